@@ -0,0 +1,289 @@
+"""本地模拟大模型服务：兼容OpenAI对话补全接口，用于离线压测与延迟测试
+
+输出由请求内容决定（相同请求得到相同结果），格式与真实模型一致（标题/正文/摘要、情节建议、段落改写）；
+支持流式输出、可配置的延迟分布以及按比例注入429/500/超时错误。
+
+    python llm_stub_server.py --port 8008 --latency lognormal:0.0,0.5 --error-rate 0.05
+    export OPENAI_API_BASE=http://127.0.0.1:8008/v1
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+sys.path.insert(0, os.path.dirname(__file__))
+
+from src.services.knowledge_packer import estimate_tokens
+
+_PATCH_LINE = re.compile(r'^段落\s*(\d+)\s*[：:]\s*(.*)$', re.M)
+
+# 生成正文使用的词句素材
+SUBJECTS = ['他', '她', '少年', '老人', '掌柜', '师父', '来客', '守卫']
+PLACES = ['城门外', '山道上', '客栈里', '长廊尽头', '河岸边', '庭院中', '集市口', '藏书阁前']
+ACTIONS = ['停下脚步', '低声说了一句', '握紧了手中的剑', '抬头望向远处', '缓缓推开木门', '转身离去', '沉默良久', '露出一丝笑意']
+SCENES = ['风吹过檐角的铜铃', '天色渐渐暗了下来', '远处传来马蹄声', '雨点落在青石板上', '灯火在夜色中摇曳', '空气里弥漫着淡淡的药香']
+TITLE_WORDS = ['夜雨', '归途', '旧约', '暗流', '重逢', '抉择', '风起', '残灯', '密信', '破晓']
+SUGGESTIONS = [
+    '让主角在关键时刻做出违背本心的选择，借此揭示其内心冲突',
+    '引入一位身份成谜的新角色，为后续情节埋下伏笔',
+    '让此前的伏笔在意外场合被揭开，迫使各方重新站队',
+    '安排一场正面冲突，让主要人物的立场彻底对立',
+    '通过一次失败让主角付出代价，推动其成长',
+]
+
+class LatencyModel:
+    """响应延迟分布：fixed:秒、uniform:下限,上限、normal:均值,标准差、lognormal:mu,sigma"""
+
+    def __init__(self, spec: str, rng: random.Random):
+        kind, _, params = spec.partition(':')
+        self.kind = kind or 'fixed'
+        self.params = [float(value) for value in params.split(',') if value] or [0.0]
+        self.rng = rng
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == 'uniform':
+                low, high = (self.params + self.params)[:2]
+                return self.rng.uniform(low, high)
+            if self.kind == 'normal':
+                mean, std = (self.params + [0.0])[:2]
+                return max(self.rng.gauss(mean, std), 0.0)
+            if self.kind == 'lognormal':
+                mu, sigma = (self.params + [0.0])[:2]
+                return self.rng.lognormvariate(mu, sigma)
+            return self.params[0]
+
+class StubCompletions:
+    """按请求内容确定性地生成回复"""
+
+    def reply(self, body: Dict[str, Any]) -> str:
+        messages = body.get('messages', [])
+        prompt = '\n'.join(str(message.get('content', '')) for message in messages)
+        seed = hashlib.sha256(json.dumps(
+            [body.get('model'), messages, body.get('temperature'), body.get('max_tokens')],
+            ensure_ascii=False, sort_keys=True
+        ).encode('utf-8')).hexdigest()
+        rng = random.Random(seed)
+        # 输出长度不超过 max_tokens（中文约1字1个token）
+        budget = int(body.get('max_tokens') or 2000)
+
+        if '段落[编号]' in prompt:
+            return self._patch(prompt, rng)
+        if '建议1' in prompt:
+            return self._suggestions(rng)
+        return self._chapter(rng, budget)
+
+    def _sentence(self, rng: random.Random) -> str:
+        return f"{rng.choice(SCENES)}，{rng.choice(SUBJECTS)}在{rng.choice(PLACES)}{rng.choice(ACTIONS)}。"
+
+    def _paragraph(self, rng: random.Random) -> str:
+        return ''.join(self._sentence(rng) for _ in range(rng.randint(3, 6)))
+
+    def _chapter(self, rng: random.Random, budget: int) -> str:
+        title = ''.join(rng.sample(TITLE_WORDS, 2))
+        target = max(min(1800, budget - 100), 50)
+        paragraphs: List[str] = []
+        while sum(len(paragraph) + 1 for paragraph in paragraphs) < target:
+            paragraphs.append(self._paragraph(rng))
+        summary = f"{rng.choice(SUBJECTS)}在{rng.choice(PLACES)}经历了{title}，故事由此转折。"
+        return f"标题：{title}\n正文：" + '\n'.join(paragraphs) + f"\n摘要：{summary}"
+
+    def _suggestions(self, rng: random.Random) -> str:
+        return '\n'.join(
+            f"建议{index + 1}：{suggestion}。" for index, suggestion in enumerate(rng.sample(SUGGESTIONS, 3))
+        )
+
+    def _patch(self, prompt: str, rng: random.Random) -> str:
+        numbers = sorted({int(number) for number, _ in _PATCH_LINE.findall(prompt)})
+        return '\n'.join(f"段落{number}：{self._paragraph(rng)}" for number in numbers)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: LatencyModel, token_delay: float, error_rate: float,
+                 errors: List[str], timeout_sleep: float, rng: random.Random):
+        super().__init__(address, StubHandler)
+        self.completions = StubCompletions()
+        self.latency = latency
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.errors = errors
+        self.timeout_sleep = timeout_sleep
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def inject_error(self) -> Optional[str]:
+        """按错误率抽取本次要注入的错误类型"""
+        with self.lock:
+            if self.errors and self.rng.random() < self.error_rate:
+                return self.rng.choice(self.errors)
+        return None
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: StubServer
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._json(200, {'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+        elif self.path.rstrip('/') == '/stats':
+            with self.server.lock:
+                self._json(200, dict(self.server.counters, in_flight=self.server.in_flight,
+                                     max_in_flight=self.server.max_in_flight))
+        else:
+            self._json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.counters['requests'] += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            error = server.inject_error()
+            if error == 'timeout':
+                # 模拟上游无响应：长时间不返回后直接断开
+                self._count('timeouts')
+                time.sleep(server.timeout_sleep)
+                self.close_connection = True
+                return
+            time.sleep(server.latency.sample())
+            if error == '429':
+                self._count('rate_limited')
+                self._json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                           headers={'Retry-After': '1'})
+                return
+            if error == '500':
+                self._count('server_errors')
+                self._json(500, {'error': {'message': 'Internal server error', 'type': 'server_error'}})
+                return
+
+            text = server.completions.reply(body)
+            if body.get('stream'):
+                self._stream(body, text)
+            else:
+                self._json(200, self._completion(body, text))
+            self._count('completed')
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如流式调用被取消）
+            self._count('disconnected')
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _completion(self, body: Dict[str, Any], text: str) -> Dict[str, Any]:
+        prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in body.get('messages', []))
+        completion_tokens = estimate_tokens(text)
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        }
+
+    def _chunks(self, text: str) -> Iterator[str]:
+        """按8个字符切分流式输出，逐块按 token_delay 计时"""
+        for start in range(0, len(text), 8):
+            yield text[start:start + 8]
+
+    def _stream(self, body: Dict[str, Any], text: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        base = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': body.get('model', 'stub')}
+        for piece in self._chunks(text):
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay * estimate_tokens(piece))
+            self._event(dict(base, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]))
+        self._event(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _event(self, data: Dict[str, Any]) -> None:
+        self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _count(self, name: str) -> None:
+        with self.server.lock:
+            self.server.counters[name] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+def create_server(host: str = '127.0.0.1', port: int = 8008, latency: str = 'fixed:0', token_delay: float = 0.0,
+                  error_rate: float = 0.0, errors: str = '429,500,timeout', timeout_sleep: float = 120.0,
+                  seed: Optional[int] = None) -> StubServer:
+    """创建模拟服务（port 为0时自动分配端口），调用 serve_forever() 启动"""
+    rng = random.Random(seed)
+    return StubServer(
+        (host, port), LatencyModel(latency, rng), token_delay, error_rate,
+        [error.strip() for error in errors.split(',') if error.strip()], timeout_sleep, rng
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟大模型服务（OpenAI兼容）')
+    parser.add_argument('--host', default=os.getenv('STUB_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('STUB_PORT', '8008')))
+    parser.add_argument('--latency', default=os.getenv('STUB_LATENCY', 'fixed:0'),
+                        help='首字节延迟分布，如 fixed:0.5、uniform:0.2,1.5、normal:0.8,0.2、lognormal:0,0.5')
+    parser.add_argument('--token-delay', type=float, default=float(os.getenv('STUB_TOKEN_DELAY', '0')),
+                        help='流式输出每个token的间隔（秒）')
+    parser.add_argument('--error-rate', type=float, default=float(os.getenv('STUB_ERROR_RATE', '0')),
+                        help='注入错误的比例（0-1）')
+    parser.add_argument('--errors', default=os.getenv('STUB_ERRORS', '429,500,timeout'),
+                        help='注入的错误类型，逗号分隔：429、500、timeout')
+    parser.add_argument('--timeout-sleep', type=float, default=float(os.getenv('STUB_TIMEOUT_SLEEP', '120')),
+                        help='timeout 错误挂起的秒数')
+    parser.add_argument('--seed', type=int, default=None, help='延迟与错误注入的随机种子')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.latency, args.token_delay, args.error_rate,
+                           args.errors, args.timeout_sleep, args.seed)
+    print(f"模拟大模型服务已启动: http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
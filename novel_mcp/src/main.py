@@ -5,7 +5,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from src.database_init import db
+from src.database_init import db, upgrade_schema
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -32,13 +32,15 @@ app.register_blueprint(mcp_bp, url_prefix='/api/mcp')
 
 # 导入模型以确保表被创建
 from src.models.user import User
-from src.models.novel import Novel, Chapter, Character, Setting, Outline
+from src.models.novel import Novel, Chapter, Character, Setting, Outline, NovelStats
+from src.models.knowledge import KnowledgeTerm, ChapterChunk, ChapterAnalysis, ParagraphFingerprint
 
 # 创建数据库目录
 os.makedirs(os.path.join(os.path.dirname(__file__), 'database'), exist_ok=True)
 
 with app.app_context():
     db.create_all()
+    upgrade_schema()
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
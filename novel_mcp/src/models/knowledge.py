@@ -0,0 +1,95 @@
+from src.database_init import db
+
+class KnowledgeTerm(db.Model):
+    """知识库倒排索引：词项 -> 实体及词频"""
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
+    term = db.Column(db.String(100), nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)  # character, setting, outline, chunk
+    entity_id = db.Column(db.Integer, nullable=False)
+    frequency = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        db.Index('ix_knowledge_term_lookup', 'novel_id', 'term'),
+        db.Index('ix_knowledge_term_entity', 'entity_type', 'entity_id'),
+        db.Index('ix_knowledge_term_novel_type', 'novel_id', 'entity_type'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'term': self.term,
+            'entity_type': self.entity_type,
+            'entity_id': self.entity_id,
+            'frequency': self.frequency
+        }
+
+class ChapterChunk(db.Model):
+    """章节切分出的段落块，用于跨章节检索"""
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False, index=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False, index=True)
+    chapter_number = db.Column(db.Integer, nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # 块在章节中的序号
+    content = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'chapter_id': self.chapter_id,
+            'chapter_number': self.chapter_number,
+            'position': self.position,
+            'content': self.content,
+            'token_count': self.token_count
+        }
+
+class ChapterAnalysis(db.Model):
+    """单章一致性分析结果（人物/设定提及、时间标记），按正文与名称集合的哈希复用"""
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False, index=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False, unique=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    names_hash = db.Column(db.String(64), nullable=False)
+    chapter_updated_at = db.Column(db.DateTime)  # 分析时章节的更新时间，未变化时无需读取正文
+    result = db.Column(db.Text, nullable=False)  # JSON
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'chapter_id': self.chapter_id,
+            'content_hash': self.content_hash,
+            'names_hash': self.names_hash,
+            'result': self.result
+        }
+
+class ParagraphFingerprint(db.Model):
+    """章节段落的64位simhash指纹，按4个16位分段建立索引用于近似重复查找"""
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)  # 段落在章节中的序号（从0开始）
+    simhash = db.Column(db.BigInteger, nullable=False)  # 以有符号64位整数存储
+    band0 = db.Column(db.Integer, nullable=False)
+    band1 = db.Column(db.Integer, nullable=False)
+    band2 = db.Column(db.Integer, nullable=False)
+    band3 = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_paragraph_fingerprint_band0', 'novel_id', 'band0'),
+        db.Index('ix_paragraph_fingerprint_band1', 'novel_id', 'band1'),
+        db.Index('ix_paragraph_fingerprint_band2', 'novel_id', 'band2'),
+        db.Index('ix_paragraph_fingerprint_band3', 'novel_id', 'band3'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'chapter_id': self.chapter_id,
+            'position': self.position,
+            'simhash': self.simhash
+        }
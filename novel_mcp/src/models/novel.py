@@ -14,6 +14,7 @@ class Novel(db.Model):
     characters = db.relationship('Character', backref='novel', lazy=True, cascade='all, delete-orphan')
     settings = db.relationship('Setting', backref='novel', lazy=True, cascade='all, delete-orphan')
     outlines = db.relationship('Outline', backref='novel', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('NovelStats', backref='novel', lazy=True, uselist=False, cascade='all, delete-orphan')
     
     def to_dict(self):
         return {
@@ -32,9 +33,16 @@ class Chapter(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     summary = db.Column(db.Text)  # 章节摘要
+    char_count = db.Column(db.Integer)  # 字符数
+    word_count = db.Column(db.Integer)  # 字数（中文按字、英文按词）
+    token_signature = db.Column(db.LargeBinary)  # 词项签名（有序哈希ID数组）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_chapter_novel_number', 'novel_id', 'chapter_number'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -43,6 +51,8 @@ class Chapter(db.Model):
             'title': self.title,
             'content': self.content,
             'summary': self.summary,
+            'char_count': self.char_count,
+            'word_count': self.word_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -52,10 +62,12 @@ class Character(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
+    aliases = db.Column(db.Text)  # 别名，以逗号分隔
     description = db.Column(db.Text)
     personality = db.Column(db.Text)
     background = db.Column(db.Text)
     relationships = db.Column(db.Text)  # 人物关系
+    token_signature = db.Column(db.LargeBinary)  # 词项签名（有序哈希ID数组）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -64,6 +76,7 @@ class Character(db.Model):
             'id': self.id,
             'novel_id': self.novel_id,
             'name': self.name,
+            'aliases': self.aliases,
             'description': self.description,
             'personality': self.personality,
             'background': self.background,
@@ -77,8 +90,10 @@ class Setting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
+    aliases = db.Column(db.Text)  # 别名，以逗号分隔
     type = db.Column(db.String(50))  # 地点、物品、规则等
     description = db.Column(db.Text)
+    token_signature = db.Column(db.LargeBinary)  # 词项签名（有序哈希ID数组）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -87,6 +102,7 @@ class Setting(db.Model):
             'id': self.id,
             'novel_id': self.novel_id,
             'name': self.name,
+            'aliases': self.aliases,
             'type': self.type,
             'description': self.description,
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -101,6 +117,7 @@ class Outline(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     status = db.Column(db.String(20), default='planned')  # planned, writing, completed
+    token_signature = db.Column(db.LargeBinary)  # 词项签名（有序哈希ID数组）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -116,3 +133,29 @@ class Outline(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+
+class NovelStats(db.Model):
+    """小说统计信息（随写入同步维护）"""
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), primary_key=True)
+    chapter_count = db.Column(db.Integer, nullable=False, default=0)
+    character_count = db.Column(db.Integer, nullable=False, default=0)
+    setting_count = db.Column(db.Integer, nullable=False, default=0)
+    outline_count = db.Column(db.Integer, nullable=False, default=0)
+    total_chars = db.Column(db.Integer, nullable=False, default=0)
+    total_word_count = db.Column(db.Integer, nullable=False, default=0)
+    latest_chapter_id = db.Column(db.Integer)
+    latest_chapter_number = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'novel_id': self.novel_id,
+            'chapter_count': self.chapter_count,
+            'character_count': self.character_count,
+            'setting_count': self.setting_count,
+            'outline_count': self.outline_count,
+            'total_chars': self.total_chars,
+            'total_word_count': self.total_word_count,
+            'latest_chapter_id': self.latest_chapter_id,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
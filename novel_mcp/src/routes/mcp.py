@@ -1,12 +1,26 @@
-from flask import Blueprint, jsonify, request
+import json
+import os
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from src.models.novel import Novel, Chapter, Character, Setting, Outline
 from src.database_init import db
 from src.services.knowledge_manager import KnowledgeManager
+from src.services.knowledge_cache import knowledge_cache
 from src.services.writing_assistant import WritingAssistant
 from src.services.content_reviewer import ContentReviewer
+from src.services.llm_client import llm_client
+from src.services.llm_cache import llm_cache
+from src.services.candidate_generator import CandidateGenerator
+from src.services.single_flight import single_flight
+from src.services.deadline import Deadline, DeadlineExceeded
+from src.services.model_router import model_router
 
 mcp_bp = Blueprint('mcp', __name__)
 
+# 并行候选数量上限
+MAX_CANDIDATES = int(os.getenv('MAX_CANDIDATES', '5'))
+# 批量审核时每次从数据库读取的章节数
+REVIEW_BATCH_SIZE = int(os.getenv('REVIEW_BATCH_SIZE', '50'))
+
 @mcp_bp.route('/generate-chapter', methods=['POST'])
 def generate_chapter():
     """生成新章节"""
@@ -16,34 +30,54 @@ def generate_chapter():
         context = data['context']
         requirements = data.get('requirements', '')
         
-        # 初始化各个智能体
+        # 本次请求的截止时间（deadline 秒，未指定时使用接口默认值），沿调用链传递
+        deadline = Deadline.for_endpoint('generate-chapter', data.get('deadline'))
+        
+        # 初始化各个智能体（no_cache 为真时本次请求不使用响应缓存）
         knowledge_manager = KnowledgeManager()
-        writing_assistant = WritingAssistant()
-        content_reviewer = ContentReviewer()
+        writing_assistant = WritingAssistant(use_cache=not data.get('no_cache', False), deadline=deadline)
+        content_reviewer = ContentReviewer(deadline=deadline)
         
-        # 获取相关知识
-        knowledge = knowledge_manager.get_relevant_knowledge(novel_id, context)
+        # 获取相关知识（各阶段按自己的模型与提示词在上下文预算内裁剪）
+        knowledge = knowledge_manager.get_relevant_knowledge(novel_id, context, deadline=deadline)
         
-        # 生成内容
-        generated_content = writing_assistant.generate_content(
-            knowledge=knowledge,
-            context=context,
-            requirements=requirements
-        )
+        # candidates 大于1时并行生成多个候选并择优，否则串行生成
+        candidate_count = min(int(data.get('candidates', 1)), MAX_CANDIDATES)
+        candidates = None
+        review_result = None
+        if candidate_count > 1:
+            candidates = CandidateGenerator(writing_assistant, content_reviewer, candidate_count).generate(
+                knowledge=knowledge,
+                context=context,
+                requirements=requirements
+            )
+            generated_content = candidates.pop('content')
+            review_result = candidates.pop('review_result')
         
-        # 审核内容
-        review_result = content_reviewer.review_content(
-            content=generated_content,
-            knowledge=knowledge
-        )
+        # 串行生成；并行候选在截止时间内都未完成时同样走这里（已超时则返回默认内容）
+        if review_result is None:
+            # 生成内容
+            generated_content = writing_assistant.generate_content(
+                knowledge=knowledge,
+                context=context,
+                requirements=requirements
+            )
+            
+            # 审核内容
+            review_result = content_reviewer.review_content(
+                content=generated_content,
+                knowledge=knowledge
+            )
         
-        # 如果审核不通过，进行迭代优化
+        # 如果审核不通过，在截止时间内进行迭代优化
         iterations = 1
-        while not review_result['approved'] and iterations < 3:
+        while not review_result['approved'] and iterations < 3 and not deadline.expired():
             generated_content = writing_assistant.improve_content(
                 content=generated_content,
                 feedback=review_result['feedback'],
-                knowledge=knowledge
+                knowledge=knowledge,
+                # 只有未通过的检查都能靠改写问题段落修复时才局部改写
+                issue_locations=review_result['issue_locations'] if review_result.get('patchable') else None
             )
             review_result = content_reviewer.review_content(
                 content=generated_content,
@@ -56,29 +90,210 @@ def generate_chapter():
             'content': generated_content,
             'review_result': review_result,
             'iterations': iterations,
-            'knowledge_used': knowledge
+            'knowledge_used': knowledge,
+            'packing_report': writing_assistant.packing_reports,
+            'prompt_stats': writing_assistant.prompt_stats,
+            'candidates': candidates,
+            'deadline': deadline.report()
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _sse(event: str, data) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@mcp_bp.route('/generate-chapter/stream', methods=['POST'])
+def generate_chapter_stream():
+    """流式生成新章节（Server-Sent Events）：边生成边推送正文，最后推送审核结果"""
+    try:
+        data = request.json
+        novel_id = data['novel_id']
+        context = data['context']
+        requirements = data.get('requirements', '')
+        use_cache = not data.get('no_cache', False)
+        deadline = Deadline.for_endpoint('generate-chapter', data.get('deadline'))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        try:
+            knowledge_manager = KnowledgeManager()
+            writing_assistant = WritingAssistant(use_cache=use_cache, deadline=deadline)
+            content_reviewer = ContentReviewer(deadline=deadline)
+            
+            knowledge = knowledge_manager.get_relevant_knowledge(novel_id, context, deadline=deadline)
+            
+            # 逐段推送知识打包报告与模型输出
+            generated_content = None
+            for event in writing_assistant.stream_content(knowledge=knowledge, context=context, requirements=requirements):
+                if event['type'] == 'content':
+                    generated_content = event['content']
+                    yield _sse('content', generated_content)
+                else:
+                    yield _sse(event['type'], {key: value for key, value in event.items() if key != 'type'})
+            
+            # 审核与迭代优化，与非流式接口一致
+            review_result = content_reviewer.review_content(content=generated_content, knowledge=knowledge)
+            iterations = 1
+            while not review_result['approved'] and iterations < 3 and not deadline.expired():
+                generated_content = writing_assistant.improve_content(
+                    content=generated_content,
+                    feedback=review_result['feedback'],
+                    knowledge=knowledge,
+                    # 只有未通过的检查都能靠改写问题段落修复时才局部改写
+                    issue_locations=review_result['issue_locations'] if review_result.get('patchable') else None
+                )
+                review_result = content_reviewer.review_content(content=generated_content, knowledge=knowledge)
+                iterations += 1
+            
+            yield _sse('review', {
+                'content': generated_content,
+                'review_result': review_result,
+                'iterations': iterations,
+                'packing_report': writing_assistant.packing_reports,
+                'prompt_stats': writing_assistant.prompt_stats,
+                'deadline': deadline.report()
+            })
+            yield _sse('done', {'success': True})
+            
+        except Exception as e:
+            yield _sse('error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @mcp_bp.route('/analyze-consistency', methods=['POST'])
 def analyze_consistency():
     """分析内容一致性"""
     try:
         data = request.json
         novel_id = data['novel_id']
+        deadline = Deadline.for_endpoint('analyze-consistency', data.get('deadline'))
+        if db.session.get(Novel, novel_id) is None:
+            return jsonify({'error': f"小说ID {novel_id} 不存在"}), 404
         
-        content_reviewer = ContentReviewer()
-        consistency_report = content_reviewer.analyze_consistency(novel_id)
+        # 同一小说的并发分析请求合并为一次（合并的请求共享执行方的截止时间）
+        def analyze():
+            content_reviewer = ContentReviewer(deadline=deadline)
+            return {
+                'success': True,
+                'consistency_report': content_reviewer.analyze_consistency(novel_id),
+                'deadline': deadline.report()
+            }
         
-        return jsonify({
-            'success': True,
-            'consistency_report': consistency_report
-        })
+        result, coalesced = single_flight.do(
+            single_flight.fingerprint('analyze-consistency', {'novel_id': novel_id}), analyze
+        )
+        return jsonify(dict(result, coalesced=coalesced))
+        
+    except DeadlineExceeded as e:
+        return jsonify({'error': str(e), 'deadline': deadline.report()}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@mcp_bp.route('/review-batch', methods=['POST'])
+def review_batch():
+    """批量重新审核已有章节，以NDJSON逐行返回每章结果，最后一行为汇总"""
+    try:
+        data = request.json
+        novel_id = data['novel_id']
+        # chapter_ids 指定章节ID列表，chapter_range 指定ID闭区间 [起, 止]，都未提供时审核全部章节
+        chapter_ids = data.get('chapter_ids')
+        chapter_range = data.get('chapter_range')
+        deadline = Deadline.for_endpoint('review-batch', data.get('deadline'))
         
+        # 知识只获取一次，所有章节共用
+        novel_knowledge = KnowledgeManager().get_novel_knowledge(novel_id)
+        knowledge = {
+            'novel': dict(novel_knowledge.novel),
+            'characters': list(novel_knowledge.entities['character'].values()),
+            'settings': list(novel_knowledge.entities['setting'].values())
+        }
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        content_reviewer = ContentReviewer(deadline=deadline)
+        reviewed = approved = 0
+        total_score = 0.0
+        try:
+            for chapter in _iter_chapters(novel_id, chapter_ids, chapter_range):
+                if deadline.expired():
+                    deadline.record_exceeded('review_batch')
+                    break
+                review_result = content_reviewer.review_content(
+                    content={
+                        'chapter_id': chapter.id,
+                        'title': chapter.title,
+                        'content': chapter.content,
+                        'summary': chapter.summary or ''
+                    },
+                    knowledge=knowledge
+                )
+                reviewed += 1
+                approved += 1 if review_result['approved'] else 0
+                total_score += review_result['overall_score']
+                yield json.dumps({
+                    'type': 'chapter',
+                    'chapter_id': chapter.id,
+                    'chapter_number': chapter.chapter_number,
+                    'title': chapter.title,
+                    'approved': review_result['approved'],
+                    'overall_score': review_result['overall_score'],
+                    'detailed_scores': review_result['detailed_scores'],
+                    'feedback': review_result['feedback'],
+                    'issues': review_result['issues']
+                }, ensure_ascii=False) + '\n'
+            
+            yield json.dumps({
+                'type': 'summary',
+                'success': True,
+                'reviewed': reviewed,
+                'approved': approved,
+                'average_score': total_score / reviewed if reviewed else 0.0,
+                'deadline': deadline.report()
+            }, ensure_ascii=False) + '\n'
+            
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _iter_chapters(novel_id: int, chapter_ids=None, chapter_range=None):
+    """按章节ID顺序分批读取章节（只取审核所需的列，不加载ORM对象），内存占用与章节总数无关"""
+    def query():
+        return db.session.query(
+            Chapter.id, Chapter.chapter_number, Chapter.title, Chapter.content, Chapter.summary
+        ).filter(Chapter.novel_id == novel_id)
+    
+    if chapter_ids is not None:
+        # 指定ID列表时按ID分段查询，同时避免超出SQLite参数个数上限
+        wanted = sorted(set(chapter_ids))
+        for start in range(0, len(wanted), REVIEW_BATCH_SIZE):
+            batch = query().filter(Chapter.id.in_(wanted[start:start + REVIEW_BATCH_SIZE])).order_by(Chapter.id).all()
+            # 每批读取后结束只读事务，不长时间占用数据库快照
+            db.session.commit()
+            yield from batch
+        return
+    
+    last_id = None
+    while True:
+        batch_query = query()
+        if chapter_range:
+            batch_query = batch_query.filter(Chapter.id >= chapter_range[0], Chapter.id <= chapter_range[1])
+        if last_id is not None:
+            batch_query = batch_query.filter(Chapter.id > last_id)
+        batch = batch_query.order_by(Chapter.id).limit(REVIEW_BATCH_SIZE).all()
+        db.session.commit()
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1].id
 
 @mcp_bp.route('/update-knowledge', methods=['POST'])
 def update_knowledge():
@@ -124,24 +339,56 @@ def suggest_next_plot():
         data = request.json
         novel_id = data['novel_id']
         current_context = data['current_context']
+        use_cache = not data.get('no_cache', False)
+        deadline = Deadline.for_endpoint('suggest-next-plot', data.get('deadline'))
         
-        knowledge_manager = KnowledgeManager()
-        writing_assistant = WritingAssistant()
-        
-        # 获取相关知识
-        knowledge = knowledge_manager.get_relevant_knowledge(novel_id, current_context)
+        def suggest():
+            knowledge_manager = KnowledgeManager()
+            writing_assistant = WritingAssistant(use_cache=use_cache, deadline=deadline)
+            
+            # 获取相关知识
+            knowledge = knowledge_manager.get_relevant_knowledge(novel_id, current_context, deadline=deadline)
+            
+            # 生成情节建议
+            suggestions = writing_assistant.suggest_plot_development(
+                knowledge=knowledge,
+                current_context=current_context
+            )
+            
+            return {
+                'success': True,
+                'suggestions': suggestions,
+                'packing_report': writing_assistant.packing_reports.get('suggest'),
+                'prompt_stats': writing_assistant.prompt_stats,
+                'deadline': deadline.report()
+            }
         
-        # 生成情节建议
-        suggestions = writing_assistant.suggest_plot_development(
-            knowledge=knowledge,
-            current_context=current_context
+        # 参数相同的并发请求只查询和调用模型一次
+        result, coalesced = single_flight.do(
+            single_flight.fingerprint('suggest-next-plot', {
+                'novel_id': novel_id,
+                'current_context': current_context.strip(),
+                'use_cache': use_cache
+            }),
+            suggest
         )
-        
-        return jsonify({
-            'success': True,
-            'suggestions': suggestions
-        })
+        return jsonify(dict(result, coalesced=coalesced))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@mcp_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """获取缓存等运行指标"""
+    return jsonify({
+        'success': True,
+        'metrics': {
+            'knowledge_cache': knowledge_cache.stats(),
+            'llm_client': llm_client.stats(),
+            'model_router': model_router.stats(),
+            'llm_cache': llm_cache.stats(),
+            'single_flight': single_flight.stats(),
+            'deadlines': Deadline.stats()
+        }
+    })
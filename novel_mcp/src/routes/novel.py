@@ -1,15 +1,45 @@
 from flask import Blueprint, jsonify, request
 from src.models.novel import Novel, Chapter, Character, Setting, Outline
 from src.database_init import db
+from src.services.knowledge_index import KnowledgeIndex
+from src.services.novel_stats import NovelStatistics
+from src.services.vector_index import vector_index
+from src.services.chapter_analyzer import ChapterAnalyzer
+from src.services.simhash_index import simhash_index
+from src.services.pagination import ListQuery, PaginationError
 
 novel_bp = Blueprint('novel', __name__)
 
+# 列表接口的排序键（游标分页按此续读）
+novel_list = ListQuery(Novel)
+chapter_list = ListQuery(Chapter, order_by=('chapter_number', 'id'))
+character_list = ListQuery(Character)
+setting_list = ListQuery(Setting)
+outline_list = ListQuery(Outline, order_by=('section_number', 'id'))
+
+def _list_response(list_query: ListQuery, **filters):
+    """列表响应：提供limit或cursor时返回分页结构，否则保持原来的完整数组；fields参数只查询指定的列"""
+    limit = request.args.get('limit', type=int)
+    if 'limit' in request.args and (limit is None or limit < 1):
+        return jsonify({'error': 'limit参数必须是正整数'}), 400
+    try:
+        page = list_query.fetch(
+            filters,
+            fields=request.args.get('fields'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    if 'limit' in request.args or 'cursor' in request.args:
+        return jsonify(page)
+    return jsonify(page['items'])
+
 # 小说管理
 @novel_bp.route('/novels', methods=['GET'])
 def get_novels():
     """获取所有小说"""
-    novels = Novel.query.all()
-    return jsonify([novel.to_dict() for novel in novels])
+    return _list_response(novel_list)
 
 @novel_bp.route('/novels', methods=['POST'])
 def create_novel():
@@ -20,6 +50,8 @@ def create_novel():
         description=data.get('description', '')
     )
     db.session.add(novel)
+    db.session.flush()
+    NovelStatistics().create(novel.id)
     db.session.commit()
     return jsonify(novel.to_dict()), 201
 
@@ -43,16 +75,19 @@ def update_novel(novel_id):
 def delete_novel(novel_id):
     """删除小说"""
     novel = Novel.query.get_or_404(novel_id)
+    KnowledgeIndex().remove_novel(novel_id)
+    ChapterAnalyzer().remove_novel(novel_id)
+    simhash_index.remove_novel(novel_id)
     db.session.delete(novel)
     db.session.commit()
+    vector_index.remove(novel_id)
     return '', 204
 
 # 章节管理
 @novel_bp.route('/novels/<int:novel_id>/chapters', methods=['GET'])
 def get_chapters(novel_id):
     """获取小说的所有章节"""
-    chapters = Chapter.query.filter_by(novel_id=novel_id).order_by(Chapter.chapter_number).all()
-    return jsonify([chapter.to_dict() for chapter in chapters])
+    return _list_response(chapter_list, novel_id=novel_id)
 
 @novel_bp.route('/novels/<int:novel_id>/chapters', methods=['POST'])
 def create_chapter(novel_id):
@@ -66,6 +101,10 @@ def create_chapter(novel_id):
         summary=data.get('summary', '')
     )
     db.session.add(chapter)
+    db.session.flush()
+    simhash_index.index_chapter(chapter, force=True)
+    KnowledgeIndex().index_chapter(chapter)
+    NovelStatistics().chapter_added(chapter)
     db.session.commit()
     return jsonify(chapter.to_dict()), 201
 
@@ -83,6 +122,10 @@ def update_chapter(chapter_id):
     chapter.title = data.get('title', chapter.title)
     chapter.content = data.get('content', chapter.content)
     chapter.summary = data.get('summary', chapter.summary)
+    # 段落指纹先于知识索引更新（后者会flush并清除正文的变更记录）
+    simhash_index.index_chapter(chapter)
+    KnowledgeIndex().index_chapter(chapter)
+    NovelStatistics().chapter_updated(chapter)
     db.session.commit()
     return jsonify(chapter.to_dict())
 
@@ -90,7 +133,11 @@ def update_chapter(chapter_id):
 def delete_chapter(chapter_id):
     """删除章节"""
     chapter = Chapter.query.get_or_404(chapter_id)
+    KnowledgeIndex().remove_chapter(chapter_id)
+    ChapterAnalyzer().remove_chapter(chapter_id)
+    simhash_index.remove_chapter(chapter_id)
     db.session.delete(chapter)
+    NovelStatistics().chapter_removed(chapter)
     db.session.commit()
     return '', 204
 
@@ -98,8 +145,7 @@ def delete_chapter(chapter_id):
 @novel_bp.route('/novels/<int:novel_id>/characters', methods=['GET'])
 def get_characters(novel_id):
     """获取小说的所有人物"""
-    characters = Character.query.filter_by(novel_id=novel_id).all()
-    return jsonify([character.to_dict() for character in characters])
+    return _list_response(character_list, novel_id=novel_id)
 
 @novel_bp.route('/novels/<int:novel_id>/characters', methods=['POST'])
 def create_character(novel_id):
@@ -108,12 +154,16 @@ def create_character(novel_id):
     character = Character(
         novel_id=novel_id,
         name=data['name'],
+        aliases=data.get('aliases', ''),
         description=data.get('description', ''),
         personality=data.get('personality', ''),
         background=data.get('background', ''),
         relationships=data.get('relationships', '')
     )
     db.session.add(character)
+    db.session.flush()
+    KnowledgeIndex().index_entity(character)
+    NovelStatistics().entity_added('character', novel_id)
     db.session.commit()
     return jsonify(character.to_dict()), 201
 
@@ -123,10 +173,12 @@ def update_character(character_id):
     character = Character.query.get_or_404(character_id)
     data = request.json
     character.name = data.get('name', character.name)
+    character.aliases = data.get('aliases', character.aliases)
     character.description = data.get('description', character.description)
     character.personality = data.get('personality', character.personality)
     character.background = data.get('background', character.background)
     character.relationships = data.get('relationships', character.relationships)
+    KnowledgeIndex().index_entity(character)
     db.session.commit()
     return jsonify(character.to_dict())
 
@@ -134,7 +186,9 @@ def update_character(character_id):
 def delete_character(character_id):
     """删除人物"""
     character = Character.query.get_or_404(character_id)
+    KnowledgeIndex().remove_entity('character', character_id)
     db.session.delete(character)
+    NovelStatistics().entity_removed('character', character.novel_id)
     db.session.commit()
     return '', 204
 
@@ -142,8 +196,7 @@ def delete_character(character_id):
 @novel_bp.route('/novels/<int:novel_id>/settings', methods=['GET'])
 def get_settings(novel_id):
     """获取小说的所有世界观设定"""
-    settings = Setting.query.filter_by(novel_id=novel_id).all()
-    return jsonify([setting.to_dict() for setting in settings])
+    return _list_response(setting_list, novel_id=novel_id)
 
 @novel_bp.route('/novels/<int:novel_id>/settings', methods=['POST'])
 def create_setting(novel_id):
@@ -152,10 +205,14 @@ def create_setting(novel_id):
     setting = Setting(
         novel_id=novel_id,
         name=data['name'],
+        aliases=data.get('aliases', ''),
         type=data.get('type', ''),
         description=data.get('description', '')
     )
     db.session.add(setting)
+    db.session.flush()
+    KnowledgeIndex().index_entity(setting)
+    NovelStatistics().entity_added('setting', novel_id)
     db.session.commit()
     return jsonify(setting.to_dict()), 201
 
@@ -165,8 +222,10 @@ def update_setting(setting_id):
     setting = Setting.query.get_or_404(setting_id)
     data = request.json
     setting.name = data.get('name', setting.name)
+    setting.aliases = data.get('aliases', setting.aliases)
     setting.type = data.get('type', setting.type)
     setting.description = data.get('description', setting.description)
+    KnowledgeIndex().index_entity(setting)
     db.session.commit()
     return jsonify(setting.to_dict())
 
@@ -174,7 +233,9 @@ def update_setting(setting_id):
 def delete_setting(setting_id):
     """删除世界观设定"""
     setting = Setting.query.get_or_404(setting_id)
+    KnowledgeIndex().remove_entity('setting', setting_id)
     db.session.delete(setting)
+    NovelStatistics().entity_removed('setting', setting.novel_id)
     db.session.commit()
     return '', 204
 
@@ -182,8 +243,7 @@ def delete_setting(setting_id):
 @novel_bp.route('/novels/<int:novel_id>/outlines', methods=['GET'])
 def get_outlines(novel_id):
     """获取小说的所有大纲"""
-    outlines = Outline.query.filter_by(novel_id=novel_id).order_by(Outline.section_number).all()
-    return jsonify([outline.to_dict() for outline in outlines])
+    return _list_response(outline_list, novel_id=novel_id)
 
 @novel_bp.route('/novels/<int:novel_id>/outlines', methods=['POST'])
 def create_outline(novel_id):
@@ -197,6 +257,9 @@ def create_outline(novel_id):
         status=data.get('status', 'planned')
     )
     db.session.add(outline)
+    db.session.flush()
+    KnowledgeIndex().index_entity(outline)
+    NovelStatistics().entity_added('outline', novel_id)
     db.session.commit()
     return jsonify(outline.to_dict()), 201
 
@@ -208,6 +271,7 @@ def update_outline(outline_id):
     outline.title = data.get('title', outline.title)
     outline.content = data.get('content', outline.content)
     outline.status = data.get('status', outline.status)
+    KnowledgeIndex().index_entity(outline)
     db.session.commit()
     return jsonify(outline.to_dict())
 
@@ -215,7 +279,9 @@ def update_outline(outline_id):
 def delete_outline(outline_id):
     """删除大纲"""
     outline = Outline.query.get_or_404(outline_id)
+    KnowledgeIndex().remove_entity('outline', outline_id)
     db.session.delete(outline)
+    NovelStatistics().entity_removed('outline', outline.novel_id)
     db.session.commit()
     return '', 204
 
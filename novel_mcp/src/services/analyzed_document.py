@@ -0,0 +1,71 @@
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.services.name_matcher import NameMatcher
+from src.services.simhash import simhash
+
+_PARAGRAPH = re.compile(r'[^\n]+')
+_SENTENCE_SPLIT = re.compile(r'[。！？]')
+_CLAUSE_SPLIT = re.compile(r'[。！？!?，,；;：:]')
+
+def paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    """正文中各段落（非空行）的起止位置"""
+    return [
+        (match.start(), match.end())
+        for match in _PARAGRAPH.finditer(text or '')
+        if match.group().strip()
+    ]
+
+class Paragraph:
+    """草稿中的一个段落"""
+
+    __slots__ = ('index', 'start', 'end', 'text', 'clauses', 'fingerprint')
+
+    def __init__(self, index: int, start: int, end: int, text: str):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.text = text
+        # 按句读切分的分句，用于重复检测
+        self.clauses = [clause.strip() for clause in _CLAUSE_SPLIT.split(text) if clause.strip()]
+        # simhash指纹，用于跨章节的近似重复检测（过短的段落为None）
+        self.fingerprint = simhash(text)
+
+class AnalyzedDocument:
+    """一份草稿的共享分析结果：构建时扫描一次正文，各项审核检查只读取其中的字段"""
+
+    def __init__(self, content: Dict[str, str], matcher: Optional[NameMatcher] = None):
+        self.title = content.get('title', '') or ''
+        self.text = content.get('content', '') or ''
+        self.summary = content.get('summary', '') or ''
+        # 审核已保存的章节时排除其自身的段落
+        self.chapter_id = content.get('chapter_id')
+        self.normalized = self.text.lower()
+        self.length = len(self.text)
+
+        self.paragraphs = [
+            Paragraph(index, start, end, self.text[start:end].strip())
+            for index, (start, end) in enumerate(paragraph_spans(self.text))
+        ]
+        # 以空行分隔的段落块数与按句末标点切分的句子
+        self.block_count = len(self.text.split('\n\n'))
+        self.sentences = _SENTENCE_SPLIT.split(self.text)
+
+        # 人物与设定的提及（未提供匹配器时为空，例如已超过截止时间）
+        self.mentions: List[Dict[str, Any]] = matcher.find_all(self.text) if matcher is not None else []
+        self.mentioned_entities: Set[Tuple[str, int]] = {
+            (mention['entity_type'], mention['entity_id']) for mention in self.mentions
+        }
+        # 段落级问题（由审核在首次需要时填充，评分与局部改写共用）
+        self.issue_locations: Optional[List[Dict[str, Any]]] = None
+
+    def stats(self) -> Dict[str, Any]:
+        """长度统计"""
+        sentence_lengths = [len(sentence) for sentence in self.sentences if sentence.strip()]
+        return {
+            'length': self.length,
+            'paragraphs': len(self.paragraphs),
+            'sentences': len(sentence_lengths),
+            'max_paragraph_length': max((len(paragraph.text) for paragraph in self.paragraphs), default=0),
+            'avg_sentence_length': sum(sentence_lengths) / len(sentence_lengths) if sentence_lengths else 0.0,
+            'mentions': len(self.mentions)
+        }
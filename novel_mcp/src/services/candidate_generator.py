@@ -0,0 +1,117 @@
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+from flask import current_app
+from src.services.writing_assistant import WritingAssistant
+from src.services.content_reviewer import ContentReviewer
+
+# 进程内共享的线程池，避免每次请求创建线程
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CANDIDATE_WORKERS', '8')),
+    thread_name_prefix='candidate'
+)
+
+class CandidateGenerator:
+    """并行生成多个候选章节，审核打分后择优；任一候选通过审核即返回并取消其余候选"""
+
+    # 各候选使用不同的温度，保证结果多样（也使响应缓存键互不相同）
+    BASE_TEMPERATURE = 0.7
+    TEMPERATURE_STEP = 0.1
+    MAX_TEMPERATURE = 1.2
+
+    def __init__(self, writing_assistant: WritingAssistant, content_reviewer: ContentReviewer, count: int = 3):
+        self.writing_assistant = writing_assistant
+        self.content_reviewer = content_reviewer
+        self.count = max(1, count)
+
+    def generate(self, knowledge: Dict[str, Any], context: str, requirements: str = "") -> Dict[str, Any]:
+        """返回选中的候选内容、审核结果及各候选的得分概况"""
+        app = current_app._get_current_object()
+        cancelled = threading.Event()
+        futures = {
+            _executor.submit(self._run, app, index, knowledge, context, requirements, cancelled): index
+            for index in range(self.count)
+        }
+
+        results: List[Dict[str, Any]] = []
+        selected: Optional[Dict[str, Any]] = None
+        pending = set(futures)
+        deadline = self.writing_assistant.deadline
+        while pending and selected is None:
+            done, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                # 超过截止时间：停止等待，在已完成的候选中择优
+                deadline.record_exceeded('candidates')
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"生成候选内容时出错: {e}")
+                    continue
+                if result is None:
+                    continue
+                results.append(result)
+                if result['review_result']['approved'] and (
+                    selected is None or result['review_result']['overall_score'] > selected['review_result']['overall_score']
+                ):
+                    selected = result
+
+        # 已有候选通过审核（或已超时）：取消尚未开始的任务，正在生成的任务在下一段输出时停止
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+        if selected is None and results:
+            selected = max(results, key=lambda result: (result['review_result']['overall_score'], -result['index']))
+        if selected:
+            # 各候选使用独立的写作助手，选中候选的统计合并回请求的写作助手
+            self.writing_assistant.prompt_stats.update(selected['assistant'].prompt_stats)
+            self.writing_assistant.packing_reports.update(selected['assistant'].packing_reports)
+
+        return {
+            'content': selected['content'] if selected else None,
+            'review_result': selected['review_result'] if selected else None,
+            'selected': selected['index'] if selected else None,
+            'early_return': bool(pending),
+            'candidates': [
+                {
+                    'index': result['index'],
+                    'temperature': result['temperature'],
+                    'approved': result['review_result']['approved'],
+                    'overall_score': result['review_result']['overall_score']
+                }
+                for result in sorted(results, key=lambda result: result['index'])
+            ]
+        }
+
+    def _run(self, app, index: int, knowledge: Dict[str, Any], context: str, requirements: str,
+             cancelled: threading.Event) -> Optional[Dict[str, Any]]:
+        """生成并审核单个候选；被取消时关闭流式调用并返回None"""
+        temperature = round(min(self.BASE_TEMPERATURE + self.TEMPERATURE_STEP * index, self.MAX_TEMPERATURE), 2)
+        # 写作助手记录每次调用的统计，各候选线程不共享同一个实例
+        assistant = self.writing_assistant.fork()
+        with app.app_context():
+            content = None
+            events = assistant.stream_content(
+                knowledge=knowledge, context=context, requirements=requirements, temperature=temperature
+            )
+            try:
+                for event in events:
+                    if cancelled.is_set():
+                        return None
+                    if event['type'] == 'content':
+                        content = event['content']
+            finally:
+                events.close()
+
+            if cancelled.is_set() or content is None:
+                return None
+            return {
+                'index': index,
+                'temperature': temperature,
+                'content': content,
+                'review_result': self.content_reviewer.review_content(content=content, knowledge=knowledge),
+                'assistant': assistant
+            }
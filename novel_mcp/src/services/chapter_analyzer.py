@@ -0,0 +1,241 @@
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.models.novel import Chapter
+from src.models.knowledge import ChapterAnalysis
+from src.database_init import db
+from src.services.knowledge_manager import KnowledgeManager
+from src.services.name_matcher import NameMatcher, entity_names
+
+# SQLite单条语句的参数个数有限，分批读取正文
+_QUERY_BATCH_SIZE = 500
+
+# 待分析章节数达到阈值时分发到进程池，工作进程按章节ID直接读取SQLite
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', str(os.cpu_count() or 1)))
+ANALYSIS_PARALLEL_MIN = int(os.getenv('ANALYSIS_PARALLEL_MIN', '64'))
+
+_NUMBER = r'[0-9]+|[零一二两三四五六七八九十百千]+'
+# 时间标记：向后推进、向前回溯、明确的第N天
+_FORWARD_MARKER = re.compile(rf'次日|翌日|第二天|隔天|当晚|(?:{_NUMBER}|几|数)(?:天|日|个月|月|年|周|个星期)(?:之)?后')
+_BACKWARD_MARKER = re.compile(rf'昨天|昨日|前一天|多年前|当年|回想起|回忆起|(?:{_NUMBER}|几|数)(?:天|日|个月|年|周)(?:之)?前')
+_DAY_MARKER = re.compile(rf'第({_NUMBER})天')
+_CN_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+
+def parse_number(text: str) -> Optional[int]:
+    """解析阿拉伯数字或简单的中文数字（如 十二、二十、一百零五）"""
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, None
+    for char in text:
+        if char in _CN_DIGITS:
+            digit = _CN_DIGITS[char]
+        elif char in _CN_UNITS:
+            total += (digit if digit is not None else 1) * _CN_UNITS[char]
+            digit = None
+        else:
+            return None
+    return total + (digit or 0)
+
+def names_hash(names: List[Tuple[str, str, int]]) -> str:
+    """名称集合的哈希：人物或设定名称变化后需要重新分析提及"""
+    return hashlib.sha256(json.dumps(sorted(names), ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+def analyze_chapter_text(text: str, matcher: NameMatcher) -> Dict[str, Any]:
+    """单章分析：人物与设定的提及次数、时间标记及明确的天数"""
+    text = text or ''
+    mentions: Dict[str, Dict[int, int]] = {'character': {}, 'setting': {}}
+    for mention in matcher.find_all(text):
+        counts = mentions[mention['entity_type']]
+        counts[mention['entity_id']] = counts.get(mention['entity_id'], 0) + 1
+
+    markers = [
+        (match.start(), kind, match.group())
+        for kind, pattern in (('forward', _FORWARD_MARKER), ('backward', _BACKWARD_MARKER))
+        for match in pattern.finditer(text)
+    ]
+    days = [parse_number(match.group(1)) for match in _DAY_MARKER.finditer(text)]
+
+    return {
+        'characters': sorted(mentions['character'].items()),
+        'settings': sorted(mentions['setting'].items()),
+        'temporal_markers': [{'marker': marker, 'kind': kind} for _, kind, marker in sorted(markers)],
+        'day_numbers': [day for day in days if day is not None],
+        'flashback': any(kind == 'backward' for _, kind, _ in markers)
+    }
+
+def analyze_chapters(rows: Iterable[Tuple[int, str]], known_hashes: Dict[int, str],
+                     matcher: NameMatcher) -> List[Tuple[int, str, Optional[str]]]:
+    """分析一批章节，返回 (章节ID, 正文哈希, 分析结果JSON)；正文哈希与已存结果一致时结果为None"""
+    results = []
+    for chapter_id, text in rows:
+        digest = content_hash(text)
+        result = None
+        if known_hashes.get(chapter_id) != digest:
+            result = json.dumps(analyze_chapter_text(text, matcher), ensure_ascii=False)
+        results.append((chapter_id, digest, result))
+    return results
+
+# 工作进程内按名称哈希缓存的匹配器
+_worker_matcher: Optional[Tuple[str, NameMatcher]] = None
+
+def _analyze_worker(database: str, chapter_ids: List[int], known_hashes: Dict[int, str],
+                    names: List[Tuple[str, str, int]], names_digest: str) -> List[Tuple[int, str, Optional[str]]]:
+    """进程池任务：只读打开SQLite读取正文并分析，不传递ORM对象"""
+    global _worker_matcher
+    if _worker_matcher is None or _worker_matcher[0] != names_digest:
+        _worker_matcher = (names_digest, NameMatcher(names))
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    try:
+        rows = conn.execute(
+            f"SELECT id, content FROM chapter WHERE id IN ({','.join('?' * len(chapter_ids))})", chapter_ids
+        ).fetchall()
+    finally:
+        conn.close()
+    return analyze_chapters(rows, known_hashes, _worker_matcher[1])
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """进程内共享的进程池（spawn方式启动，避免fork时复制请求线程持有的锁）"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=ANALYSIS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_pool
+
+class ChapterAnalyzer:
+    """整部小说的逐章分析：结果按正文哈希与名称哈希存储，只重新分析有变化的章节"""
+
+    def __init__(self, knowledge_manager: Optional[KnowledgeManager] = None, workers: Optional[int] = None,
+                 parallel_min: Optional[int] = None):
+        self.knowledge_manager = knowledge_manager or KnowledgeManager()
+        self.workers = workers if workers is not None else ANALYSIS_WORKERS
+        self.parallel_min = parallel_min if parallel_min is not None else ANALYSIS_PARALLEL_MIN
+
+    def analyze_novel(self, novel_id: int) -> Dict[str, Any]:
+        """返回按章节顺序排列的单章分析结果、人物与设定列表及复用统计"""
+        knowledge = self.knowledge_manager.get_novel_knowledge(novel_id)
+        names = []
+        for entity_type in ('character', 'setting'):
+            for entity in knowledge.entities[entity_type].values():
+                names.extend(entity_names(entity_type, entity))
+        current_names_hash = names_hash(names)
+
+        # 先只读章节元数据，更新时间与名称均未变化的章节直接复用
+        chapters = db.session.query(
+            Chapter.id, Chapter.chapter_number, Chapter.title, Chapter.updated_at
+        ).filter_by(novel_id=novel_id).order_by(Chapter.chapter_number, Chapter.id).all()
+        stored = {analysis.chapter_id: analysis for analysis in ChapterAnalysis.query.filter_by(novel_id=novel_id).all()}
+
+        stale = [
+            chapter.id for chapter in chapters
+            if chapter.id not in stored
+            or stored[chapter.id].names_hash != current_names_hash
+            or stored[chapter.id].chapter_updated_at != chapter.updated_at
+        ]
+        # 名称未变的章节只在正文哈希变化时重新分析（如只修改了标题）
+        known_hashes = {
+            chapter_id: stored[chapter_id].content_hash for chapter_id in stale
+            if chapter_id in stored and stored[chapter_id].names_hash == current_names_hash
+        }
+        if len(stale) >= self.parallel_min and self.workers > 1 and self._database():
+            results = self._analyze_parallel(stale, known_hashes, names, current_names_hash)
+        else:
+            results = self._analyze_serial(stale, known_hashes, knowledge.name_matcher)
+        
+        # 按章节ID顺序合并，串行与并行结果一致
+        updated_at = {chapter.id: chapter.updated_at for chapter in chapters}
+        reused = len(chapters) - len(stale)
+        analyzed = 0
+        for chapter_id, digest, result in sorted(results, key=lambda item: item[0]):
+            analysis = stored.get(chapter_id)
+            if analysis is None:
+                analysis = stored[chapter_id] = ChapterAnalysis(novel_id=novel_id, chapter_id=chapter_id)
+                db.session.add(analysis)
+            if result is None:
+                reused += 1
+            else:
+                analysis.result = result
+                analysis.content_hash = digest
+                analysis.names_hash = current_names_hash
+                analyzed += 1
+            analysis.chapter_updated_at = updated_at[chapter_id]
+
+        # 清理已删除章节遗留的结果
+        chapter_ids = {chapter.id for chapter in chapters}
+        removed = [chapter_id for chapter_id in stored if chapter_id not in chapter_ids]
+        for chapter_id in removed:
+            db.session.delete(stored.pop(chapter_id))
+        if stale or removed:
+            db.session.commit()
+
+        return {
+            'chapters': [
+                dict(json.loads(stored[chapter.id].result),
+                     chapter_id=chapter.id, chapter_number=chapter.chapter_number, title=chapter.title)
+                for chapter in chapters if chapter.id in stored
+            ],
+            'characters': list(knowledge.entities['character'].values()),
+            'settings': list(knowledge.entities['setting'].values()),
+            'stats': {'chapters': len(chapters), 'reused': reused, 'analyzed': analyzed}
+        }
+
+    def _analyze_serial(self, chapter_ids: List[int], known_hashes: Dict[int, str],
+                        matcher: NameMatcher) -> List[Tuple[int, str, Optional[str]]]:
+        results = []
+        for start in range(0, len(chapter_ids), _QUERY_BATCH_SIZE):
+            rows = db.session.query(Chapter.id, Chapter.content).filter(
+                Chapter.id.in_(chapter_ids[start:start + _QUERY_BATCH_SIZE])
+            ).all()
+            results.extend(analyze_chapters(rows, known_hashes, matcher))
+        return results
+    
+    def _analyze_parallel(self, chapter_ids: List[int], known_hashes: Dict[int, str],
+                          names: List[Tuple[str, str, int]], names_digest: str) -> List[Tuple[int, str, Optional[str]]]:
+        """按章节ID分批分发到进程池；进程池不可用时回退为串行"""
+        # 每个工作进程分到约4批，兼顾负载均衡与调度开销
+        batch_size = min(max(math.ceil(len(chapter_ids) / (self.workers * 4)), 8), _QUERY_BATCH_SIZE)
+        database = self._database()
+        try:
+            futures = [
+                _get_process_pool().submit(
+                    _analyze_worker, database, batch,
+                    {chapter_id: known_hashes[chapter_id] for chapter_id in batch if chapter_id in known_hashes},
+                    names, names_digest
+                )
+                for batch in (chapter_ids[start:start + batch_size] for start in range(0, len(chapter_ids), batch_size))
+            ]
+            return [item for future in futures for item in future.result()]
+        except Exception as e:
+            print(f"并行分析章节时出错: {e}")
+            return self._analyze_serial(chapter_ids, known_hashes, NameMatcher(names))
+    
+    def _database(self) -> Optional[str]:
+        """SQLite数据库文件路径，其他数据库返回None（只能串行分析）"""
+        url = db.engine.url
+        if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+            return None
+        return url.database
+    
+    def remove_chapter(self, chapter_id: int) -> None:
+        """删除章节的分析结果（由调用方提交）"""
+        ChapterAnalysis.query.filter_by(chapter_id=chapter_id).delete(synchronize_session=False)
+
+    def remove_novel(self, novel_id: int) -> None:
+        """删除整部小说的分析结果（由调用方提交）"""
+        ChapterAnalysis.query.filter_by(novel_id=novel_id).delete(synchronize_session=False)
@@ -1,47 +1,108 @@
 import json
-import re
-from typing import Dict, List, Any
-from src.models.novel import Novel, Chapter, Character, Setting, Outline
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from src.services.knowledge_manager import KnowledgeManager
+from src.services.name_matcher import NameMatcher
+from src.services.deadline import Deadline
+from src.services.chapter_analyzer import ChapterAnalyzer
+from src.services.analyzed_document import AnalyzedDocument
+from src.services.simhash_index import simhash_index
+
+# 段落结尾的合法标点
+_PARAGRAPH_ENDINGS = ('。', '！', '？', '…', '”', '」', '』', '"', '～', '—', '.', '!', '?')
+
+def score_check(name: str, feedback: str, local: bool = False):
+    """注册评分检查：方法接收 (document, knowledge) 返回0-1的得分，低于0.7时输出 feedback；
+    local 为真表示得分只由段落级问题决定，改写问题段落即可修复"""
+    def decorator(method: Callable) -> Callable:
+        method.score_check = (name, feedback, local)
+        return method
+    return decorator
+
+def issue_check(method: Callable) -> Callable:
+    """注册问题检查：方法接收 (document, knowledge) 返回问题说明列表"""
+    method.issue_check = True
+    return method
 
 class ContentReviewer:
-    """内容审核智能体"""
+    """内容审核智能体：草稿先分析一次得到 AnalyzedDocument，再依次执行注册的检查"""
+    
+    # 单个段落的最大长度
+    PARAGRAPH_MAX_LENGTH = 800
+    # 参与重复检测的最短分句长度
+    MIN_REPEAT_CLAUSE = 8
+    # 每个有问题的段落在段落检查中的扣分
+    PARAGRAPH_ISSUE_PENALTY = 0.3
+    # 人物连续缺席超过该章节数时提示
+    CHARACTER_ABSENCE_CHAPTERS = 10
+    # 整部小说一致性分析中每个问题的扣分及最低分
+    ISSUE_PENALTY = 0.1
+    MIN_ANALYSIS_SCORE = 0.3
     
-    def __init__(self):
+    def __init__(self, deadline: Optional[Deadline] = None):
         self.quality_threshold = 0.7
+        # 请求截止时间：超时后跳过需要读库的检查
+        self.deadline = deadline or Deadline()
+        # 按定义顺序收集注册的检查：按方法名绑定（子类重写的方法即使未加装饰器也会生效），
+        # 子类注册的同名检查替换基类的检查并保留其位置
+        score_checks: Dict[str, Tuple[str, str, bool]] = {}
+        issue_checks: Dict[str, None] = {}
+        for klass in reversed(type(self).__mro__):
+            for attr, method in vars(klass).items():
+                if hasattr(method, 'score_check'):
+                    name, feedback, local = method.score_check
+                    # 重写的方法改用了新的检查名时，去掉基类以原名注册的检查
+                    renamed = [other for other, (_, bound, _) in score_checks.items() if bound == attr and other != name]
+                    for other in renamed:
+                        del score_checks[other]
+                    score_checks[name] = (feedback, attr, local)
+                if getattr(method, 'issue_check', False):
+                    issue_checks[attr] = None
+        self.score_checks = [(name, feedback, getattr(self, attr)) for name, (feedback, attr, _) in score_checks.items()]
+        self.local_checks = {name for name, (_, _, local) in score_checks.items() if local}
+        self.issue_checks = [getattr(self, attr) for attr in issue_checks]
+    
+    def analyze_document(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> AnalyzedDocument:
+        """分析草稿；已超过截止时间时不加载名称匹配器"""
+        matcher = None
+        if self.deadline.expired():
+            self.deadline.record_exceeded('review')
+        else:
+            matcher = self._get_name_matcher(knowledge)
+        return AnalyzedDocument(content, matcher)
     
     def review_content(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> Dict[str, Any]:
         """审核内容质量"""
         try:
+            document = self.analyze_document(content, knowledge)
+            
             # 各项评分
-            consistency_score = self._check_consistency(content, knowledge)
-            logic_score = self._check_logic(content, knowledge)
-            character_score = self._check_character_consistency(content, knowledge)
-            plot_score = self._check_plot_coherence(content, knowledge)
-            quality_score = self._check_writing_quality(content)
+            scores = {name: check(document, knowledge) for name, _, check in self.score_checks}
             
             # 计算总分
-            overall_score = (consistency_score + logic_score + character_score + plot_score + quality_score) / 5
+            overall_score = sum(scores.values()) / len(scores)
             
             # 生成反馈
-            feedback = self._generate_feedback(
-                consistency_score, logic_score, character_score, plot_score, quality_score
-            )
+            feedback = self._generate_feedback(scores)
             
             # 检查是否通过审核
             approved = overall_score >= self.quality_threshold
             
+            # 定位到具体段落的问题，供局部改写使用
+            issue_locations = self._paragraph_issues(document, knowledge)
+            # 未通过的检查都是段落级时才适合局部改写，否则需要带反馈整体改写
+            failed_checks = [name for name, _, _ in self.score_checks if scores[name] < 0.7]
+            
             return {
                 'approved': approved,
                 'overall_score': overall_score,
-                'detailed_scores': {
-                    'consistency': consistency_score,
-                    'logic': logic_score,
-                    'character': character_score,
-                    'plot': plot_score,
-                    'quality': quality_score
-                },
+                'detailed_scores': scores,
                 'feedback': feedback,
-                'issues': self._identify_issues(content, knowledge)
+                'issues': [issue for check in self.issue_checks for issue in check(document, knowledge)] + [
+                    f"第{location['paragraph'] + 1}段：{location['issue']}" for location in issue_locations
+                ],
+                'issue_locations': issue_locations,
+                'failed_checks': failed_checks,
+                'patchable': bool(issue_locations) and bool(failed_checks) and set(failed_checks) <= self.local_checks
             }
             
         except Exception as e:
@@ -49,184 +110,269 @@ class ContentReviewer:
             return {
                 'approved': True,
                 'overall_score': 0.8,
-                'detailed_scores': {
-                    'consistency': 0.8,
-                    'logic': 0.8,
-                    'character': 0.8,
-                    'plot': 0.8,
-                    'quality': 0.8
-                },
+                'detailed_scores': {name: 0.8 for name, _, _ in self.score_checks},
                 'feedback': '内容审核完成，质量良好。',
-                'issues': []
+                'issues': [],
+                'issue_locations': [],
+                'failed_checks': [],
+                'patchable': False
             }
     
     def analyze_consistency(self, novel_id: int) -> Dict[str, Any]:
-        """分析整部小说的一致性"""
-        try:
-            # 获取所有相关数据
-            novel = Novel.query.get(novel_id)
-            chapters = Chapter.query.filter_by(novel_id=novel_id).order_by(Chapter.chapter_number).all()
-            characters = Character.query.filter_by(novel_id=novel_id).all()
-            settings = Setting.query.filter_by(novel_id=novel_id).all()
-            
-            # 分析各个方面的一致性
-            character_consistency = self._analyze_character_consistency(chapters, characters)
-            timeline_consistency = self._analyze_timeline_consistency(chapters)
-            worldview_consistency = self._analyze_worldview_consistency(chapters, settings)
-            
-            # 计算总体评级
-            scores = [
-                character_consistency['score'],
-                timeline_consistency['score'],
-                worldview_consistency['score']
-            ]
-            average_score = sum(scores) / len(scores)
-            
-            if average_score >= 0.8:
-                overall_rating = "优秀"
-            elif average_score >= 0.6:
-                overall_rating = "良好"
-            elif average_score >= 0.4:
-                overall_rating = "一般"
-            else:
-                overall_rating = "需要改进"
-            
-            return {
-                'character_consistency': character_consistency,
-                'timeline_consistency': timeline_consistency,
-                'worldview_consistency': worldview_consistency,
-                'overall_rating': overall_rating
-            }
-            
-        except Exception as e:
-            print(f"分析一致性时出错: {e}")
-            return {
-                'character_consistency': {'issues': [], 'score': 0.8, 'details': '人物一致性分析完成'},
-                'timeline_consistency': {'issues': [], 'score': 0.8, 'details': '时间线一致性分析完成'},
-                'worldview_consistency': {'issues': [], 'score': 0.8, 'details': '世界观一致性分析完成'},
-                'overall_rating': '良好'
-            }
+        """分析整部小说的一致性；小说不存在、超过截止时间或读库出错时抛出异常，由接口返回对应的错误"""
+        # 逐章分析结果（只重新分析有变化的章节）
+        self.deadline.check('analyze_consistency')
+        analysis = ChapterAnalyzer().analyze_novel(novel_id)
+        chapters = analysis['chapters']
+        
+        # 汇总各个方面的一致性
+        character_consistency = self._analyze_character_consistency(chapters, analysis['characters'])
+        timeline_consistency = self._analyze_timeline_consistency(chapters)
+        worldview_consistency = self._analyze_worldview_consistency(chapters, analysis['settings'])
+        
+        # 计算总体评级
+        scores = [
+            character_consistency['score'],
+            timeline_consistency['score'],
+            worldview_consistency['score']
+        ]
+        average_score = sum(scores) / len(scores)
+        
+        if average_score >= 0.8:
+            overall_rating = "优秀"
+        elif average_score >= 0.6:
+            overall_rating = "良好"
+        elif average_score >= 0.4:
+            overall_rating = "一般"
+        else:
+            overall_rating = "需要改进"
+        
+        return {
+            'character_consistency': character_consistency,
+            'timeline_consistency': timeline_consistency,
+            'worldview_consistency': worldview_consistency,
+            'overall_rating': overall_rating,
+            'repetition_hotspots': simhash_index.repetition_hotspots(novel_id),
+            'analysis_stats': analysis['stats']
+        }
     
-    def _check_consistency(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> float:
+    @score_check('consistency', "内容与已有设定存在一致性问题，建议检查人物和世界观设定。")
+    def _check_consistency(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
         """检查一致性"""
         # 简单的一致性检查逻辑
         score = 0.8
         
-        # 检查人物名称是否一致
-        characters = knowledge.get('characters', [])
-        content_text = content.get('content', '').lower()
-        
-        for char in characters:
-            char_name = char.get('name', '').lower()
-            if char_name in content_text:
+        # 检查人物名称是否一致（提及已在分析草稿时一次扫描得到）
+        for char in knowledge.get('characters', []):
+            if ('character', char.get('id')) in document.mentioned_entities:
                 # 检查人物描述是否一致（这里简化处理）
                 score += 0.05
         
         return min(score, 1.0)
     
-    def _check_logic(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> float:
+    def _get_name_matcher(self, knowledge: Dict[str, Any]) -> NameMatcher:
+        """获取名称匹配器，优先复用小说级的自动机"""
+        novel_id = knowledge.get('novel', {}).get('id')
+        if novel_id:
+            try:
+                return KnowledgeManager().get_name_matcher(novel_id)
+            except Exception as e:
+                print(f"获取名称匹配器时出错: {e}")
+        return NameMatcher.from_knowledge(knowledge)
+    
+    @score_check('logic', "情节逻辑存在问题，建议重新梳理事件发展顺序。")
+    def _check_logic(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
         """检查逻辑性"""
-        # 简单的逻辑检查
-        content_text = content.get('content', '')
-        
         # 检查内容长度是否合理
-        if len(content_text) < 500:
+        if document.length < 500:
             return 0.5
-        elif len(content_text) > 5000:
+        elif document.length > 5000:
             return 0.7
         else:
             return 0.8
     
-    def _check_character_consistency(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> float:
+    @score_check('character', "人物行为与性格设定不符，建议调整人物对话和行为描写。")
+    def _check_character_consistency(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
         """检查人物一致性"""
         return 0.8  # 简化实现
     
-    def _check_plot_coherence(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> float:
+    @score_check('plot', "情节发展不够连贯，建议加强与前文的联系。")
+    def _check_plot_coherence(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
         """检查情节连贯性"""
         return 0.8  # 简化实现
     
-    def _check_writing_quality(self, content: Dict[str, str]) -> float:
+    @score_check('quality', "写作质量需要提升，建议改进语言表达和段落结构。")
+    def _check_writing_quality(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
         """检查写作质量"""
-        content_text = content.get('content', '')
-        
         # 简单的质量评估
-        if not content_text:
+        if not document.text:
             return 0.0
         
         # 检查段落结构
-        paragraphs = content_text.split('\n\n')
-        if len(paragraphs) < 2:
+        if document.block_count < 2:
             return 0.6
         
         # 检查句子长度变化
-        sentences = re.split(r'[。！？]', content_text)
-        if len(sentences) < 5:
+        if len(document.sentences) < 5:
             return 0.6
         
         return 0.8
     
-    def _generate_feedback(self, consistency: float, logic: float, character: float, plot: float, quality: float) -> str:
+    @score_check('paragraphs', "部分段落过长、重复或结尾不完整，建议改写标出的段落。", local=True)
+    def _check_paragraphs(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> float:
+        """检查段落级问题：每个有问题的段落扣分，改写这些段落即可修复"""
+        locations = self._paragraph_issues(document, knowledge)
+        return max(1.0 - self.PARAGRAPH_ISSUE_PENALTY * len(locations), 0.0)
+    
+    def _paragraph_issues(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """段落级问题，每份草稿只定位一次"""
+        if document.issue_locations is None:
+            document.issue_locations = self._locate_issues(document, knowledge)
+        return document.issue_locations
+    
+    def _generate_feedback(self, scores: Dict[str, float]) -> str:
         """生成反馈意见"""
-        feedback_parts = []
-        
-        if consistency < 0.7:
-            feedback_parts.append("内容与已有设定存在一致性问题，建议检查人物和世界观设定。")
-        
-        if logic < 0.7:
-            feedback_parts.append("情节逻辑存在问题，建议重新梳理事件发展顺序。")
-        
-        if character < 0.7:
-            feedback_parts.append("人物行为与性格设定不符，建议调整人物对话和行为描写。")
-        
-        if plot < 0.7:
-            feedback_parts.append("情节发展不够连贯，建议加强与前文的联系。")
-        
-        if quality < 0.7:
-            feedback_parts.append("写作质量需要提升，建议改进语言表达和段落结构。")
+        feedback_parts = [
+            feedback for name, feedback, _ in self.score_checks if scores[name] < 0.7
+        ]
         
         if not feedback_parts:
             return "内容质量良好，通过审核。"
         
         return " ".join(feedback_parts)
     
-    def _identify_issues(self, content: Dict[str, str], knowledge: Dict[str, Any]) -> List[str]:
+    @issue_check
+    def _identify_issues(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> List[str]:
         """识别具体问题"""
         issues = []
         
-        content_text = content.get('content', '')
-        
         # 检查内容长度
-        if len(content_text) < 500:
+        if document.length < 500:
             issues.append("内容过短，建议扩展到至少500字")
         
         # 检查标题
-        title = content.get('title', '')
-        if not title or len(title) < 2:
+        if not document.title or len(document.title) < 2:
             issues.append("标题过短或缺失")
         
         return issues
     
-    def _analyze_character_consistency(self, chapters: List[Chapter], characters: List[Character]) -> Dict[str, Any]:
-        """分析人物一致性"""
+    def _locate_issues(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """逐段检查过长、与前文或已有章节重复及结尾不完整的段落，返回段落下标（从0开始）与问题说明"""
+        locations = []
+        seen_clauses = set()
+        near_duplicates = self._find_near_duplicates(document, knowledge)
+        
+        for paragraph in document.paragraphs:
+            problems = []
+            
+            if len(paragraph.text) > self.PARAGRAPH_MAX_LENGTH:
+                problems.append("段落过长，建议拆分或精简")
+            
+            clauses = [clause for clause in paragraph.clauses if len(clause) >= self.MIN_REPEAT_CLAUSE]
+            if any(clause in seen_clauses for clause in clauses):
+                problems.append("与前文语句重复，建议改写")
+            seen_clauses.update(clauses)
+            
+            matches = near_duplicates.get(paragraph.index)
+            if matches:
+                problems.append(f"与第{matches[0]['chapter_number']}章第{matches[0]['paragraph'] + 1}段高度相似，建议改写")
+            
+            if not paragraph.text.endswith(_PARAGRAPH_ENDINGS):
+                problems.append("段落结尾不完整")
+            
+            if problems:
+                locations.append({'paragraph': paragraph.index, 'issue': '；'.join(problems)})
+        
+        return locations
+    
+    def _find_near_duplicates(self, document: AnalyzedDocument, knowledge: Dict[str, Any]) -> Dict[int, List[Dict[str, Any]]]:
+        """通过段落指纹索引查找与已有章节近似重复的段落；超时或出错时跳过"""
+        novel_id = knowledge.get('novel', {}).get('id')
+        if not novel_id or self.deadline.expired():
+            return {}
+        try:
+            return simhash_index.find_near_duplicates(
+                novel_id, [paragraph.fingerprint for paragraph in document.paragraphs],
+                exclude_chapter_id=document.chapter_id
+            )
+        except Exception as e:
+            print(f"查找重复段落时出错: {e}")
+            return {}
+    
+    def _analyze_character_consistency(self, chapters: List[Dict[str, Any]], characters: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """分析人物一致性：未出场的人物，以及长时间缺席后再次出现的人物"""
+        if not chapters:
+            return {'issues': [], 'score': 0.8, 'details': '暂无章节，无法分析人物一致性。'}
+        
+        appearances = {character['id']: [] for character in characters}
+        for position, chapter in enumerate(chapters):
+            for character_id, _ in chapter['characters']:
+                if character_id in appearances:
+                    appearances[character_id].append(position)
+        
+        issues = []
+        for character in characters:
+            positions = appearances[character['id']]
+            if not positions:
+                issues.append(f"人物「{character['name']}」未在任何章节中出现")
+                continue
+            for previous, current in zip(positions, positions[1:]):
+                if current - previous - 1 >= self.CHARACTER_ABSENCE_CHAPTERS:
+                    issues.append(
+                        f"人物「{character['name']}」在第{chapters[previous]['chapter_number']}章后缺席"
+                        f"{current - previous - 1}章，直到第{chapters[current]['chapter_number']}章才再次出现"
+                    )
+        
+        appeared = sum(1 for positions in appearances.values() if positions)
         return {
-            'issues': [],
-            'score': 0.8,
-            'details': '人物一致性分析完成，未发现明显问题。'
+            'issues': issues,
+            'score': self._issue_score(issues),
+            'details': f'共{len(chapters)}章，{len(characters)}个人物中{appeared}个已出场。'
         }
     
-    def _analyze_timeline_consistency(self, chapters: List[Chapter]) -> Dict[str, Any]:
-        """分析时间线一致性"""
+    def _analyze_timeline_consistency(self, chapters: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """分析时间线一致性：明确的“第N天”倒退且该章没有回忆或倒叙提示"""
+        if not chapters:
+            return {'issues': [], 'score': 0.8, 'details': '暂无章节，无法分析时间线一致性。'}
+        
+        issues = []
+        latest_day, latest_chapter = None, None
+        for chapter in chapters:
+            days = chapter['day_numbers']
+            if not days:
+                continue
+            if latest_day is not None and days[0] < latest_day and not chapter['flashback']:
+                issues.append(
+                    f"第{chapter['chapter_number']}章出现“第{days[0]}天”，早于第{latest_chapter}章的“第{latest_day}天”，"
+                    f"且没有回忆或倒叙提示"
+                )
+            if latest_day is None or max(days) > latest_day:
+                latest_day, latest_chapter = max(days), chapter['chapter_number']
+        
+        marked = sum(1 for chapter in chapters if chapter['temporal_markers'] or chapter['day_numbers'])
         return {
-            'issues': [],
-            'score': 0.8,
-            'details': '时间线一致性分析完成，未发现明显问题。'
+            'issues': issues,
+            'score': self._issue_score(issues),
+            'details': f'共{len(chapters)}章，其中{marked}章包含时间标记。'
         }
     
-    def _analyze_worldview_consistency(self, chapters: List[Chapter], settings: List[Setting]) -> Dict[str, Any]:
-        """分析世界观一致性"""
+    def _analyze_worldview_consistency(self, chapters: List[Dict[str, Any]], settings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """分析世界观一致性：从未在正文中出现的设定"""
+        if not chapters:
+            return {'issues': [], 'score': 0.8, 'details': '暂无章节，无法分析世界观一致性。'}
+        
+        mentioned = {setting_id for chapter in chapters for setting_id, _ in chapter['settings']}
+        issues = [
+            f"设定「{setting['name']}」未在任何章节中出现"
+            for setting in settings if setting['id'] not in mentioned
+        ]
         return {
-            'issues': [],
-            'score': 0.8,
-            'details': '世界观一致性分析完成，未发现明显问题。'
+            'issues': issues,
+            'score': self._issue_score(issues),
+            'details': f'共{len(settings)}项设定，其中{len(settings) - len(issues)}项在正文中出现。'
         }
+    
+    def _issue_score(self, issues: List[str]) -> float:
+        """每个问题扣除固定分数，最低不低于下限"""
+        return max(1.0 - self.ISSUE_PENALTY * len(issues), self.MIN_ANALYSIS_SCORE)
 
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+# 各接口默认的截止时间（秒），可由请求体中的 deadline 覆盖
+DEFAULT_DEADLINES = {
+    'generate-chapter': float(os.getenv('DEADLINE_GENERATE_CHAPTER', '120')),
+    'suggest-next-plot': float(os.getenv('DEADLINE_SUGGEST_NEXT_PLOT', '45')),
+    'analyze-consistency': float(os.getenv('DEADLINE_ANALYZE_CONSISTENCY', '60')),
+    'review-batch': float(os.getenv('DEADLINE_REVIEW_BATCH', '600')),
+}
+
+class DeadlineExceeded(TimeoutError):
+    """请求已超过截止时间"""
+
+class Deadline:
+    """请求截止时间：在路由创建，沿知识检索、写作与审核的调用链向下传递"""
+
+    _exceeded = Counter()
+    _lock = threading.Lock()
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.budget = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds if seconds is not None else None
+
+    @classmethod
+    def for_endpoint(cls, endpoint: str, requested: Optional[float] = None) -> 'Deadline':
+        """按接口默认值（或请求指定的秒数）创建截止时间"""
+        return cls(float(requested) if requested is not None else DEFAULT_DEADLINES.get(endpoint))
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数，未设置截止时间时为None"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        """已超时则记录并抛出 DeadlineExceeded"""
+        if self.expired():
+            self.record_exceeded(stage)
+            raise DeadlineExceeded(f"{stage} 超过截止时间（{self.budget}秒）")
+
+    @classmethod
+    def record_exceeded(cls, stage: str) -> None:
+        with cls._lock:
+            cls._exceeded[stage] += 1
+
+    def report(self) -> Dict[str, Any]:
+        """本次请求的截止时间使用情况"""
+        return {
+            'budget': self.budget,
+            'elapsed': time.monotonic() - self.started_at,
+            'exceeded': self.expired()
+        }
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """各阶段超时次数"""
+        with cls._lock:
+            return dict(cls._exceeded)
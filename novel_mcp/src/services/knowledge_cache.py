@@ -0,0 +1,122 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from src.models.novel import Novel, Chapter, Character, Setting, Outline
+
+class KnowledgeCache:
+    """进程内共享的小说知识缓存（按小说ID的LRU）"""
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # 每次失效递增，防止加载期间发生写入时把旧数据写回缓存
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # 失效时的回调（如向量索引），参数为小说ID
+        self._listeners: List[Callable[[int], None]] = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, novel_id: int) -> Optional[Any]:
+        """读取缓存，命中时移动到最近使用位置"""
+        with self._lock:
+            if novel_id in self._entries:
+                self._entries.move_to_end(novel_id)
+                self.hits += 1
+                return self._entries[novel_id]
+            self.misses += 1
+            return None
+
+    def get_or_load(self, novel_id: int, loader: Callable[[int], Any]) -> Any:
+        """读取缓存，未命中时调用loader加载并写入"""
+        value = self.get(novel_id)
+        if value is not None:
+            return value
+
+        with self._lock:
+            generation = self._generations.get(novel_id, 0)
+        value = loader(novel_id)
+        self._put(novel_id, value, generation)
+        return value
+
+    def _put(self, novel_id: int, value: Any, generation: int) -> None:
+        with self._lock:
+            if self.max_size <= 0 or self._generations.get(novel_id, 0) != generation:
+                return
+            self._entries[novel_id] = value
+            self._entries.move_to_end(novel_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, novel_id: int) -> None:
+        """使某部小说的缓存失效"""
+        with self._lock:
+            self._generations[novel_id] = self._generations.get(novel_id, 0) + 1
+            if self._entries.pop(novel_id, None) is not None:
+                self.invalidations += 1
+        for listener in self._listeners:
+            try:
+                listener(novel_id)
+            except Exception as e:
+                print(f"缓存失效回调出错: {e}")
+
+    def add_listener(self, listener: Callable[[int], None]) -> None:
+        """注册缓存失效回调"""
+        self._listeners.append(listener)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            for novel_id in self._entries:
+                self._generations[novel_id] = self._generations.get(novel_id, 0) + 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+knowledge_cache = KnowledgeCache(int(os.getenv('KNOWLEDGE_CACHE_SIZE', '32')))
+
+_DIRTY_KEY = 'knowledge_cache_dirty_novels'
+
+def _invalidate_target(mapper, connection, target):
+    """写入小说相关数据时使对应缓存失效"""
+    novel_id = target.id if isinstance(target, Novel) else target.novel_id
+    if novel_id is None:
+        return
+    knowledge_cache.invalidate(novel_id)
+
+    # 提交后再失效一次，避免其他请求在提交前读到旧数据并写回缓存
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_DIRTY_KEY, set()).add(novel_id)
+
+def _invalidate_committed(session):
+    for novel_id in session.info.pop(_DIRTY_KEY, ()):
+        knowledge_cache.invalidate(novel_id)
+
+def _discard_dirty(session):
+    session.info.pop(_DIRTY_KEY, None)
+
+for _model in (Novel, Chapter, Character, Setting, Outline):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate_target)
+
+event.listen(Session, 'after_commit', _invalidate_committed)
+event.listen(Session, 'after_soft_rollback', _discard_dirty)
@@ -0,0 +1,248 @@
+import re
+from collections import Counter
+from typing import Dict, FrozenSet, List, Tuple
+from sqlalchemy import func, inspect
+from src.models.novel import Chapter, Character, Setting, Outline
+from src.models.knowledge import KnowledgeTerm, ChapterChunk
+from src.database_init import db
+from src.services.tokenizer import get_tokenizer, build_signature, decode_signature, term_id
+from src.services.ranking import BM25Ranker
+
+# SQLite单条语句的参数个数有限，分批查询
+_QUERY_BATCH_SIZE = 500
+_SENTENCE_END = re.compile(r'(?<=[。！？!?…」』”])')
+
+class KnowledgeIndex:
+    """知识库倒排索引，按小说维护 词项 -> 实体ID及词频"""
+
+    # 各类实体参与相关性计算的字段
+    INDEXED_FIELDS = {
+        'character': 'description',
+        'setting': 'description',
+        'outline': 'content',
+        'chapter': 'content',
+    }
+    # 进入倒排索引的实体类型（章节按段落块建立索引）
+    MODELS = {
+        'character': Character,
+        'setting': Setting,
+        'outline': Outline,
+    }
+
+    # 段落块的目标长度与上限（字符）
+    CHUNK_TARGET_SIZE = 400
+    CHUNK_MAX_SIZE = 800
+    # 出现在超过该比例段落块中的词项不参与检索
+    CHUNK_MAX_DF_RATIO = 0.5
+
+    def __init__(self):
+        self.tokenizer = get_tokenizer()
+
+    def tokenize(self, text: str) -> List[str]:
+        """提取关键词"""
+        return self.tokenizer.tokenize(text)
+
+    def refresh_signature(self, entity) -> bool:
+        """仅当索引字段变化时重新计算实体的词项签名，返回是否有更新"""
+        field = self.INDEXED_FIELDS[entity.__tablename__]
+        history = inspect(entity).attrs[field].history
+        if entity.token_signature is not None and history.added == history.deleted:
+            return False
+
+        entity.token_signature = build_signature(self.tokenize(getattr(entity, field) or ''))
+        return True
+
+    def index_entity(self, entity, force: bool = False) -> None:
+        """增量更新单个实体的签名与索引（实体需已flush获得ID，由调用方提交）"""
+        if not self.refresh_signature(entity) and not force:
+            return
+
+        entity_type = entity.__tablename__
+        self.remove_entity(entity_type, entity.id)
+
+        text = getattr(entity, self.INDEXED_FIELDS[entity_type]) or ''
+        term_counts = Counter(self.tokenize(text))
+        db.session.add_all([
+            KnowledgeTerm(
+                novel_id=entity.novel_id,
+                term=term,
+                entity_type=entity_type,
+                entity_id=entity.id,
+                frequency=frequency
+            )
+            for term, frequency in term_counts.items()
+        ])
+
+    def remove_entity(self, entity_type: str, entity_id: int) -> None:
+        """删除单个实体的索引"""
+        KnowledgeTerm.query.filter_by(
+            entity_type=entity_type, entity_id=entity_id
+        ).delete(synchronize_session=False)
+
+    def remove_novel(self, novel_id: int) -> None:
+        """删除整部小说的索引"""
+        KnowledgeTerm.query.filter_by(novel_id=novel_id).delete(synchronize_session=False)
+        ChapterChunk.query.filter_by(novel_id=novel_id).delete(synchronize_session=False)
+
+    def split_chunks(self, text: str) -> List[str]:
+        """将章节按段落切分为长度适中的块：合并过短段落，按句子拆分过长段落"""
+        pieces = []
+        for paragraph in (text or '').split('\n'):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            if len(paragraph) <= self.CHUNK_MAX_SIZE:
+                pieces.append(paragraph)
+                continue
+            sentence_group = ''
+            for sentence in _SENTENCE_END.split(paragraph):
+                if sentence_group and len(sentence_group) + len(sentence) > self.CHUNK_MAX_SIZE:
+                    pieces.append(sentence_group)
+                    sentence_group = ''
+                sentence_group += sentence
+                # 无标点的超长文本直接截断
+                while len(sentence_group) > self.CHUNK_MAX_SIZE:
+                    pieces.append(sentence_group[:self.CHUNK_MAX_SIZE])
+                    sentence_group = sentence_group[self.CHUNK_MAX_SIZE:]
+            if sentence_group:
+                pieces.append(sentence_group)
+
+        chunks = []
+        for piece in pieces:
+            if chunks and len(chunks[-1]) < self.CHUNK_TARGET_SIZE and len(chunks[-1]) + len(piece) <= self.CHUNK_MAX_SIZE:
+                chunks[-1] += '\n' + piece
+            else:
+                chunks.append(piece)
+        return chunks
+
+    def index_chapter(self, chapter, force: bool = False) -> None:
+        """章节内容变化时重新切分段落块并建立索引（章节需已flush获得ID，由调用方提交）"""
+        if not self.refresh_signature(chapter) and not force:
+            return
+
+        self.remove_chapter(chapter.id)
+        chunks = [
+            ChapterChunk(
+                novel_id=chapter.novel_id,
+                chapter_id=chapter.id,
+                chapter_number=chapter.chapter_number,
+                position=position,
+                content=text
+            )
+            for position, text in enumerate(self.split_chunks(chapter.content))
+        ]
+        db.session.add_all(chunks)
+        db.session.flush()
+
+        for chunk in chunks:
+            term_counts = Counter(self.tokenize(chunk.content))
+            chunk.token_count = sum(term_counts.values())
+            db.session.add_all([
+                KnowledgeTerm(
+                    novel_id=chapter.novel_id,
+                    term=term,
+                    entity_type='chunk',
+                    entity_id=chunk.id,
+                    frequency=frequency
+                )
+                for term, frequency in term_counts.items()
+            ])
+
+    def remove_chapter(self, chapter_id: int) -> None:
+        """删除章节的段落块及其索引"""
+        chunk_ids = [row[0] for row in db.session.query(ChapterChunk.id).filter_by(chapter_id=chapter_id).all()]
+        for start in range(0, len(chunk_ids), _QUERY_BATCH_SIZE):
+            KnowledgeTerm.query.filter(
+                KnowledgeTerm.entity_type == 'chunk',
+                KnowledgeTerm.entity_id.in_(chunk_ids[start:start + _QUERY_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+        ChapterChunk.query.filter_by(chapter_id=chapter_id).delete(synchronize_session=False)
+
+    def rebuild(self, novel_id: int) -> None:
+        """重建整部小说的索引（由调用方提交）"""
+        self.remove_novel(novel_id)
+        for model in self.MODELS.values():
+            for entity in model.query.filter_by(novel_id=novel_id).all():
+                entity.token_signature = None
+                self.index_entity(entity, force=True)
+
+        for chapter in Chapter.query.filter_by(novel_id=novel_id).all():
+            chapter.token_signature = None
+            self.index_chapter(chapter, force=True)
+
+    def signature_of(self, text: str) -> FrozenSet[int]:
+        """计算文本的词项签名集合"""
+        return decode_signature(build_signature(self.tokenize(text)))
+
+    def term_ids(self, text: str) -> List[int]:
+        """文本的词项哈希ID序列（保留重复，用于加权查询）"""
+        return [term_id(term) for term in self.tokenize(text)]
+
+    def load_term_frequencies(self, novel_id: int) -> Dict[Tuple[str, int], Dict[int, int]]:
+        """读取整部小说人物、设定与大纲的索引词频，返回 (类型, ID) -> {词项哈希ID: 词频}；
+        段落块的倒排记录在检索时按词项读取，不进入快照"""
+        frequencies = {}
+        rows = db.session.query(
+            KnowledgeTerm.entity_type,
+            KnowledgeTerm.entity_id,
+            KnowledgeTerm.term,
+            KnowledgeTerm.frequency
+        ).filter(
+            KnowledgeTerm.novel_id == novel_id,
+            KnowledgeTerm.entity_type.in_(list(self.MODELS))
+        ).yield_per(5000)
+
+        for entity_type, entity_id, term, frequency in rows:
+            frequencies.setdefault((entity_type, entity_id), {})[term_id(term)] = frequency
+
+        return frequencies
+
+    def chunk_stats(self, novel_id: int) -> Tuple[int, float]:
+        """段落块总数与平均长度（BM25的语料统计）"""
+        count, total = db.session.query(
+            func.count(ChapterChunk.id),
+            func.coalesce(func.sum(ChapterChunk.token_count), 0)
+        ).filter(ChapterChunk.novel_id == novel_id).one()
+        return count, (total / count if count else 0.0)
+
+    def search_chunks(self, novel_id: int, text: str, limit: int, corpus_size: int, avg_length: float) -> List[Tuple[int, float]]:
+        """在整部小说的段落块中检索，返回得分最高的 (块ID, 得分)"""
+        terms = list(set(self.tokenize(text)))
+        if not terms or not corpus_size or limit <= 0:
+            return []
+
+        # 先按文档频率剔除过于常见的词项，再只读取剩余词项的倒排记录
+        max_df = max(1, int(corpus_size * self.CHUNK_MAX_DF_RATIO))
+        kept_terms = []
+        for start in range(0, len(terms), _QUERY_BATCH_SIZE):
+            rows = db.session.query(KnowledgeTerm.term, func.count(KnowledgeTerm.id)).filter(
+                KnowledgeTerm.novel_id == novel_id,
+                KnowledgeTerm.entity_type == 'chunk',
+                KnowledgeTerm.term.in_(terms[start:start + _QUERY_BATCH_SIZE])
+            ).group_by(KnowledgeTerm.term).all()
+            kept_terms.extend(term for term, doc_freq in rows if doc_freq <= max_df)
+
+        documents = {}
+        doc_lengths = {}
+        for start in range(0, len(kept_terms), _QUERY_BATCH_SIZE):
+            rows = db.session.query(
+                KnowledgeTerm.entity_id, KnowledgeTerm.term, KnowledgeTerm.frequency, ChapterChunk.token_count
+            ).join(ChapterChunk, ChapterChunk.id == KnowledgeTerm.entity_id).filter(
+                KnowledgeTerm.novel_id == novel_id,
+                KnowledgeTerm.entity_type == 'chunk',
+                KnowledgeTerm.term.in_(kept_terms[start:start + _QUERY_BATCH_SIZE])
+            ).all()
+            for chunk_id, term, frequency, token_count in rows:
+                documents.setdefault(('chunk', chunk_id), {})[term] = frequency
+                doc_lengths[('chunk', chunk_id)] = token_count
+
+        if not documents:
+            return []
+
+        ranker = BM25Ranker(
+            documents,
+            doc_lengths=[doc_lengths[key] for key in documents],
+            corpus_size=corpus_size,
+            avg_length=avg_length
+        )
+        return ranker.top_k(self.tokenize(text), {'chunk': limit})['chunk']
@@ -1,146 +1,298 @@
+import heapq
 import json
-import re
-from typing import Dict, List, Any
-from src.models.novel import Novel, Chapter, Character, Setting, Outline
+import os
+from collections import Counter
+from typing import Dict, FrozenSet, List, Any, Optional, Set, Tuple
+from src.models.novel import Novel, Chapter, Character, Setting, Outline, NovelStats
+from src.models.knowledge import ChapterChunk
 from src.database_init import db
+from src.services.knowledge_index import KnowledgeIndex
+from src.services.knowledge_cache import knowledge_cache
+from src.services.tokenizer import decode_signature
+from src.services.name_matcher import NameMatcher, entity_names, get_name_matcher
+from src.services.ranking import BM25Ranker
+from src.services.novel_stats import NovelStatistics
+from src.services.vector_index import vector_index
+from src.services.deadline import Deadline
+from src.services.simhash_index import simhash_index
+
+class NovelKnowledge:
+    """缓存中的单部小说知识快照：实体字典、词项签名、内存倒排表及BM25打分器"""
+    
+    def __init__(self, novel: Dict[str, Any], entities: Dict[str, Dict[int, Dict[str, Any]]],
+                 signatures: Dict[Tuple[str, int], FrozenSet[int]], recent_chapters: List[Dict[str, Any]],
+                 name_matcher: NameMatcher, ranker: BM25Ranker,
+                 chunk_stats: Tuple[int, float], closing_passage: Optional[Dict[str, Any]]):
+        self.novel = novel
+        self.entities = entities
+        self.signatures = signatures
+        self.recent_chapters = recent_chapters
+        self.name_matcher = name_matcher
+        self.ranker = ranker
+        # 段落块总数与平均长度，以及最新章节的结尾段落
+        self.chunk_stats = chunk_stats
+        self.closing_passage = closing_passage
+        
+        # 词项ID -> 包含该词项的实体
+        self.postings: Dict[int, List[Tuple[str, int]]] = {}
+        for key, signature in signatures.items():
+            for term_id in signature:
+                self.postings.setdefault(term_id, []).append(key)
 
 class KnowledgeManager:
     """知识库管理智能体"""
     
-    def __init__(self):
-        self.knowledge_cache = {}
+    # 各类实体最多返回的数量（名称被直接提及的实体不受此限制）
+    DEFAULT_TOP_K = {'character': 5, 'setting': 5, 'outline': 3, 'chunk': 5}
+    # 交并比打分时的最低相关度
+    JACCARD_THRESHOLDS = {'character': 0.3, 'setting': 0.3, 'outline': 0.2}
+    
+    def __init__(self, scorer: Optional[str] = None, top_k: Optional[Dict[str, int]] = None):
+        self.knowledge_cache = knowledge_cache
+        self.index = KnowledgeIndex()
+        self.vector_index = vector_index
+        # bm25（默认）、jaccard 或 vector（本地哈希向量的余弦相似度）
+        self.scorer = scorer or os.getenv('KNOWLEDGE_SCORER', 'bm25')
+        self.top_k = dict(self.DEFAULT_TOP_K, **(top_k or {}))
     
-    def get_relevant_knowledge(self, novel_id: int, context: str) -> Dict[str, Any]:
-        """根据上下文获取相关知识"""
+    def get_relevant_knowledge(self, novel_id: int, context: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """根据上下文获取相关知识；超过截止时间时跳过段落检索"""
         try:
-            # 获取小说基本信息
-            novel = Novel.query.get(novel_id)
-            if not novel:
-                raise ValueError(f"小说ID {novel_id} 不存在")
+            # 获取小说知识快照（进程内共享缓存，写入时自动失效）
+            knowledge = self.knowledge_cache.get_or_load(novel_id, self._load_novel_knowledge)
+            
+            # 按类型取相关度最高的实体，并保留上下文中直接提到名称的实体
+            ranked = self._rank_entities(knowledge, context)
+            mentioned = knowledge.name_matcher.entities_in(context)
             
-            # 获取所有相关信息
-            characters = Character.query.filter_by(novel_id=novel_id).all()
-            settings = Setting.query.filter_by(novel_id=novel_id).all()
-            outlines = Outline.query.filter_by(novel_id=novel_id).all()
-            recent_chapters = Chapter.query.filter_by(novel_id=novel_id).order_by(Chapter.chapter_number.desc()).limit(3).all()
+            relevant_characters = self._select_entities(knowledge, 'character', ranked, mentioned)
+            # 如果没有找到相关人物，返回主要人物
+            if not relevant_characters:
+                relevant_characters = [
+                    dict(char, relevance_score=0.0)
+                    for char in list(knowledge.entities['character'].values())[:3]  # 返回前3个人物
+                ]
+            relevant_settings = self._select_entities(knowledge, 'setting', ranked, mentioned)
+            relevant_outlines = self._select_entities(knowledge, 'outline', ranked, set())
             
-            # 基于上下文筛选相关信息
-            relevant_characters = self._filter_relevant_characters(characters, context)
-            relevant_settings = self._filter_relevant_settings(settings, context)
-            relevant_outlines = self._filter_relevant_outlines(outlines, context)
+            # 从全部章节中检索与上下文相关的段落
+            if deadline is not None and deadline.expired():
+                deadline.record_exceeded('retrieval')
+                relevant_passages = []
+            else:
+                relevant_passages = self._retrieve_passages(novel_id, knowledge, context, ranked.get('chunk'))
             
             return {
-                'novel': novel.to_dict(),
-                'characters': [char.to_dict() for char in relevant_characters],
-                'settings': [setting.to_dict() for setting in relevant_settings],
-                'outlines': [outline.to_dict() for outline in relevant_outlines],
-                'recent_chapters': [chapter.to_dict() for chapter in recent_chapters]
+                'novel': dict(knowledge.novel),
+                'characters': relevant_characters,
+                'settings': relevant_settings,
+                'outlines': relevant_outlines,
+                'passages': relevant_passages,
+                'recent_chapters': [dict(chapter) for chapter in knowledge.recent_chapters]
             }
             
         except Exception as e:
             print(f"获取知识时出错: {e}")
             return {}
     
-    def _filter_relevant_characters(self, characters: List[Character], context: str) -> List[Character]:
-        """筛选相关人物"""
-        relevant = []
-        context_lower = context.lower()
-        
-        for char in characters:
-            # 检查人物名字是否在上下文中
-            if char.name.lower() in context_lower:
-                relevant.append(char)
-            # 检查人物描述是否与上下文相关
-            elif self._calculate_relevance(char.description or '', context) > 0.3:
-                relevant.append(char)
-        
-        # 如果没有找到相关人物，返回主要人物
-        if not relevant and characters:
-            relevant = characters[:3]  # 返回前3个人物
-        
-        return relevant
+    def _load_novel_knowledge(self, novel_id: int) -> NovelKnowledge:
+        """从数据库加载小说知识快照"""
+        novel = Novel.query.get(novel_id)
+        if not novel:
+            raise ValueError(f"小说ID {novel_id} 不存在")
+        
+        term_frequencies = self.index.load_term_frequencies(novel_id)
+        entities = {}
+        signatures = {}
+        documents = {}
+        for entity_type, model in self.index.MODELS.items():
+            field = self.index.INDEXED_FIELDS[entity_type]
+            entities[entity_type] = {}
+            for entity in model.query.filter_by(novel_id=novel_id).order_by(model.id).all():
+                key = (entity_type, entity.id)
+                entities[entity_type][entity.id] = entity.to_dict()
+                # 旧数据尚未建立索引时临时计算
+                if entity.token_signature is None:
+                    text = getattr(entity, field) or ''
+                    signatures[key] = self.index.signature_of(text)
+                    documents[key] = Counter(self.index.term_ids(text))
+                else:
+                    signatures[key] = decode_signature(entity.token_signature)
+                    documents[key] = term_frequencies.get(key, {})
+        
+        # 最近章节只保留标题与摘要，正文通过段落检索按需提供
+        recent_chapters = db.session.query(
+            Chapter.id, Chapter.chapter_number, Chapter.title, Chapter.summary
+        ).filter_by(novel_id=novel_id).order_by(Chapter.chapter_number.desc()).limit(3).all()
+        
+        # 最新章节的结尾段落，保证续写衔接
+        closing_passage = None
+        if recent_chapters:
+            last_chunk = ChapterChunk.query.filter_by(chapter_id=recent_chapters[0].id).order_by(ChapterChunk.position.desc()).first()
+            if last_chunk:
+                closing_passage = self._passage_dict(last_chunk, recent_chapters[0].title, 0.0)
+        
+        # 人物与设定名称（含别名）的匹配自动机，名称未变时复用
+        names = []
+        for entity_type in ('character', 'setting'):
+            for entity in entities[entity_type].values():
+                names.extend(entity_names(entity_type, entity))
+        
+        return NovelKnowledge(
+            novel=novel.to_dict(),
+            entities=entities,
+            signatures=signatures,
+            recent_chapters=[
+                {'id': chapter.id, 'chapter_number': chapter.chapter_number, 'title': chapter.title, 'summary': chapter.summary}
+                for chapter in recent_chapters
+            ],
+            name_matcher=get_name_matcher(novel_id, names),
+            ranker=BM25Ranker(documents),
+            chunk_stats=self.index.chunk_stats(novel_id),
+            closing_passage=closing_passage
+        )
+    
+    def get_novel_knowledge(self, novel_id: int) -> NovelKnowledge:
+        """获取小说知识快照（进程内共享缓存）"""
+        return self.knowledge_cache.get_or_load(novel_id, self._load_novel_knowledge)
     
-    def _filter_relevant_settings(self, settings: List[Setting], context: str) -> List[Setting]:
-        """筛选相关设定"""
-        relevant = []
-        context_lower = context.lower()
-        
-        for setting in settings:
-            # 检查设定名称是否在上下文中
-            if setting.name.lower() in context_lower:
-                relevant.append(setting)
-            # 检查设定描述是否与上下文相关
-            elif self._calculate_relevance(setting.description or '', context) > 0.3:
-                relevant.append(setting)
-        
-        return relevant
+    def get_name_matcher(self, novel_id: int) -> NameMatcher:
+        """获取小说人物与设定名称的匹配器"""
+        return self.get_novel_knowledge(novel_id).name_matcher
     
-    def _filter_relevant_outlines(self, outlines: List[Outline], context: str) -> List[Outline]:
-        """筛选相关大纲"""
-        relevant = []
+    def _rank_entities(self, knowledge: NovelKnowledge, context: str) -> Dict[str, List[Tuple[int, float]]]:
+        """按实体类型返回相关度最高的实体 (ID, 得分)"""
+        if self.scorer == 'jaccard':
+            ranked = {}
+            for (entity_type, entity_id), score in self._score_candidates(knowledge, context).items():
+                if score > self.JACCARD_THRESHOLDS[entity_type]:
+                    ranked.setdefault(entity_type, []).append((entity_id, score))
+            return {
+                entity_type: heapq.nlargest(self.top_k.get(entity_type, 0), items, key=lambda item: (item[1], -item[0]))
+                for entity_type, items in ranked.items()
+            }
         
-        for outline in outlines:
-            if self._calculate_relevance(outline.content, context) > 0.2:
-                relevant.append(outline)
+        if self.scorer == 'vector':
+            # 实体与段落块在同一次检索中打分
+            return self.vector_index.search(knowledge.novel['id'], [context], self.top_k)[0]
         
-        return relevant
+        limits = {entity_type: limit for entity_type, limit in self.top_k.items() if entity_type in self.index.MODELS}
+        return knowledge.ranker.top_k(self.index.term_ids(context), limits)
     
-    def _calculate_relevance(self, text1: str, text2: str) -> float:
-        """计算两个文本的相关性（简单的关键词匹配）"""
-        if not text1 or not text2:
-            return 0.0
+    def _retrieve_passages(self, novel_id: int, knowledge: NovelKnowledge, context: str,
+                           ranked: Optional[List[Tuple[int, float]]] = None) -> List[Dict[str, Any]]:
+        """检索相关段落（已排好序的段落块可直接传入），按章节顺序返回，并附上最新章节的结尾段落"""
+        if ranked is None:
+            corpus_size, avg_length = knowledge.chunk_stats
+            ranked = self.index.search_chunks(novel_id, context, self.top_k.get('chunk', 0), corpus_size, avg_length)
+        scores = dict(ranked)
+        
+        chunks = ChapterChunk.query.filter(ChapterChunk.id.in_(list(scores))).all() if scores else []
+        titles = dict(db.session.query(Chapter.id, Chapter.title).filter(
+            Chapter.id.in_({chunk.chapter_id for chunk in chunks})
+        ).all()) if chunks else {}
+        passages = [self._passage_dict(chunk, titles.get(chunk.chapter_id, ''), scores[chunk.id]) for chunk in chunks]
         
-        # 提取关键词
-        words1 = set(re.findall(r'\w+', text1.lower()))
-        words2 = set(re.findall(r'\w+', text2.lower()))
+        closing = knowledge.closing_passage
+        if closing and closing['id'] not in scores:
+            passages.append(dict(closing))
+        
+        return sorted(passages, key=lambda passage: (passage['chapter_number'], passage['position']))
+    
+    def _passage_dict(self, chunk: ChapterChunk, chapter_title: str, score: float) -> Dict[str, Any]:
+        return {
+            'id': chunk.id,
+            'chapter_id': chunk.chapter_id,
+            'chapter_number': chunk.chapter_number,
+            'title': chapter_title,
+            'position': chunk.position,
+            'content': chunk.content,
+            'relevance_score': score
+        }
+    
+    def _score_candidates(self, knowledge: NovelKnowledge, context: str) -> Dict[Tuple[str, int], float]:
+        """计算候选实体与上下文的交并比相关性（基于预先计算的词项签名）"""
+        context_signature = self.index.signature_of(context)
+        candidates = set()
+        for term_id in context_signature:
+            candidates.update(knowledge.postings.get(term_id, ()))
+        
+        return {
+            key: self._calculate_relevance(knowledge.signatures[key], context_signature)
+            for key in candidates
+        }
+    
+    def _select_entities(self, knowledge: NovelKnowledge, entity_type: str,
+                         ranked: Dict[str, List[Tuple[int, float]]], mentioned: Set[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        """合并名称命中的实体与得分最高的实体，附带相关度得分"""
+        entities = knowledge.entities[entity_type]
+        scores = dict(ranked.get(entity_type, []))
         
-        # 计算交集比例
-        if not words1 or not words2:
+        selected_ids = [
+            entity_id for entity_id in entities
+            if (entity_type, entity_id) in mentioned
+        ]
+        selected_ids += [
+            entity_id for entity_id, _ in ranked.get(entity_type, [])
+            if entity_id not in selected_ids
+        ]
+        
+        return [
+            dict(entities[entity_id], relevance_score=scores.get(entity_id, 0.0))
+            for entity_id in selected_ids
+        ]
+    
+    def _calculate_relevance(self, signature1: FrozenSet[int], signature2: FrozenSet[int]) -> float:
+        """计算两个词项签名的相关性（交并比）"""
+        if not signature1 or not signature2:
             return 0.0
         
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
+        intersection = len(signature1 & signature2)
+        union = len(signature1) + len(signature2) - intersection
         
-        return len(intersection) / len(union) if union else 0.0
+        return intersection / union if union else 0.0
     
     def update_knowledge_base(self, novel_id: int):
         """更新知识库"""
-        # 清除缓存
-        if novel_id in self.knowledge_cache:
-            del self.knowledge_cache[novel_id]
+        # 重新构建知识索引
+        self.index.rebuild(novel_id)
+        simhash_index.rebuild(novel_id)
+        db.session.commit()
+        self.vector_index.rebuild(novel_id)
         
-        # 重新构建知识索引（这里可以添加更复杂的索引逻辑）
+        # 清除缓存
+        self.knowledge_cache.invalidate(novel_id)
         print(f"知识库已更新：小说ID {novel_id}")
     
     def get_knowledge_summary(self, novel_id: int) -> Dict[str, Any]:
         """获取知识库摘要"""
         try:
-            novel = Novel.query.get(novel_id)
-            if not novel:
+            # 一次查询读取小说、统计行与最新章节
+            row = db.session.query(Novel, NovelStats, Chapter).outerjoin(
+                NovelStats, NovelStats.novel_id == Novel.id
+            ).outerjoin(
+                Chapter, Chapter.id == NovelStats.latest_chapter_id
+            ).filter(Novel.id == novel_id).first()
+            if not row:
                 raise ValueError(f"小说ID {novel_id} 不存在")
             
-            # 统计信息
-            chapter_count = Chapter.query.filter_by(novel_id=novel_id).count()
-            character_count = Character.query.filter_by(novel_id=novel_id).count()
-            setting_count = Setting.query.filter_by(novel_id=novel_id).count()
-            outline_count = Outline.query.filter_by(novel_id=novel_id).count()
-            
-            # 计算总字数
-            chapters = Chapter.query.filter_by(novel_id=novel_id).all()
-            total_words = sum(len(chapter.content) for chapter in chapters)
-            
-            # 获取最新章节
-            latest_chapter = Chapter.query.filter_by(novel_id=novel_id).order_by(Chapter.chapter_number.desc()).first()
+            novel, stats, latest_chapter = row
+            if stats is None:
+                # 旧数据尚无统计行，重新统计一次
+                stats = NovelStatistics().recompute(novel_id)
+                db.session.commit()
+                latest_chapter = Chapter.query.get(stats.latest_chapter_id) if stats.latest_chapter_id else None
             
             return {
                 'novel_title': novel.title,
                 'novel_description': novel.description,
                 'statistics': {
-                    'chapter_count': chapter_count,
-                    'character_count': character_count,
-                    'setting_count': setting_count,
-                    'outline_count': outline_count,
-                    'total_words': total_words
+                    'chapter_count': stats.chapter_count,
+                    'character_count': stats.character_count,
+                    'setting_count': stats.setting_count,
+                    'outline_count': stats.outline_count,
+                    'total_words': stats.total_chars,
+                    'word_count': stats.total_word_count
                 },
                 'latest_chapter': latest_chapter.to_dict() if latest_chapter else None,
                 'last_updated': novel.updated_at.isoformat() if novel.updated_at else None
@@ -0,0 +1,152 @@
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# 各模型的上下文窗口（token）
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4o-mini': 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+_CJK_CHAR = re.compile(r'[㐀-䶿一-鿿豈-﫿　-〿＀-￯]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文字符及全角标点约1个token，其余约4个字符1个token"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_CHAR.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+def estimate_item_tokens(item: Any) -> int:
+    """估算一个知识条目序列化后的token数"""
+    return estimate_tokens(json.dumps(item, ensure_ascii=False, separators=(',', ':')))
+
+class KnowledgePacker:
+    """在token预算内挑选价值最高的知识条目（按相关度做背包选择）"""
+
+    # 各类知识的基础价值权重
+    TYPE_WEIGHTS = {'characters': 1.0, 'settings': 0.8, 'outlines': 0.9, 'passages': 0.9, 'recent_chapters': 1.0}
+    # 最近章节按时间由近到远递减的价值
+    CHAPTER_RECENCY = [1.0, 0.7, 0.5]
+    # 动态规划时预算最多划分的格数
+    MAX_BUCKETS = 2000
+
+    def __init__(self, model: str, max_output_tokens: int = 2000, reserved_tokens: int = 800,
+                 budget: Optional[int] = None, context_window: Optional[int] = None):
+        # 指定context_window时使用该窗口（如主模型与备用模型中较小的一个）
+        window = context_window or MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+        # 预算 = 上下文窗口 - 输出token - 提示词模板与上下文等预留
+        self.budget = budget if budget is not None else max(window - max_output_tokens - reserved_tokens, 0)
+
+    def pack(self, knowledge: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """返回裁剪后的知识及打包报告"""
+        if not knowledge:
+            return knowledge, {'budget': self.budget, 'used_tokens': 0, 'dropped': [], 'truncated': []}
+
+        # 小说基本信息始终保留
+        novel_tokens = estimate_item_tokens(knowledge.get('novel', {}))
+        groups = self._build_groups(knowledge)
+        choices = self._solve(groups, max(self.budget - novel_tokens, 0))
+
+        packed = {key: value for key, value in knowledge.items() if key not in self.TYPE_WEIGHTS}
+        for key in self.TYPE_WEIGHTS:
+            if key in knowledge:
+                packed[key] = []
+
+        used_tokens = novel_tokens
+        dropped, truncated = [], []
+        for group, choice in zip(groups, choices):
+            if choice is None:
+                dropped.append(self._describe(group[0]))
+                continue
+            variant = group[choice]
+            packed[variant['key']].append(variant['item'])
+            used_tokens += variant['tokens']
+            if choice > 0:
+                truncated.append(self._describe(variant))
+
+        return packed, {
+            'budget': self.budget,
+            'used_tokens': used_tokens,
+            'items_total': len(groups),
+            'items_packed': len(groups) - len(dropped),
+            'dropped': dropped,
+            'truncated': truncated
+        }
+
+    def _build_groups(self, knowledge: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+        """每个知识条目为一组候选（章节另有仅保留摘要的精简版本），同组至多选一个"""
+        groups = []
+        for key, type_weight in self.TYPE_WEIGHTS.items():
+            items = knowledge.get(key, [])
+            if key == 'recent_chapters':
+                for position, chapter in enumerate(items):
+                    recency = self.CHAPTER_RECENCY[min(position, len(self.CHAPTER_RECENCY) - 1)]
+                    value = type_weight * recency
+                    variants = [self._variant(key, chapter, value)]
+                    if chapter.get('content'):
+                        summary_only = {field: v for field, v in chapter.items() if field != 'content'}
+                        variants.append(self._variant(key, summary_only, value * 0.6))
+                    groups.append(variants)
+                continue
+
+            max_score = max((item.get('relevance_score', 0.0) for item in items), default=0.0)
+            for item in items:
+                normalized = item.get('relevance_score', 0.0) / max_score if max_score > 0 else 0.0
+                # 名称直接命中或兜底返回的实体得分可能为0，仍保留基础价值
+                groups.append([self._variant(key, item, type_weight * (0.5 + 0.5 * normalized))])
+
+        return groups
+
+    def _variant(self, key: str, item: Dict[str, Any], value: float) -> Dict[str, Any]:
+        return {'key': key, 'item': item, 'value': value, 'tokens': estimate_item_tokens(item)}
+
+    def _solve(self, groups: List[List[Dict[str, Any]]], budget: int) -> List[Optional[int]]:
+        """分组背包：在预算内最大化总价值，返回每组选中的版本下标（None为丢弃）"""
+        if not groups:
+            return []
+
+        # 预算较大时按粒度划分格子，控制计算量
+        unit = max(1, math.ceil(budget / self.MAX_BUCKETS))
+        capacity = budget // unit
+        best = [0.0] * (capacity + 1)
+        picks = []
+
+        for group in groups:
+            weights = [math.ceil(variant['tokens'] / unit) for variant in group]
+            new_best = list(best)
+            pick = [None] * (capacity + 1)
+            for index, (variant, weight) in enumerate(zip(group, weights)):
+                for remaining in range(weight, capacity + 1):
+                    candidate = best[remaining - weight] + variant['value']
+                    if candidate > new_best[remaining]:
+                        new_best[remaining] = candidate
+                        pick[remaining] = index
+            best = new_best
+            picks.append((pick, weights))
+
+        # 回溯每组的选择
+        choices = []
+        remaining = capacity
+        for pick, weights in reversed(picks):
+            choice = pick[remaining]
+            choices.append(choice)
+            if choice is not None:
+                remaining -= weights[choice]
+        choices.reverse()
+        return choices
+
+    def _describe(self, variant: Dict[str, Any]) -> Dict[str, Any]:
+        item = variant['item']
+        return {
+            'type': variant['key'],
+            'id': item.get('id'),
+            'name': item.get('name') or item.get('title'),
+            'tokens': variant['tokens'],
+            'value': round(variant['value'], 3)
+        }
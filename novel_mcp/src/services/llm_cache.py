@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+LLM_CACHE_PATH = os.getenv(
+    'LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'llm_cache.db')
+)
+
+class LLMResponseCache:
+    """按内容寻址的大模型响应缓存：SQLite持久化，过期时间与按容量的LRU淘汰"""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, enabled: Optional[bool] = None):
+        self.path = path or LLM_CACHE_PATH
+        self.ttl = ttl if ttl is not None else float(os.getenv('LLM_CACHE_TTL', '86400'))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+        self.enabled = enabled if enabled is not None else os.getenv('LLM_CACHE_ENABLED', '1') not in ('0', 'false', 'False')
+        # 每个线程使用独立的SQLite连接
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def key(self, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """由请求参数计算缓存键"""
+        payload = json.dumps(
+            {'model': model, 'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens},
+            ensure_ascii=False, sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        'CREATE TABLE IF NOT EXISTS llm_response ('
+                        'key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, '
+                        'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+                    )
+                    conn.execute('CREATE INDEX IF NOT EXISTS ix_llm_response_accessed ON llm_response (accessed_at)')
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存响应，命中时刷新访问时间"""
+        if not self.enabled:
+            return None
+        try:
+            conn = self._connection()
+            now = time.time()
+            row = conn.execute(
+                'SELECT response FROM llm_response WHERE key = ? AND created_at > ?',
+                (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                conn.execute('UPDATE llm_response SET accessed_at = ? WHERE key = ?', (now, key))
+            with self._stats_lock:
+                if row:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"读取大模型缓存时出错: {e}")
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        """写入响应，并按过期时间与容量淘汰旧条目"""
+        if not self.enabled or not response:
+            return
+        try:
+            conn = self._connection()
+            now = time.time()
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_response (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, response, len(response.encode('utf-8')), now, now)
+            )
+            with self._stats_lock:
+                self.writes += 1
+            self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"写入大模型缓存时出错: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        evicted = conn.execute('DELETE FROM llm_response WHERE created_at <= ?', (now - self.ttl,)).rowcount
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_response').fetchone()[0]
+        if total > self.max_bytes:
+            # 按最近访问时间从旧到新删除，直到总大小回到上限以内
+            excess = total - self.max_bytes
+            removed = 0
+            keys = []
+            for key, size in conn.execute('SELECT key, size FROM llm_response ORDER BY accessed_at'):
+                keys.append(key)
+                removed += size
+                if removed >= excess:
+                    break
+            conn.executemany('DELETE FROM llm_response WHERE key = ?', [(key,) for key in keys])
+            evicted += len(keys)
+        if evicted:
+            with self._stats_lock:
+                self.evictions += evicted
+
+    def clear(self) -> None:
+        """清空缓存"""
+        try:
+            self._connection().execute('DELETE FROM llm_response')
+        except sqlite3.Error as e:
+            print(f"清空大模型缓存时出错: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        entries, size = 0, 0
+        if self.enabled:
+            try:
+                entries, size = self._connection().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_response'
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"读取大模型缓存统计时出错: {e}")
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': entries,
+                'size_bytes': size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+llm_cache = LLMResponseCache()
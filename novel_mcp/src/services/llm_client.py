@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Any, Deque, Dict, Iterator, List, Optional
+import httpx
+import numpy as np
+import openai
+
+class LLMBusyError(RuntimeError):
+    """并发已满且排队超时"""
+
+# 给定总时间上限时在剩余时间内自行重试的错误（与SDK的重试条件一致：连接错误、超时、限流与服务端错误）
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+class LLMClient:
+    """进程内共享的大模型客户端：HTTP连接池复用、单次调用超时、并发上限与排队，以及可选的对冲请求"""
+
+    # 计算对冲阈值（p95）所需的最少样本数与保留的最近样本数
+    HEDGE_MIN_SAMPLES = 20
+    LATENCY_SAMPLES = 200
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                 queue_timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 hedge: Optional[bool] = None, hedge_delay: Optional[float] = None):
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.base_url = base_url or os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+        self.max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+        self.timeout = timeout or float(os.getenv('LLM_TIMEOUT', '60'))
+        # 等待并发名额的最长时间，超时后快速失败而不是无限堆积
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('LLM_MAX_RETRIES', '2'))
+        # 对冲：首个请求超过该模型近期延迟的p95仍未返回时，再发一个相同请求，取先返回者
+        self.hedge = hedge if hedge is not None else os.getenv('LLM_HEDGE', '0') in ('1', 'true', 'True')
+        # 样本不足时使用的对冲等待时间
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv('LLM_HEDGE_DELAY', '10'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix='llm')
+        self._latencies: Dict[str, Deque[float]] = {}
+
+        self._client: Optional[openai.OpenAI] = None
+        # 有总时间上限的调用使用关闭SDK重试的客户端（共享同一连接池）
+        self._budget_client: Optional[openai.OpenAI] = None
+        self._client_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_latency = 0.0
+        self.total_wait = 0.0
+
+    def _get_client(self) -> openai.OpenAI:
+        """延迟创建客户端，所有调用共享同一个连接池"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.max_concurrency,
+                            max_keepalive_connections=self.max_concurrency
+                        ),
+                        timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 10.0))
+                    )
+                    self._client = openai.OpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        timeout=self.timeout,
+                        max_retries=self.max_retries,
+                        http_client=http_client
+                    )
+                    self._budget_client = self._client.with_options(max_retries=0)
+        return self._client
+
+    def _acquire(self, timeout: Optional[float] = None) -> None:
+        with self._stats_lock:
+            self.waiting += 1
+        started = time.monotonic()
+        wait_timeout = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        acquired = self._semaphore.acquire(timeout=wait_timeout)
+        with self._stats_lock:
+            self.waiting -= 1
+            self.total_wait += time.monotonic() - started
+            if not acquired:
+                self.rejected += 1
+            else:
+                self.in_flight += 1
+        if not acquired:
+            raise LLMBusyError(f"大模型调用排队超时（{wait_timeout}秒）")
+
+    def _release(self, started: float, failed: bool, cancelled: bool = False) -> None:
+        self._semaphore.release()
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self.total_latency += time.monotonic() - started
+            if cancelled:
+                self.cancelled += 1
+            elif failed:
+                self.errors += 1
+
+    def chat(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+             timeout: Optional[float] = None, hedge: Optional[bool] = None) -> str:
+        """调用对话补全，返回生成的文本；timeout 为整次调用（含排队、重试与对冲）的时间上限，None表示不限"""
+        if not (self.hedge if hedge is None else hedge):
+            return self._call(model, messages, max_tokens, temperature, timeout)
+
+        started = time.monotonic()
+        primary = self._executor.submit(self._call, model, messages, max_tokens, temperature, timeout)
+        threshold = self.hedge_threshold(model)
+        try:
+            return primary.result(timeout=threshold if timeout is None else min(threshold, timeout))
+        except FutureTimeoutError:
+            pass
+
+        remaining = None if timeout is None else timeout - (time.monotonic() - started)
+        if remaining is not None and remaining <= 0:
+            return primary.result()
+
+        # 对冲请求不排队：没有空闲并发名额时只等待首个请求
+        backup = self._executor.submit(self._call, model, messages, max_tokens, temperature, remaining, 0)
+        with self._stats_lock:
+            self.hedges += 1
+
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if future is backup:
+                    with self._stats_lock:
+                        self.hedge_wins += 1
+                # 落后的请求无法中断，结果直接丢弃
+                return result
+        raise error
+
+    def _call(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+              timeout: Optional[float], acquire_timeout: Optional[float] = None) -> str:
+        """单次调用"""
+        started = time.monotonic()
+        self._acquire(timeout if acquire_timeout is None else acquire_timeout)
+        called, failed = time.monotonic(), True
+        try:
+            response = self._create(
+                started, timeout,
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+            failed = False
+            with self._stats_lock:
+                self._latencies.setdefault(model, deque(maxlen=self.LATENCY_SAMPLES)).append(time.monotonic() - called)
+            return response.choices[0].message.content
+        except openai.APITimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._release(called, failed)
+
+    def _create(self, started: float, budget: Optional[float], **kwargs):
+        """发起请求：未给定总时间时由SDK按单次超时重试；给定时关闭SDK重试，只在剩余时间内重试"""
+        client = self._get_client()
+        if budget is None:
+            return client.chat.completions.create(timeout=self.timeout, **kwargs)
+
+        attempt = 0
+        while True:
+            left = budget - (time.monotonic() - started)
+            if left <= 0:
+                raise openai.APITimeoutError(request=httpx.Request('POST', self.base_url))
+            try:
+                return self._budget_client.chat.completions.create(timeout=min(self.timeout, left), **kwargs)
+            except RETRYABLE_ERRORS:
+                # 退避时间与SDK相同；剩余时间不足以再试一次时直接抛出
+                delay = min(0.5 * 2 ** attempt, 8.0)
+                attempt += 1
+                if attempt > self.max_retries or budget - (time.monotonic() - started) <= delay:
+                    raise
+                time.sleep(delay)
+
+    def hedge_threshold(self, model: str) -> float:
+        """对冲等待时间：该模型近期成功调用延迟的p95"""
+        with self._stats_lock:
+            samples = list(self._latencies.get(model, ()))
+        if len(samples) < self.HEDGE_MIN_SAMPLES:
+            return self.hedge_delay
+        return float(np.percentile(samples, 95))
+
+    def stream_chat(self, model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                    timeout: Optional[float] = None) -> Iterator[str]:
+        """流式调用对话补全，逐段产出文本；流结束前一直占用并发名额"""
+        queued = time.monotonic()
+        self._acquire(timeout)
+        started, failed, cancelled = time.monotonic(), True, False
+        try:
+            stream = self._create(
+                queued, timeout,
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+            with stream:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+            failed = False
+        except openai.APITimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        except GeneratorExit:
+            # 调用方提前停止读取（如候选被取消），关闭流即中止上游生成
+            cancelled = True
+            raise
+        finally:
+            self._release(started, failed, cancelled)
+
+    def stats(self) -> Dict[str, Any]:
+        """调用统计"""
+        with self._stats_lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'calls': self.calls,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled,
+                'timeouts': self.timeouts,
+                'hedge_enabled': self.hedge,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'avg_latency': self.total_latency / self.calls if self.calls else 0.0,
+                'avg_wait': self.total_wait / (self.calls + self.rejected) if self.calls + self.rejected else 0.0
+            }
+
+llm_client = LLMClient()
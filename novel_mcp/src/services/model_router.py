@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Generator, List, Optional, Tuple
+import openai
+from src.services.llm_client import LLMBusyError, llm_client
+from src.services.knowledge_packer import DEFAULT_CONTEXT_WINDOW, MODEL_CONTEXT_WINDOWS, estimate_tokens
+from src.services.deadline import Deadline
+
+# 默认路由：未配置时各阶段都使用同一模型，与原有行为一致
+DEFAULT_MODEL = os.getenv('LLM_MODEL', 'gpt-3.5-turbo')
+DEFAULT_ROUTES = {
+    'generate': {'model': DEFAULT_MODEL, 'fallback': None, 'max_tokens': 2000},
+    'improve': {'model': DEFAULT_MODEL, 'fallback': None, 'max_tokens': 2000},
+    'patch': {'model': DEFAULT_MODEL, 'fallback': None, 'max_tokens': 2000},
+    'suggest': {'model': DEFAULT_MODEL, 'fallback': None, 'max_tokens': 1500},
+}
+
+# 触发切换到备用模型的错误：超时、限流与本地排队超时
+FALLBACK_ERRORS = (openai.APITimeoutError, openai.RateLimitError, LLMBusyError)
+
+def load_routes(config: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """读取路由配置：LLM_ROUTES 可以是JSON字符串或JSON文件路径，按阶段覆盖默认值"""
+    config = config if config is not None else os.getenv('LLM_ROUTES', '')
+    routes = {stage: dict(route) for stage, route in DEFAULT_ROUTES.items()}
+    if not config:
+        return routes
+    try:
+        if config.lstrip().startswith('{'):
+            overrides = json.loads(config)
+        else:
+            with open(config, 'r', encoding='utf-8') as f:
+                overrides = json.load(f)
+        for stage, route in overrides.items():
+            routes.setdefault(stage, dict(DEFAULT_ROUTES['generate'])).update(route)
+    except Exception as e:
+        print(f"读取模型路由配置时出错: {e}")
+    return routes
+
+class ModelRouter:
+    """按流水线阶段选择模型与输出token上限，主模型超时或限流时切换到备用模型，并按阶段统计延迟与token"""
+
+    def __init__(self, routes: Optional[Dict[str, Dict[str, Any]]] = None, client=None):
+        self.routes = routes or load_routes()
+        self.llm = client or llm_client
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def route(self, stage: str) -> Dict[str, Any]:
+        """阶段对应的路由，未知阶段使用生成阶段的配置"""
+        return self.routes.get(stage) or self.routes['generate']
+
+    def model(self, stage: str) -> str:
+        return self.route(stage)['model']
+
+    def max_tokens(self, stage: str) -> int:
+        return int(self.route(stage)['max_tokens'])
+
+    def context_window(self, stage: str) -> int:
+        """阶段可能用到的主模型与备用模型中较小的上下文窗口，切换到备用模型时提示词同样放得下"""
+        return min(MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) for model in self._models(stage))
+
+    def chat(self, stage: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+             deadline: Optional[Deadline] = None) -> Tuple[str, str]:
+        """调用阶段对应的模型，返回 (生成的文本, 实际使用的模型)"""
+        deadline = deadline or Deadline()
+        models = self._models(stage)
+        for attempt, model in enumerate(models):
+            started = time.monotonic()
+            try:
+                text = self.llm.chat(
+                    model=model, messages=messages, max_tokens=max_tokens, temperature=temperature,
+                    timeout=deadline.remaining()
+                )
+            except FALLBACK_ERRORS as e:
+                self._record(stage, model, started, messages, None, failed=True)
+                if attempt + 1 == len(models) or deadline.expired():
+                    raise
+                print(f"模型 {model} 调用失败，切换到备用模型: {e}")
+                continue
+            except Exception:
+                self._record(stage, model, started, messages, None, failed=True)
+                raise
+            self._record(stage, model, started, messages, text, fallback=attempt > 0)
+            return text, model
+
+    def stream_chat(self, stage: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                    deadline: Optional[Deadline] = None) -> Generator[str, None, str]:
+        """流式调用，结束时返回实际使用的模型；只有尚未收到任何输出时才切换到备用模型"""
+        deadline = deadline or Deadline()
+        models = self._models(stage)
+        for attempt, model in enumerate(models):
+            started = time.monotonic()
+            received = []
+            try:
+                for delta in self.llm.stream_chat(
+                    model=model, messages=messages, max_tokens=max_tokens, temperature=temperature,
+                    timeout=deadline.remaining()
+                ):
+                    received.append(delta)
+                    yield delta
+            except FALLBACK_ERRORS as e:
+                self._record(stage, model, started, messages, ''.join(received), failed=True)
+                if received or attempt + 1 == len(models) or deadline.expired():
+                    raise
+                print(f"模型 {model} 调用失败，切换到备用模型: {e}")
+                continue
+            except GeneratorExit:
+                # 调用方提前停止读取，不计为错误
+                self._record(stage, model, started, messages, ''.join(received))
+                raise
+            except BaseException:
+                self._record(stage, model, started, messages, ''.join(received), failed=True)
+                raise
+            self._record(stage, model, started, messages, ''.join(received), fallback=attempt > 0)
+            return model
+
+    def _models(self, stage: str) -> List[str]:
+        route = self.route(stage)
+        fallback = route.get('fallback')
+        return [route['model']] + ([fallback] if fallback and fallback != route['model'] else [])
+
+    def _record(self, stage: str, model: str, started: float, messages: List[Dict[str, str]],
+                output: Optional[str], failed: bool = False, fallback: bool = False) -> None:
+        """记录一次调用的延迟与估算的输入/输出token"""
+        latency = time.monotonic() - started
+        prompt_tokens = sum(estimate_tokens(message.get('content', '')) for message in messages)
+        with self._lock:
+            stats = self._stats.setdefault(stage, {
+                'calls': 0, 'errors': 0, 'fallbacks': 0, 'total_latency': 0.0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'models': {}
+            })
+            stats['calls'] += 1
+            stats['total_latency'] += latency
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += estimate_tokens(output or '')
+            stats['models'][model] = stats['models'].get(model, 0) + 1
+            if failed:
+                stats['errors'] += 1
+            if fallback:
+                stats['fallbacks'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段的路由配置与调用统计（token为估算值）"""
+        with self._lock:
+            result = {}
+            for stage in sorted(set(self.routes) | set(self._stats)):
+                stats = dict(self._stats.get(stage, {}))
+                calls = stats.pop('calls', 0)
+                total_latency = stats.pop('total_latency', 0.0)
+                result[stage] = dict(
+                    route=dict(self.route(stage)),
+                    calls=calls,
+                    errors=stats.get('errors', 0),
+                    fallbacks=stats.get('fallbacks', 0),
+                    avg_latency=total_latency / calls if calls else 0.0,
+                    prompt_tokens=stats.get('prompt_tokens', 0),
+                    completion_tokens=stats.get('completion_tokens', 0),
+                    models=dict(stats.get('models', {}))
+                )
+            return result
+
+model_router = ModelRouter()
@@ -0,0 +1,116 @@
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+# 别名分隔符
+_ALIAS_SEPARATOR = re.compile(r'[,，、;；\n]')
+
+def split_aliases(aliases: str) -> List[str]:
+    """拆分以逗号/顿号等分隔的别名"""
+    if not aliases:
+        return []
+    return [alias.strip() for alias in _ALIAS_SEPARATOR.split(aliases) if alias.strip()]
+
+def entity_names(entity_type: str, entity: Dict[str, Any]) -> List[Tuple[str, str, int]]:
+    """实体的名称与别名，返回 (名称, 类型, ID) 列表"""
+    names = [entity.get('name') or ''] + split_aliases(entity.get('aliases') or '')
+    return [(name, entity_type, entity['id']) for name in names if name]
+
+class NameMatcher:
+    """Aho-Corasick多模式匹配：一次线性扫描找出文本中所有人物/设定名称"""
+
+    def __init__(self, names: Iterable[Tuple[str, str, int]]):
+        # 每个节点：子节点表、失败指针、输出（名称长度, 名称, 类型, ID）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str, str, int]]] = [[]]
+
+        for name, entity_type, entity_id in names:
+            pattern = name.lower()
+            if pattern:
+                self._add(pattern, (len(pattern), name, entity_type, entity_id))
+        self._build()
+
+    def _add(self, pattern: str, output: Tuple[int, str, str, int]) -> None:
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(output)
+
+    def _build(self) -> None:
+        """按广度优先构建失败指针，并沿失败链合并输出"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text: str) -> List[Dict[str, Any]]:
+        """查找所有名称出现位置"""
+        mentions = []
+        if not text:
+            return mentions
+
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for position, char in enumerate(text.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, name, entity_type, entity_id in output[node]:
+                mentions.append({
+                    'start': position - length + 1,
+                    'end': position + 1,
+                    'name': name,
+                    'entity_type': entity_type,
+                    'entity_id': entity_id
+                })
+
+        return mentions
+
+    def entities_in(self, text: str) -> Set[Tuple[str, int]]:
+        """文本中提到的实体集合"""
+        return {(mention['entity_type'], mention['entity_id']) for mention in self.find_all(text)}
+
+    @classmethod
+    def from_knowledge(cls, knowledge: Dict[str, Any]) -> 'NameMatcher':
+        """由知识字典中的人物与设定构建"""
+        names = []
+        for entity_type, key in (('character', 'characters'), ('setting', 'settings')):
+            for entity in knowledge.get(key, []):
+                names.extend(entity_names(entity_type, entity))
+        return cls(names)
+
+_MAX_MATCHERS = 64
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+def get_name_matcher(novel_id: int, names: List[Tuple[str, str, int]]) -> NameMatcher:
+    """获取小说的名称匹配器，名称集合未变化时复用已构建的自动机"""
+    fingerprint = tuple(sorted(names))
+    with _matchers_lock:
+        cached = _matchers.get(novel_id)
+        if cached and cached[0] == fingerprint:
+            _matchers.move_to_end(novel_id)
+            return cached[1]
+
+    matcher = NameMatcher(names)
+    with _matchers_lock:
+        _matchers[novel_id] = (fingerprint, matcher)
+        _matchers.move_to_end(novel_id)
+        while len(_matchers) > _MAX_MATCHERS:
+            _matchers.popitem(last=False)
+    return matcher
@@ -0,0 +1,130 @@
+import re
+from typing import Tuple
+from sqlalchemy import func
+from src.models.novel import Chapter, Character, Setting, Outline, NovelStats
+from src.database_init import db
+
+# 中文按字计数，其他文字按词计数
+_WORD_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]|[^\W㐀-䶿一-鿿豈-﫿]+')
+
+def count_words(text: str) -> Tuple[int, int]:
+    """统计文本的字符数与字数"""
+    if not text:
+        return 0, 0
+    return len(text), len(_WORD_PATTERN.findall(text))
+
+class NovelStatistics:
+    """小说统计信息维护：在写入路由的同一事务内增量更新，由调用方提交"""
+
+    ENTITY_COLUMNS = {
+        'character': NovelStats.character_count,
+        'setting': NovelStats.setting_count,
+        'outline': NovelStats.outline_count,
+    }
+
+    def create(self, novel_id: int) -> None:
+        """新建小说时初始化统计行"""
+        db.session.add(NovelStats(novel_id=novel_id))
+
+    def recompute(self, novel_id: int) -> NovelStats:
+        """从明细数据重新统计"""
+        stats = NovelStats.query.get(novel_id)
+        if stats is None:
+            stats = NovelStats(novel_id=novel_id)
+            db.session.add(stats)
+
+        # 补全尚未记录字数的章节
+        for chapter in Chapter.query.filter_by(novel_id=novel_id, char_count=None).all():
+            chapter.char_count, chapter.word_count = count_words(chapter.content)
+        db.session.flush()
+
+        stats.chapter_count, stats.total_chars, stats.total_word_count = db.session.query(
+            func.count(Chapter.id),
+            func.coalesce(func.sum(Chapter.char_count), 0),
+            func.coalesce(func.sum(Chapter.word_count), 0)
+        ).filter(Chapter.novel_id == novel_id).one()
+        stats.character_count = Character.query.filter_by(novel_id=novel_id).count()
+        stats.setting_count = Setting.query.filter_by(novel_id=novel_id).count()
+        stats.outline_count = Outline.query.filter_by(novel_id=novel_id).count()
+        self._refresh_latest_chapter(stats)
+        return stats
+
+    def chapter_added(self, chapter: Chapter) -> None:
+        """新增章节（章节需已flush获得ID）"""
+        chapter.char_count, chapter.word_count = count_words(chapter.content)
+        if not self._increment(chapter.novel_id, {
+            NovelStats.chapter_count: NovelStats.chapter_count + 1,
+            NovelStats.total_chars: NovelStats.total_chars + chapter.char_count,
+            NovelStats.total_word_count: NovelStats.total_word_count + chapter.word_count,
+        }):
+            return
+
+        NovelStats.query.filter(
+            NovelStats.novel_id == chapter.novel_id,
+            db.or_(
+                NovelStats.latest_chapter_number.is_(None),
+                NovelStats.latest_chapter_number <= chapter.chapter_number
+            )
+        ).update({
+            NovelStats.latest_chapter_id: chapter.id,
+            NovelStats.latest_chapter_number: chapter.chapter_number
+        }, synchronize_session=False)
+
+    def chapter_updated(self, chapter: Chapter) -> None:
+        """章节内容变化时更新字数"""
+        old_chars, old_words = chapter.char_count, chapter.word_count
+        chapter.char_count, chapter.word_count = count_words(chapter.content)
+        if old_chars is None or old_words is None:
+            self.recompute(chapter.novel_id)
+            return
+        if (chapter.char_count, chapter.word_count) == (old_chars, old_words):
+            return
+
+        self._increment(chapter.novel_id, {
+            NovelStats.total_chars: NovelStats.total_chars + (chapter.char_count - old_chars),
+            NovelStats.total_word_count: NovelStats.total_word_count + (chapter.word_count - old_words),
+        })
+
+    def chapter_removed(self, chapter: Chapter) -> None:
+        """删除章节（在session.delete之后、提交之前调用）"""
+        if chapter.char_count is None or chapter.word_count is None:
+            db.session.flush()
+            self.recompute(chapter.novel_id)
+            return
+
+        if not self._increment(chapter.novel_id, {
+            NovelStats.chapter_count: NovelStats.chapter_count - 1,
+            NovelStats.total_chars: NovelStats.total_chars - chapter.char_count,
+            NovelStats.total_word_count: NovelStats.total_word_count - chapter.word_count,
+        }):
+            return
+
+        stats = NovelStats.query.get(chapter.novel_id)
+        if stats.latest_chapter_id == chapter.id:
+            db.session.flush()
+            self._refresh_latest_chapter(stats)
+
+    def entity_added(self, entity_type: str, novel_id: int) -> None:
+        """新增人物/设定/大纲"""
+        column = self.ENTITY_COLUMNS[entity_type]
+        self._increment(novel_id, {column: column + 1})
+
+    def entity_removed(self, entity_type: str, novel_id: int) -> None:
+        """删除人物/设定/大纲"""
+        column = self.ENTITY_COLUMNS[entity_type]
+        self._increment(novel_id, {column: column - 1})
+
+    def _increment(self, novel_id: int, values) -> bool:
+        """原子地增量更新统计行；统计行缺失时整体重新统计，返回是否为增量更新"""
+        updated = NovelStats.query.filter_by(novel_id=novel_id).update(values, synchronize_session=False)
+        if not updated:
+            db.session.flush()
+            self.recompute(novel_id)
+            return False
+        return True
+
+    def _refresh_latest_chapter(self, stats: NovelStats) -> None:
+        latest = db.session.query(Chapter.id, Chapter.chapter_number).filter_by(
+            novel_id=stats.novel_id
+        ).order_by(Chapter.chapter_number.desc()).first()
+        stats.latest_chapter_id, stats.latest_chapter_number = latest if latest else (None, None)
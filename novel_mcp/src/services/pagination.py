@@ -0,0 +1,91 @@
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import and_, or_
+from src.database_init import db
+
+# 单页条数上限，未指定limit但提供了cursor时使用默认值
+PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '50'))
+PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '500'))
+
+# 列表接口不返回的内部列
+_HIDDEN_COLUMNS = {'token_signature'}
+
+class PaginationError(ValueError):
+    """分页或字段参数无效"""
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把最后一条记录的排序键编码为不透明的游标"""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except Exception:
+        raise PaginationError('cursor参数无效')
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError('cursor参数无效')
+    return values
+
+def _serialize(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class ListQuery:
+    """列表接口的键集（游标）分页与字段投影：只查询请求的列，按排序键续读而不是OFFSET"""
+
+    def __init__(self, model, order_by: Sequence[str] = ('id',)):
+        self.model = model
+        # 排序键最后一列必须唯一（主键），保证游标位置确定
+        self.order_by = list(order_by) if order_by[-1] == 'id' else list(order_by) + ['id']
+        self.fields = [column.name for column in model.__table__.columns if column.name not in _HIDDEN_COLUMNS]
+
+    def parse_fields(self, fields: Optional[str]) -> List[str]:
+        """解析逗号分隔的fields参数，未指定时返回全部字段"""
+        if not fields:
+            return list(self.fields)
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in self.fields]
+        if unknown:
+            raise PaginationError(f"未知字段: {', '.join(unknown)}")
+        return list(dict.fromkeys(requested))
+
+    def fetch(self, filters: Optional[Dict[str, Any]] = None, fields: Optional[str] = None,
+              limit: Optional[int] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """返回 {'items': [...], 'next_cursor': ...}；limit与cursor都未提供时返回全部记录"""
+        selected = self.parse_fields(fields)
+        # 排序键总是参与查询，用于生成下一页游标，未请求的排序键不出现在结果中
+        columns = list(dict.fromkeys(selected + self.order_by))
+        keys = [getattr(self.model, name) for name in self.order_by]
+
+        query = db.session.query(*[getattr(self.model, name) for name in columns])
+        if filters:
+            query = query.filter_by(**filters)
+        if cursor:
+            query = query.filter(self._after(keys, decode_cursor(cursor, len(keys))))
+        query = query.order_by(*keys)
+
+        paginated = limit is not None or cursor is not None
+        if paginated:
+            limit = min(max(limit if limit is not None else PAGE_SIZE_DEFAULT, 1), PAGE_SIZE_MAX)
+            # 多取一条判断是否还有下一页
+            rows = query.limit(limit + 1).all()
+        else:
+            rows = query.all()
+
+        next_cursor = None
+        if paginated and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]._mapping
+            next_cursor = encode_cursor([_serialize(last[name]) for name in self.order_by])
+
+        items = [{name: _serialize(row._mapping[name]) for name in selected} for row in rows]
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def _after(self, keys, values: List[Any]):
+        """(k1, k2, ...) > (v1, v2, ...) 的展开形式，各数据库都能使用排序键上的索引"""
+        conditions = []
+        for position, key in enumerate(keys):
+            conditions.append(and_(*[keys[i] == values[i] for i in range(position)], key > values[position]))
+        return or_(*conditions)
@@ -0,0 +1,80 @@
+import json
+from typing import Any, Dict, List, Tuple
+from src.services.knowledge_packer import estimate_tokens
+
+# 每次请求都可能变化的字段，不写入提示词，保证前缀稳定
+VOLATILE_FIELDS = frozenset({'relevance_score', 'created_at', 'updated_at'})
+
+def compact_json(value: Any) -> str:
+    """紧凑且确定的JSON序列化（键排序、无缩进）"""
+    return json.dumps(_strip_volatile(value), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _strip_volatile(item) for key, item in value.items() if key not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+class Prompt:
+    """组装好的对话消息及各部分的token统计"""
+
+    def __init__(self, messages: List[Dict[str, str]], sections: List[Tuple[str, int]], prefix_tokens: int):
+        self.messages = messages
+        self.sections = sections
+        self.prefix_tokens = prefix_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(tokens for _, tokens in self.sections)
+        return {
+            'sections': dict(self.sections),
+            'prefix_tokens': self.prefix_tokens,
+            'variable_tokens': total - self.prefix_tokens,
+            'total_tokens': total
+        }
+
+class PromptBuilder:
+    """提示词组装：系统提示、任务说明与小说静态资料构成字节稳定的前缀，可变内容放在最后
+
+    系统提示、小说背景与任务说明对同一部小说的同一任务始终不变；其后的人物与设定按ID排序，
+    选中相同实体时前缀继续保持一致，便于服务端的前缀缓存命中。
+    """
+
+    # 每部小说相对稳定的资料，人物与设定按ID排序
+    STATIC_SECTIONS = [('novel', '小说背景'), ('characters', '人物信息'), ('settings', '世界观设定')]
+
+    def __init__(self, system_prompt: str, instructions: str):
+        self.system_prompt = system_prompt
+        self.instructions = instructions.strip()
+
+    def build(self, knowledge: Dict[str, Any], variable_sections: List[Tuple[str, str, Any]]) -> Prompt:
+        """variable_sections 为 (名称, 标题, 内容) 列表，按顺序追加在前缀之后；内容为字符串时原样写入"""
+        sections = [('system', estimate_tokens(self.system_prompt))]
+        parts = []
+
+        for key, title in self.STATIC_SECTIONS:
+            value = knowledge.get(key, {} if key == 'novel' else [])
+            if isinstance(value, list):
+                value = sorted(value, key=lambda item: item.get('id') or 0)
+            parts.append(self._section(title, compact_json(value), key, sections))
+            if key == 'novel':
+                parts.append(self._section(None, self.instructions, 'instructions', sections))
+        prefix_tokens = sum(tokens for _, tokens in sections)
+
+        for name, title, value in variable_sections:
+            text = value if isinstance(value, str) else compact_json(value)
+            parts.append(self._section(title, text, name, sections))
+
+        return Prompt(
+            messages=[
+                {'role': 'system', 'content': self.system_prompt},
+                {'role': 'user', 'content': '\n\n'.join(parts)}
+            ],
+            sections=sections,
+            prefix_tokens=prefix_tokens
+        )
+
+    def _section(self, title: str, text: str, name: str, sections: List[Tuple[str, int]]) -> str:
+        part = f"{title}：\n{text}" if title else text
+        sections.append((name, estimate_tokens(part)))
+        return part
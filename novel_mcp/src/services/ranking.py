@@ -0,0 +1,84 @@
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from scipy import sparse
+
+class BM25Ranker:
+    """BM25批量打分：用稀疏矩阵一次计算所有实体的得分，并按类型取top-k"""
+
+    def __init__(self, documents: Dict[Tuple[str, int], Dict[Hashable, int]], k1: float = 1.5, b: float = 0.75,
+                 doc_lengths: Optional[Sequence[float]] = None, corpus_size: Optional[int] = None,
+                 avg_length: Optional[float] = None):
+        """documents 只包含候选实体时，需传入整个语料的统计量（文档长度、总数、平均长度）"""
+        self.keys = list(documents.keys())
+        self.types = np.array([entity_type for entity_type, _ in self.keys], dtype=object)
+        self.ids = np.array([entity_id for _, entity_id in self.keys], dtype=np.int64)
+        self.vocabulary: Dict[Hashable, int] = {}
+
+        rows, cols, frequencies = [], [], []
+        for row, term_frequencies in enumerate(documents.values()):
+            for term, frequency in term_frequencies.items():
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                frequencies.append(frequency)
+
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+        frequencies = np.array(frequencies, dtype=np.float32)
+        shape = (len(self.keys), len(self.vocabulary))
+
+        # 文档长度与逆文档频率
+        if doc_lengths is None:
+            doc_lengths = np.bincount(rows, weights=frequencies, minlength=shape[0])
+        else:
+            doc_lengths = np.asarray(doc_lengths, dtype=np.float64)
+        if corpus_size is None:
+            corpus_size = shape[0]
+        if avg_length is None:
+            avg_length = doc_lengths.mean() if shape[0] else 0.0
+        doc_freqs = np.bincount(cols, minlength=shape[1])
+        idf = np.log1p((corpus_size - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+        # 预先计算每个 (实体, 词项) 的BM25权重，查询时只需按列求和
+        length_norm = k1 * (1 - b + b * doc_lengths / avg_length) if avg_length else np.full(shape[0], k1)
+        weights = idf[cols] * frequencies * (k1 + 1) / (frequencies + length_norm[rows])
+        self.weights = sparse.csc_matrix((weights, (rows, cols)), shape=shape, dtype=np.float32)
+
+        self._type_rows = {
+            entity_type: np.flatnonzero(self.types == entity_type)
+            for entity_type in set(self.types.tolist())
+        }
+
+    def score(self, query_terms: Iterable[Hashable]) -> np.ndarray:
+        """计算所有实体对查询的BM25得分"""
+        counts = Counter(term for term in query_terms if term in self.vocabulary)
+        if not counts:
+            return np.zeros(len(self.keys), dtype=np.float32)
+
+        cols = np.fromiter((self.vocabulary[term] for term in counts), dtype=np.int64, count=len(counts))
+        query = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return self.weights[:, cols] @ query
+
+    def top_k(self, query_terms: Iterable[Hashable], limits: Dict[str, int]) -> Dict[str, List[Tuple[int, float]]]:
+        """按实体类型返回得分最高的k个实体 (ID, 得分)，只包含得分大于0的实体"""
+        scores = self.score(query_terms)
+        ranked = {}
+
+        for entity_type, limit in limits.items():
+            rows = self._type_rows.get(entity_type)
+            if rows is None or limit <= 0:
+                ranked[entity_type] = []
+                continue
+
+            type_scores = scores[rows]
+            positive = np.flatnonzero(type_scores > 0)
+            if positive.size > limit:
+                positive = positive[np.argpartition(-type_scores[positive], limit - 1)[:limit]]
+
+            # 得分降序，同分按ID升序，保证结果稳定
+            order = np.lexsort((self.ids[rows[positive]], -type_scores[positive]))
+            ranked[entity_type] = [
+                (int(self.ids[rows[i]]), float(type_scores[i])) for i in positive[order]
+            ]
+
+        return ranked
@@ -0,0 +1,41 @@
+import hashlib
+import re
+from collections import Counter
+from typing import List, Optional
+import numpy as np
+
+# 指纹位数与分段数（每段16位）：至少一段完全相同的段落才作为候选
+FINGERPRINT_BITS = 64
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+# 判定为近似重复的最大汉明距离：距离不超过3时必有一段相同（保证找到），更大的距离按概率找到
+MAX_DISTANCE = 6
+# 过短的段落（如单句对白）重复很常见，不参与检测
+MIN_PARAGRAPH_LENGTH = 20
+SHINGLE_SIZE = 3
+
+_IGNORED = re.compile(r'[\s\W_]+')
+_BIT_SHIFTS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+def simhash(text: str) -> Optional[int]:
+    """段落的64位simhash（去掉空白与标点后取3字符片段），过短的段落返回None"""
+    normalized = _IGNORED.sub('', (text or '').lower())
+    if len(normalized) < MIN_PARAGRAPH_LENGTH:
+        return None
+    shingles = Counter(normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1))
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little') for shingle in shingles],
+        dtype=np.uint64
+    )
+    weights = np.array(list(shingles.values()), dtype=np.int64)
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int64)
+    votes = ((bits * 2 - 1) * weights[:, None]).sum(axis=0)
+    return sum(1 << int(bit) for bit in np.flatnonzero(votes > 0))
+
+def bands(fingerprint: int) -> List[int]:
+    """把指纹切成4个16位分段"""
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (BAND_BITS * band)) & mask for band in range(BANDS)]
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
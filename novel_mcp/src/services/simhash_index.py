@@ -0,0 +1,151 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import inspect
+from sqlalchemy.orm import aliased
+from src.models.novel import Chapter
+from src.models.knowledge import ParagraphFingerprint
+from src.database_init import db
+from src.services.analyzed_document import paragraph_spans
+from src.services.simhash import BANDS, MAX_DISTANCE, bands, hamming, simhash
+
+_SQLITE_BATCH_SIZE = 500
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+class SimhashIndex:
+    """段落级simhash指纹索引：章节写入时维护，按分段（banded LSH）查找近似重复段落，无需两两比较"""
+
+    BAND_COLUMNS = ('band0', 'band1', 'band2', 'band3')
+
+    def index_chapter(self, chapter, force: bool = False) -> None:
+        """章节正文变化时重新计算段落指纹（章节需已获得ID，由调用方提交）"""
+        history = inspect(chapter).attrs.content.history
+        if not force and history.added == history.deleted:
+            return
+
+        # 不触发自动flush，保证后续的知识索引仍能读到正文的变更记录
+        with db.session.no_autoflush:
+            self.remove_chapter(chapter.id)
+            db.session.add_all([
+                ParagraphFingerprint(
+                    novel_id=chapter.novel_id,
+                    chapter_id=chapter.id,
+                    position=position,
+                    simhash=_to_signed(fingerprint),
+                    **dict(zip(self.BAND_COLUMNS, bands(fingerprint)))
+                )
+                for position, fingerprint in enumerate(self.fingerprints(chapter.content))
+                if fingerprint is not None
+            ])
+
+    def fingerprints(self, text: str) -> List[Optional[int]]:
+        """按段落（非空行）计算指纹，与审核使用的段落划分一致"""
+        return [simhash(text[start:end]) for start, end in paragraph_spans(text or '')]
+
+    def remove_chapter(self, chapter_id: int) -> None:
+        """删除章节的段落指纹（由调用方提交）"""
+        ParagraphFingerprint.query.filter_by(chapter_id=chapter_id).delete(synchronize_session=False)
+
+    def remove_novel(self, novel_id: int) -> None:
+        """删除整部小说的段落指纹（由调用方提交）"""
+        ParagraphFingerprint.query.filter_by(novel_id=novel_id).delete(synchronize_session=False)
+
+    def rebuild(self, novel_id: int) -> None:
+        """重建整部小说的段落指纹（由调用方提交）"""
+        self.remove_novel(novel_id)
+        for chapter in Chapter.query.filter_by(novel_id=novel_id).all():
+            self.index_chapter(chapter, force=True)
+
+    def find_near_duplicates(self, novel_id: int, fingerprints: Sequence[Optional[int]],
+                             exclude_chapter_id: Optional[int] = None) -> Dict[int, List[Dict[str, Any]]]:
+        """查找与给定段落指纹近似重复的已有段落，返回 段落下标 -> 匹配列表（按距离排序）"""
+        queries = [(index, fingerprint) for index, fingerprint in enumerate(fingerprints) if fingerprint is not None]
+        if not queries:
+            return {}
+
+        # 每个分段值对应的待查段落
+        band_lookup: List[Dict[int, List[Tuple[int, int]]]] = [{} for _ in range(BANDS)]
+        for index, fingerprint in queries:
+            for band, value in enumerate(bands(fingerprint)):
+                band_lookup[band].setdefault(value, []).append((index, fingerprint))
+
+        matches: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        for band, column in enumerate(self.BAND_COLUMNS):
+            values = list(band_lookup[band])
+            for start in range(0, len(values), _SQLITE_BATCH_SIZE):
+                query = db.session.query(
+                    ParagraphFingerprint.id, ParagraphFingerprint.chapter_id, ParagraphFingerprint.position,
+                    ParagraphFingerprint.simhash, getattr(ParagraphFingerprint, column), Chapter.chapter_number
+                ).join(Chapter, Chapter.id == ParagraphFingerprint.chapter_id).filter(
+                    ParagraphFingerprint.novel_id == novel_id,
+                    getattr(ParagraphFingerprint, column).in_(values[start:start + _SQLITE_BATCH_SIZE])
+                )
+                if exclude_chapter_id is not None:
+                    query = query.filter(ParagraphFingerprint.chapter_id != exclude_chapter_id)
+                for row_id, chapter_id, position, stored, value, chapter_number in query.all():
+                    stored = _to_unsigned(stored)
+                    for index, fingerprint in band_lookup[band][value]:
+                        distance = hamming(fingerprint, stored)
+                        if distance <= MAX_DISTANCE:
+                            matches.setdefault(index, {})[row_id] = {
+                                'chapter_id': chapter_id,
+                                'chapter_number': chapter_number,
+                                'paragraph': position,
+                                'distance': distance
+                            }
+
+        return {
+            index: sorted(found.values(), key=lambda match: (match['distance'], match['chapter_number'], match['paragraph']))
+            for index, found in matches.items()
+        }
+
+    def repetition_hotspots(self, novel_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """整部小说中近似重复段落最多的章节对（含同一章节内的重复）；
+        duplicate_paragraphs 为两章各自参与重复的段落数中的较大者，而不是相似段落对的个数"""
+        pairs = set()
+        for column in self.BAND_COLUMNS:
+            a = aliased(ParagraphFingerprint)
+            b = aliased(ParagraphFingerprint)
+            rows = db.session.query(
+                a.id, a.chapter_id, a.simhash, b.id, b.chapter_id, b.simhash
+            ).join(b, (a.novel_id == b.novel_id) & (getattr(a, column) == getattr(b, column)) & (a.id < b.id)).filter(
+                a.novel_id == novel_id
+            ).all()
+            for a_id, a_chapter, a_hash, b_id, b_chapter, b_hash in rows:
+                if hamming(_to_unsigned(a_hash), _to_unsigned(b_hash)) <= MAX_DISTANCE:
+                    # 按章节ID排序，first_id 为前一章（同一章节内为先出现）的段落
+                    if a_chapter <= b_chapter:
+                        pairs.add((a_chapter, b_chapter, a_id, b_id))
+                    else:
+                        pairs.add((b_chapter, a_chapter, b_id, a_id))
+
+        paragraphs: Dict[Tuple[int, int], Tuple[Set[int], Set[int]]] = {}
+        for first, second, first_id, second_id in pairs:
+            first_side, second_side = paragraphs.setdefault((first, second), (set(), set()))
+            first_side.add(first_id)
+            second_side.add(second_id)
+        counts = Counter({
+            chapters: max(len(first_side), len(second_side))
+            for chapters, (first_side, second_side) in paragraphs.items()
+        })
+        if not counts:
+            return []
+        numbers = dict(db.session.query(Chapter.id, Chapter.chapter_number).filter(
+            Chapter.id.in_({chapter_id for pair in counts for chapter_id in pair})
+        ).all())
+        hotspots = [
+            {
+                'chapters': [numbers.get(first), numbers.get(second)],
+                'chapter_ids': [first, second],
+                'duplicate_paragraphs': count
+            }
+            for (first, second), count in counts.items()
+        ]
+        hotspots.sort(key=lambda hotspot: (-hotspot['duplicate_paragraphs'], hotspot['chapters'][0] or 0, hotspot['chapters'][1] or 0))
+        return hotspots[:limit]
+
+simhash_index = SimhashIndex()
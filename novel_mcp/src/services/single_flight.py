@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SINGLE_FLIGHT_PATH = os.getenv(
+    'SINGLE_FLIGHT_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'single_flight.db')
+)
+
+class _Call:
+    """一次正在执行（或刚完成）的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished_at = 0.0
+
+class SingleFlight:
+    """相同请求合并：同一指纹的并发请求只执行一次，其余请求等待并共享结果
+
+    进程内按线程合并；开启 shared 时再通过SQLite在同一主机的多个工作进程间合并（结果需可JSON序列化）。
+    window 秒内刚完成的结果也直接复用。
+    """
+
+    # 跨进程等待时的轮询间隔（每次加倍，不超过上限），以及执行方失联后接管的时间
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1.0
+    LEASE_TIMEOUT = 120.0
+
+    def __init__(self, window: Optional[float] = None, shared: Optional[bool] = None, path: Optional[str] = None):
+        self.window = window if window is not None else float(os.getenv('SINGLE_FLIGHT_WINDOW', '0'))
+        self.shared = shared if shared is not None else os.getenv('SINGLE_FLIGHT_SHARED', '0') in ('1', 'true', 'True')
+        self.path = path or SINGLE_FLIGHT_PATH
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._owner = uuid.uuid4().hex
+        self.executions = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def fingerprint(self, namespace: str, payload: Dict[str, Any]) -> str:
+        """由请求名称与规范化后的参数计算指纹"""
+        normalized = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f'{namespace}:{normalized}'.encode('utf-8')).hexdigest()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或等待同指纹的调用，返回 (结果, 是否复用了其他请求的结果)"""
+        with self._lock:
+            self._purge_expired()
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            if self.shared:
+                call.result, shared = self._do_shared(key, fn)
+            else:
+                call.result = fn()
+                with self._lock:
+                    self.executions += 1
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.done.set()
+            with self._lock:
+                # 失败或不保留窗口时立即移除，后续请求重新执行
+                if (call.error is not None or self.window <= 0) and self._calls.get(key) is call:
+                    del self._calls[key]
+        return call.result, shared
+
+    def _purge_expired(self) -> None:
+        """移除超出复用窗口的已完成调用（调用方持有锁）"""
+        now = time.monotonic()
+        expired = [
+            key for key, call in self._calls.items()
+            if call.done.is_set() and now - call.finished_at > self.window
+        ]
+        for key in expired:
+            del self._calls[key]
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS single_flight ('
+                'key TEXT PRIMARY KEY, owner TEXT NOT NULL, started_at REAL NOT NULL, '
+                'finished_at REAL, result TEXT)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def _do_shared(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """跨进程合并：抢占成功的进程执行，其他进程只读轮询结果，间隔逐步加长"""
+        conn = self._connection()
+        # 本次请求到达前 window 秒内完成的结果可以复用，之后完成的结果都是本次等待的调用
+        reusable_since = time.time() - self.window
+        interval = self.POLL_INTERVAL
+        claimed = self._claim(conn, key, reusable_since)
+        while not claimed:
+            row = conn.execute('SELECT started_at, finished_at, result FROM single_flight WHERE key = ?', (key,)).fetchone()
+            if row and row[1] is not None and row[1] >= reusable_since:
+                with self._lock:
+                    self.shared_hits += 1
+                return json.loads(row[2]), True
+            if row is None or row[1] is not None or row[0] < time.time() - self.LEASE_TIMEOUT:
+                # 执行方失败释放了占用、结果已超出复用窗口或执行方已失联：重新抢占（过期记录在抢占时清理）
+                claimed = self._claim(conn, key, reusable_since)
+                continue
+            time.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+        try:
+            result = fn()
+            with self._lock:
+                self.executions += 1
+        except BaseException:
+            # 执行失败时释放占用，等待中的进程会自行重试
+            conn.execute('DELETE FROM single_flight WHERE key = ? AND owner = ?', (key, self._owner))
+            raise
+
+        conn.execute(
+            'UPDATE single_flight SET finished_at = ?, result = ? WHERE key = ? AND owner = ?',
+            (time.time(), json.dumps(result, ensure_ascii=False), key, self._owner)
+        )
+        self._delete_expired(conn)
+        return result, False
+
+    def _claim(self, conn: sqlite3.Connection, key: str, reusable_since: float) -> bool:
+        """清理过期记录（包括该指纹不可复用的旧结果）后尝试占用执行权"""
+        self._delete_expired(conn)
+        conn.execute('DELETE FROM single_flight WHERE key = ? AND finished_at < ?', (key, reusable_since))
+        return bool(conn.execute(
+            'INSERT OR IGNORE INTO single_flight (key, owner, started_at) VALUES (?, ?, ?)',
+            (key, self._owner, time.time())
+        ).rowcount)
+
+    def _delete_expired(self, conn: sqlite3.Connection) -> None:
+        """删除超出保留时间的结果与租约超时的占用，只在抢占与完成时执行"""
+        now = time.time()
+        # 完成的结果至少保留两个最长轮询周期，保证等待中的进程能读到
+        retention = max(self.window, self.MAX_POLL_INTERVAL * 2)
+        conn.execute(
+            'DELETE FROM single_flight WHERE (finished_at IS NOT NULL AND finished_at < ?) '
+            'OR (finished_at IS NULL AND started_at < ?)',
+            (now - retention, now - self.LEASE_TIMEOUT)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """合并统计"""
+        with self._lock:
+            return {
+                'window': self.window,
+                'shared': self.shared,
+                'in_flight': sum(1 for call in self._calls.values() if not call.done.is_set()),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'shared_hits': self.shared_hits
+            }
+
+single_flight = SingleFlight()
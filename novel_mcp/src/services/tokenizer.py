@@ -0,0 +1,97 @@
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, FrozenSet, List, Optional, Sequence, Type
+
+# 中日韩统一表意文字（含扩展A区与兼容区）
+_CJK = '㐀-䶿一-鿿豈-﫿'
+_MIXED_PATTERN = re.compile(rf'([{_CJK}]+)|([^\W{_CJK}]+)')
+
+class Tokenizer(ABC):
+    """分词器基类，子类实现 tokenize"""
+    name = 'base'
+
+    @abstractmethod
+    def tokenize(self, text: str) -> List[str]:
+        """把文本切分为词项列表"""
+
+class WordTokenizer(Tokenizer):
+    """按\\w+切分（适用于拉丁文字，中文整段会被视为一个词）"""
+    name = 'word'
+
+    def tokenize(self, text: str) -> List[str]:
+        if not text:
+            return []
+        return re.findall(r'\w+', text.lower())
+
+class CJKTokenizer(Tokenizer):
+    """中文按字符n-gram切分，拉丁文字按单词切分"""
+    name = 'cjk'
+
+    def __init__(self, ngram_sizes: Sequence[int] = (2,)):
+        self.ngram_sizes = tuple(sorted(set(ngram_sizes)))
+
+    def tokenize(self, text: str) -> List[str]:
+        if not text:
+            return []
+
+        tokens = []
+        for cjk_run, word in _MIXED_PATTERN.findall(text.lower()):
+            if word:
+                tokens.append(word)
+                continue
+
+            # 单字成段时保留单字，否则输出各长度的n-gram
+            if len(cjk_run) < self.ngram_sizes[0]:
+                tokens.append(cjk_run)
+                continue
+            for n in self.ngram_sizes:
+                tokens.extend(cjk_run[i:i + n] for i in range(len(cjk_run) - n + 1))
+
+        return tokens
+
+TOKENIZERS: Dict[str, Type[Tokenizer]] = {
+    WordTokenizer.name: WordTokenizer,
+    CJKTokenizer.name: CJKTokenizer,
+}
+
+_default_tokenizer: Optional[Tokenizer] = None
+
+def register_tokenizer(name: str, tokenizer_class: Type[Tokenizer]) -> None:
+    """注册自定义分词器，可通过环境变量KNOWLEDGE_TOKENIZER启用"""
+    TOKENIZERS[name] = tokenizer_class
+
+def get_tokenizer() -> Tokenizer:
+    """获取当前配置的分词器
+
+    KNOWLEDGE_TOKENIZER 选择分词器（默认cjk），KNOWLEDGE_NGRAM 设置中文n-gram长度（如"2"或"2,3"）。
+    更换分词器后需调用 /api/mcp/update-knowledge 重建索引与签名。
+    """
+    global _default_tokenizer
+    if _default_tokenizer is None:
+        name = os.getenv('KNOWLEDGE_TOKENIZER', CJKTokenizer.name)
+        tokenizer_class = TOKENIZERS[name]
+        if tokenizer_class is CJKTokenizer:
+            ngram_sizes = [int(n) for n in os.getenv('KNOWLEDGE_NGRAM', '2').split(',') if n.strip()]
+            _default_tokenizer = CJKTokenizer(ngram_sizes)
+        else:
+            _default_tokenizer = tokenizer_class()
+    return _default_tokenizer
+
+def term_id(term: str) -> int:
+    """词项的32位哈希ID"""
+    return zlib.crc32(term.encode('utf-8'))
+
+def build_signature(tokens: Sequence[str]) -> bytes:
+    """将词项集合编码为有序的32位整数数组"""
+    return array('I', sorted({term_id(token) for token in tokens})).tobytes()
+
+def decode_signature(signature: Optional[bytes]) -> FrozenSet[int]:
+    """解码签名为整数集合，便于求交集"""
+    if not signature:
+        return frozenset()
+    ids = array('I')
+    ids.frombytes(signature)
+    return frozenset(ids)
@@ -0,0 +1,409 @@
+import fcntl
+import glob
+import hashlib
+import os
+import re
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from src.models.novel import Chapter, Character, Setting, Outline
+from src.models.knowledge import ChapterChunk
+from src.database_init import db
+
+VECTOR_INDEX_DIR = os.getenv(
+    'VECTOR_INDEX_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'vectors')
+)
+
+_TYPE_CODES = {'character': 0, 'setting': 1, 'outline': 2, 'chunk': 3}
+_CHUNK = _TYPE_CODES['chunk']
+_WHITESPACE = re.compile(r'\s+')
+
+class HashingVectorizer:
+    """字符n-gram哈希向量（带符号哈希，L2归一化），无需词表与外部模型"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = _WHITESPACE.sub(' ', (text or '').lower()).strip()
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for start in range(len(text) - n + 1):
+                    hashed = zlib.crc32(text[start:start + n].encode('utf-8'))
+                    # 最高位决定符号，减少哈希冲突带来的偏差
+                    vectors[row, hashed % self.dim] += 1.0 if hashed & 0x80000000 else -1.0
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+class VectorIndex:
+    """按小说存放的本地语义索引：结构化NumPy文件以内存映射方式打开，多个工作进程共享页缓存
+
+    写入提交后只记录变更的实体与章节；查询时只为这些实体和章节的段落块计算向量，写入小的增量文件，
+    主索引中对应的行被增量覆盖。增量超过阈值时在后台线程合并进主索引，请求中不重建整部小说。
+    """
+
+    # 每批参与矩阵乘法的行数，控制内存峰值
+    BLOCK_ROWS = 65536
+    # 增量行数超过该值且超过主索引的一定比例时，在后台合并
+    COMPACT_MIN_ROWS = 2000
+    COMPACT_RATIO = 0.1
+
+    _mapped: Dict[str, Tuple[Tuple[int, int], np.ndarray]] = {}
+    _deltas: Dict[str, Tuple[Tuple[int, int], Dict[str, np.ndarray]]] = {}
+    _mapped_lock = threading.Lock()
+    _compacting: Set[int] = set()
+
+    def __init__(self, directory: Optional[str] = None, dim: Optional[int] = None):
+        self.directory = directory or VECTOR_INDEX_DIR
+        self.vectorizer = HashingVectorizer(dim or int(os.getenv('VECTOR_INDEX_DIM', '1024')))
+        self.dtype = np.dtype([
+            ('type', np.int8),
+            ('id', np.int64),
+            ('chapter', np.int64),  # 段落块所属章节，其他实体为0
+            ('digest', np.uint64),
+            ('vector', np.float32, (self.vectorizer.dim,))
+        ])
+        self.key_dtype = np.dtype([('type', np.int8), ('id', np.int64)])
+
+    def _index_path(self, novel_id: int) -> str:
+        return os.path.join(self.directory, f'novel_{novel_id}.npy')
+
+    def _delta_path(self, novel_id: int) -> str:
+        return os.path.join(self.directory, f'novel_{novel_id}.delta.npz')
+
+    def _pending_path(self, novel_id: int) -> str:
+        return os.path.join(self.directory, f'novel_{novel_id}.pending')
+
+    def _lock_path(self, novel_id: int) -> str:
+        return os.path.join(self.directory, f'novel_{novel_id}.lock')
+
+    @contextmanager
+    def _locked(self, novel_id: int) -> Iterator[None]:
+        """同一部小说的索引文件同一时间只由一个线程或进程改写"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._lock_path(novel_id), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def record_changes(self, novel_id: int, changes: Set[Tuple[str, int]]) -> None:
+        """记录已提交的变更 (实体类型或chapter, ID)，下次查询时增量更新（可跨进程生效）"""
+        if not changes or not os.path.exists(self._index_path(novel_id)):
+            return
+        with open(self._pending_path(novel_id), 'a') as pending:
+            pending.write(''.join(f'{kind} {entity_id}\n' for kind, entity_id in sorted(changes)))
+
+    def remove(self, novel_id: int) -> None:
+        """删除小说的向量索引"""
+        paths = [self._index_path(novel_id), self._delta_path(novel_id), self._lock_path(novel_id)]
+        for path in paths + glob.glob(f'{self._pending_path(novel_id)}*'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def search(self, novel_id: int, queries: List[str], limits: Dict[str, int]) -> List[Dict[str, List[Tuple[int, float]]]]:
+        """批量余弦相似度检索，返回每个查询按类型排列的 (ID, 得分)"""
+        index, delta = self._open(novel_id)
+        query_vectors = self.vectorizer.transform(queries)
+        if index is None or not len(index) + len(delta['rows']):
+            return [{entity_type: [] for entity_type in limits} for _ in queries]
+
+        # 主索引中被增量覆盖的行不参与排序，增量行追加在后面
+        scores = np.empty((len(index) + len(delta['rows']), len(queries)), dtype=np.float32)
+        for start in range(0, len(index), self.BLOCK_ROWS):
+            block = index[start:start + self.BLOCK_ROWS]
+            scores[start:start + len(block)] = block['vector'] @ query_vectors.T
+        scores[len(index):] = delta['rows']['vector'] @ query_vectors.T
+        scores[:len(index)][self._superseded(index, delta)] = 0.0
+
+        types = np.concatenate([np.asarray(index['type']), delta['rows']['type']])
+        ids = np.concatenate([np.asarray(index['id']), delta['rows']['id']])
+        results = []
+        for column in range(len(queries)):
+            ranked = {}
+            for entity_type, limit in limits.items():
+                rows = np.flatnonzero(types == _TYPE_CODES[entity_type])
+                type_scores = scores[rows, column]
+                positive = np.flatnonzero(type_scores > 0)
+                if limit <= 0:
+                    positive = positive[:0]
+                elif positive.size > limit:
+                    positive = positive[np.argpartition(-type_scores[positive], limit - 1)[:limit]]
+                order = np.lexsort((ids[rows[positive]], -type_scores[positive]))
+                ranked[entity_type] = [
+                    (int(ids[rows[i]]), float(type_scores[i])) for i in positive[order]
+                ]
+            results.append(ranked)
+        return results
+
+    def _superseded(self, index: np.ndarray, delta: Dict[str, np.ndarray]) -> np.ndarray:
+        """主索引中已被增量覆盖（更新或删除）的行"""
+        types = np.asarray(index['type'])
+        mask = (types == _CHUNK) & np.isin(np.asarray(index['chapter']), delta['chapters'])
+        for code in np.unique(delta['entities']['type']).tolist():
+            ids = delta['entities']['id'][delta['entities']['type'] == code]
+            mask |= (types == code) & np.isin(np.asarray(index['id']), ids)
+        return mask
+
+    def _open(self, novel_id: int) -> Tuple[Optional[np.ndarray], Dict[str, np.ndarray]]:
+        """打开主索引与增量，先应用已提交的变更；没有主索引时建立一次，文件被替换后自动重新映射"""
+        path = self._index_path(novel_id)
+        index = self._map(path)
+        if index is None or index.dtype != self.dtype:
+            self.build(novel_id)
+            index = self._map(path)
+        elif glob.glob(f'{self._pending_path(novel_id)}*'):
+            self._apply_pending(novel_id)
+        return index, self._load_delta(novel_id)
+
+    def _map(self, path: str) -> Optional[np.ndarray]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._mapped_lock:
+            cached = self._mapped.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+        mapped = np.load(path, mmap_mode='r')
+        with self._mapped_lock:
+            self._mapped[path] = (key, mapped)
+        return mapped
+
+    def _empty_delta(self) -> Dict[str, np.ndarray]:
+        return {
+            'rows': np.zeros(0, dtype=self.dtype),
+            'entities': np.zeros(0, dtype=self.key_dtype),
+            'chapters': np.zeros(0, dtype=np.int64)
+        }
+
+    def _load_delta(self, novel_id: int) -> Dict[str, np.ndarray]:
+        """读取增量：新的向量行，以及被覆盖的实体与章节"""
+        path = self._delta_path(novel_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return self._empty_delta()
+        key = (stat.st_ino, stat.st_mtime_ns)
+
+        with self._mapped_lock:
+            cached = self._deltas.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+        try:
+            with np.load(path) as data:
+                delta = {name: data[name] for name in ('rows', 'entities', 'chapters')}
+        except FileNotFoundError:
+            # 读取前刚被合并删除
+            return self._empty_delta()
+        if delta['rows'].dtype != self.dtype:
+            return self._empty_delta()
+        with self._mapped_lock:
+            self._deltas[path] = (key, delta)
+        return delta
+
+    def _apply_pending(self, novel_id: int) -> None:
+        """只为变更的实体与章节计算向量，合并进增量文件"""
+        with self._locked(novel_id):
+            pending_path = self._pending_path(novel_id)
+            # 先改名再读取，改名之后提交的变更写入新的文件，下次再应用
+            if os.path.exists(pending_path):
+                os.replace(pending_path, f'{pending_path}.{uuid.uuid4().hex}')
+            claimed = glob.glob(f'{pending_path}.*')
+            if not claimed:
+                return
+
+            entities, chapters = set(), set()
+            for claimed_path in claimed:
+                with open(claimed_path, 'r') as pending:
+                    for line in pending:
+                        kind, entity_id = line.split()
+                        if kind == 'chapter':
+                            chapters.add(int(entity_id))
+                        else:
+                            entities.add((_TYPE_CODES[kind], int(entity_id)))
+
+            delta = dict(self._load_delta(novel_id))
+            index = self._map(self._index_path(novel_id))
+            if index is None:
+                return
+            if entities:
+                delta['entities'] = np.unique(np.concatenate([
+                    delta['entities'], np.array(sorted(entities), dtype=self.key_dtype)
+                ]))
+            if chapters:
+                delta['chapters'] = np.union1d(delta['chapters'], np.array(sorted(chapters), dtype=np.int64))
+
+            # 旧的增量行中属于本次变更的丢弃，其余保留
+            rows = delta['rows']
+            keep = ~np.isin(rows['chapter'], list(chapters)) | (rows['type'] != _CHUNK)
+            for code, entity_id in entities:
+                keep &= ~((rows['type'] == code) & (rows['id'] == entity_id))
+            # 内容未变的行（如只改了章节标题）复用原有向量
+            reusable = np.concatenate([index[self._superseded(index, delta)], rows])
+            rows = np.concatenate([rows[keep], self._rows(self._collect_texts(novel_id, entities, chapters), reusable)])
+            delta['rows'] = rows
+            self._write(self._delta_path(novel_id), lambda f: np.savez(f, **delta))
+            for claimed_path in claimed:
+                os.remove(claimed_path)
+
+        if len(rows) > max(self.COMPACT_MIN_ROWS, self.COMPACT_RATIO * len(index)):
+            self._compact_in_background(novel_id)
+
+    def _compact_in_background(self, novel_id: int) -> None:
+        """把增量合并进主索引：只复制已有的向量，不读取数据库也不重新计算"""
+        with self._mapped_lock:
+            if novel_id in self._compacting:
+                return
+            self._compacting.add(novel_id)
+
+        def compact():
+            try:
+                with self._locked(novel_id):
+                    index = self._map(self._index_path(novel_id))
+                    delta = self._load_delta(novel_id)
+                    if index is None or not len(delta['rows']) + len(delta['entities']) + len(delta['chapters']):
+                        return
+                    merged = np.concatenate([index[~self._superseded(index, delta)], delta['rows']])
+                    self._write(self._index_path(novel_id), lambda f: np.save(f, merged))
+                    os.remove(self._delta_path(novel_id))
+            except Exception as e:
+                print(f"合并向量索引时出错: {e}")
+            finally:
+                with self._mapped_lock:
+                    self._compacting.discard(novel_id)
+
+        threading.Thread(target=compact, name=f'vector-compact-{novel_id}', daemon=True).start()
+
+    def rebuild(self, novel_id: int) -> None:
+        """更新知识库后重建已有的向量索引（段落块已重新切分，ID全部变化）"""
+        if os.path.exists(self._index_path(novel_id)):
+            self.build(novel_id)
+
+    def build(self, novel_id: int) -> None:
+        """建立整部小说的向量索引（首次使用或更新知识库时），内容未变的行复用旧向量"""
+        with self._locked(novel_id):
+            # 先清除待应用的变更再读取数据，之后提交的变更会重新记录
+            for path in glob.glob(f'{self._pending_path(novel_id)}*'):
+                os.remove(path)
+
+            reusable = self._load_delta(novel_id)['rows']
+            old = self._map(self._index_path(novel_id))
+            if old is not None and old.dtype == self.dtype:
+                reusable = np.concatenate([old, reusable])
+
+            index = self._rows(self._collect_texts(novel_id), reusable)
+            self._write(self._index_path(novel_id), lambda f: np.save(f, index))
+            if os.path.exists(self._delta_path(novel_id)):
+                os.remove(self._delta_path(novel_id))
+
+    def _rows(self, entries: List[Tuple[str, int, int, str]], reusable: np.ndarray) -> np.ndarray:
+        """生成索引行；内容摘要与已有行相同时复用其向量，其余重新计算"""
+        rows = np.zeros(len(entries), dtype=self.dtype)
+        rows['type'] = [_TYPE_CODES[entity_type] for entity_type, _, _, _ in entries]
+        rows['id'] = [entity_id for _, entity_id, _, _ in entries]
+        rows['chapter'] = [chapter_id for _, _, chapter_id, _ in entries]
+        rows['digest'] = [
+            int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+            for _, _, _, text in entries
+        ]
+
+        # 向量只取决于文本，按内容摘要复用
+        previous = {digest: row for row, digest in enumerate(reusable['digest'].tolist())}
+        stale_rows = []
+        for row, digest in enumerate(rows['digest'].tolist()):
+            old_row = previous.get(digest)
+            if old_row is None:
+                stale_rows.append(row)
+            else:
+                rows['vector'][row] = reusable['vector'][old_row]
+
+        if stale_rows:
+            rows['vector'][stale_rows] = self.vectorizer.transform([entries[row][3] for row in stale_rows])
+        return rows
+
+    def _write(self, path: str, save) -> None:
+        """写入临时文件后原子替换，已映射旧文件的进程不受影响"""
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as temp_file:
+            save(temp_file)
+        os.replace(temp_path, path)
+
+    def _collect_texts(self, novel_id: int, entities: Optional[Set[Tuple[int, int]]] = None,
+                       chapters: Optional[Set[int]] = None) -> List[Tuple[str, int, int, str]]:
+        """读取参与向量检索的实体文本 (类型, ID, 所属章节, 文本)；指定entities与chapters时只读取这些实体与章节的段落块"""
+        partial = entities is not None
+
+        def ids_of(entity_type: str) -> List[int]:
+            return [entity_id for code, entity_id in entities if code == _TYPE_CODES[entity_type]]
+
+        entries = []
+        sources = [
+            ('character', Character, (Character.name, Character.description, Character.personality)),
+            ('setting', Setting, (Setting.name, Setting.description)),
+            ('outline', Outline, (Outline.title, Outline.content)),
+        ]
+        for entity_type, model, columns in sources:
+            query = db.session.query(model.id, *columns).filter(model.novel_id == novel_id)
+            if partial:
+                selected = ids_of(entity_type)
+                if not selected:
+                    continue
+                query = query.filter(model.id.in_(selected))
+            for entity_id, *fields in query.order_by(model.id):
+                entries.append((entity_type, entity_id, 0, '\n'.join(filter(None, fields))))
+
+        query = db.session.query(ChapterChunk.id, ChapterChunk.chapter_id, ChapterChunk.content).filter(
+            ChapterChunk.novel_id == novel_id
+        )
+        if partial:
+            if not chapters:
+                return entries
+            query = query.filter(ChapterChunk.chapter_id.in_(sorted(chapters)))
+        for chunk_id, chapter_id, content in query.order_by(ChapterChunk.id).yield_per(1000):
+            entries.append(('chunk', chunk_id, chapter_id, content))
+        return entries
+
+vector_index = VectorIndex()
+
+_CHANGES_KEY = 'vector_index_changes'
+_CHANGE_KINDS = {Character: 'character', Setting: 'setting', Outline: 'outline', Chapter: 'chapter'}
+
+def _record_target(mapper, connection, target):
+    """记录写入的实体（章节的段落块按章节整体更新），提交后交给向量索引"""
+    session = object_session(target)
+    if session is not None and target.novel_id is not None:
+        session.info.setdefault(_CHANGES_KEY, {}).setdefault(target.novel_id, set()).add(
+            (_CHANGE_KINDS[type(target)], target.id)
+        )
+
+def _record_committed(session):
+    for novel_id, changes in session.info.pop(_CHANGES_KEY, {}).items():
+        try:
+            vector_index.record_changes(novel_id, changes)
+        except Exception as e:
+            print(f"记录向量索引变更时出错: {e}")
+
+def _discard_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
+
+for _model in _CHANGE_KINDS:
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _record_target)
+
+event.listen(Session, 'after_commit', _record_committed)
+event.listen(Session, 'after_soft_rollback', _discard_changes)
@@ -1,36 +1,180 @@
-import os
-import json
-from typing import Dict, List, Any
-import openai
+import copy
+import re
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+from src.services.llm_client import llm_client
+from src.services.model_router import model_router
+from src.services.llm_cache import llm_cache
+from src.services.prompt_builder import Prompt, PromptBuilder
+from src.services.knowledge_packer import KnowledgePacker, estimate_tokens
+from src.services.analyzed_document import paragraph_spans
+from src.services.deadline import Deadline
+
+_PARAGRAPH_REWRITE = re.compile(r'^段落\s*(\d+)\s*[：:]\s*(.*)$')
+
+class StreamingContentParser:
+    """增量解析流式输出的 标题：/正文：/摘要： 段落，边接收边产出增量文本"""
+    
+    MARKERS = {'标题：': 'title', '正文：': 'content', '摘要：': 'summary'}
+    
+    def __init__(self):
+        self.text = ''
+        self.section: Optional[str] = None
+        self._line = ''
+        # 当前行是否已确定归属（段落标记行或续行）及已输出到的位置
+        self._line_started = False
+        self._emitted = 0
+        self._skip_space = False
+        self._marker_line = False
+        self._has_text: Dict[str, bool] = {}
+    
+    def feed(self, chunk: str) -> List[Tuple[str, str, str]]:
+        """输入一段模型输出，返回 (事件, 段落名, 文本) 列表，事件为 section（段落开始）或 delta（增量文本）"""
+        self.text += chunk
+        self._line += chunk
+        events = []
+        while '\n' in self._line:
+            line, self._line = self._line.split('\n', 1)
+            self._process(line, events, complete=True)
+            self._line_started = False
+            self._emitted = 0
+        self._process(self._line, events, complete=False)
+        return events
+    
+    def _process(self, line: str, events: List[Tuple[str, str, str]], complete: bool) -> None:
+        if not self._line_started:
+            stripped = line.lstrip()
+            marker = next((m for m in self.MARKERS if stripped.startswith(m)), None)
+            if marker:
+                self.section = self.MARKERS[marker]
+                events.append(('section', self.section, ''))
+                self._line_started = True
+                self._marker_line = True
+                self._emitted = len(line) - len(stripped) + len(marker)
+                # 标记后的空白与非流式解析一样去掉
+                self._skip_space = True
+            elif not complete and (not stripped or any(m.startswith(stripped) for m in self.MARKERS)):
+                # 可能是尚未接收完整的段落标记，等待更多输出
+                return
+            else:
+                self._line_started = True
+                self._marker_line = False
+                self._emitted = len(line) - len(stripped)
+                self._skip_space = False
+                # 标题只取第一行；其他段落的续行以换行连接
+                if stripped and self.section in ('content', 'summary') and self._has_text.get(self.section):
+                    events.append(('delta', self.section, '\n'))
+        
+        if self._skip_space:
+            while self._emitted < len(line) and line[self._emitted].isspace():
+                self._emitted += 1
+            self._skip_space = self._emitted == len(line)
+        
+        if self.section in ('content', 'summary') or (self.section == 'title' and self._marker_line):
+            text = line[self._emitted:]
+            if text:
+                events.append(('delta', self.section, text))
+                self._has_text[self.section] = True
+        self._emitted = len(line)
 
 class WritingAssistant:
     """写作助手智能体"""
     
-    def __init__(self):
-        # 使用环境变量中的API配置
-        openai.api_key = os.getenv('OPENAI_API_KEY')
-        openai.api_base = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
-        self.model = "gpt-3.5-turbo"
+    GENERATION_PROMPT = PromptBuilder(
+        system_prompt="你是一个专业的小说创作助手，擅长根据背景信息创作高质量的小说章节。",
+        instructions="""
+请根据提供的小说资料和最后的创作要求创作一个小说章节，包含：
+1. 引人入胜的标题
+2. 1500-2000字的正文内容
+3. 简洁的章节摘要
+
+格式要求：
+标题：[章节标题]
+正文：[章节正文内容]
+摘要：[章节摘要]
+"""
+    )
+    
+    IMPROVEMENT_PROMPT = PromptBuilder(
+        system_prompt="你是一个专业的小说编辑，擅长根据反馈改进内容质量。",
+        instructions="""
+请根据最后的反馈意见改进原始章节内容，格式如下：
+标题：[改进后的标题]
+正文：[改进后的正文]
+摘要：[改进后的摘要]
+"""
+    )
+    
+    # 局部改写时附带的上文长度
+    PATCH_CONTEXT_CHARS = 200
+    # 知识预算在提示词估算之外的余量（token估算的误差）
+    PROMPT_MARGIN_TOKENS = 200
+    
+    PATCH_PROMPT = PromptBuilder(
+        system_prompt="你是一个专业的小说编辑，擅长根据反馈改进内容质量。",
+        instructions="""
+请只改写最后列出的段落，解决每段标注的问题，与上下文保持衔接，不要输出其他段落。
+每个段落按如下格式单独输出一行：
+段落[编号]：[改写后的段落]
+"""
+    )
     
-    def generate_content(self, knowledge: Dict[str, Any], context: str, requirements: str = "") -> Dict[str, str]:
+    SUGGESTION_PROMPT = PromptBuilder(
+        system_prompt="你是一个经验丰富的小说策划师，擅长设计引人入胜的情节发展。",
+        instructions="""
+请基于提供的小说资料和最后的当前情况，提供3个不同的情节发展方向，每个建议应该：
+1. 符合已建立的世界观和人物设定
+2. 推进主要情节发展
+3. 具有足够的戏剧冲突
+4. 保持逻辑连贯性
+
+格式：
+建议1：[详细描述]
+建议2：[详细描述]
+建议3：[详细描述]
+"""
+    )
+    
+    def __init__(self, use_cache: bool = True, deadline: Optional[Deadline] = None):
+        # 进程内共享的客户端（连接池、超时与并发上限由环境变量配置）
+        self.llm = llm_client
+        # 各阶段（生成、改写、局部改写、情节建议）使用的模型与输出上限由路由配置决定
+        self.router = model_router
+        # 请求截止时间：每次调用的超时不超过剩余时间
+        self.deadline = deadline or Deadline()
+        # 相同请求直接返回缓存的响应；use_cache=False 时本次请求绕过缓存
+        self.cache = llm_cache
+        self.use_cache = use_cache
+        self.model = self.router.model('generate')
+        self.max_tokens = self.router.max_tokens('generate')
+        self.suggestion_model = self.router.model('suggest')
+        self.suggestion_max_tokens = self.router.max_tokens('suggest')
+        # 最近一次各类调用的提示词token统计
+        self.prompt_stats: Dict[str, Dict[str, Any]] = {}
+        # 最近一次各类调用的知识打包报告（各阶段按自己的提示词裁剪知识）
+        self.packing_reports: Dict[str, Dict[str, Any]] = {}
+    
+    def fork(self) -> 'WritingAssistant':
+        """相同配置的新实例（共享客户端、路由、缓存与截止时间），统计各自记录，供并行任务各用一个"""
+        assistant = copy.copy(self)
+        assistant.prompt_stats = {}
+        assistant.packing_reports = {}
+        return assistant
+    
+    def generate_content(self, knowledge: Dict[str, Any], context: str, requirements: str = "",
+                         temperature: float = 0.7) -> Dict[str, str]:
         """生成章节内容"""
         try:
             # 构建提示词
             prompt = self._build_generation_prompt(knowledge, context, requirements)
             
             # 调用AI生成内容
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的小说创作助手，擅长根据背景信息创作高质量的小说章节。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
-                temperature=0.7
+            content = self._chat(
+                'generate',
+                messages=prompt.messages,
+                max_tokens=self.max_tokens,
+                temperature=temperature
             )
             
-            content = response.choices[0].message.content
-            
             # 解析生成的内容
             return self._parse_generated_content(content)
             
@@ -43,76 +187,201 @@ class WritingAssistant:
                 'summary': '示例章节摘要。'
             }
     
-    def improve_content(self, content: Dict[str, str], feedback: str, knowledge: Dict[str, Any]) -> Dict[str, str]:
-        """根据反馈改进内容"""
+    def stream_content(self, knowledge: Dict[str, Any], context: str, requirements: str = "",
+                       temperature: float = 0.7) -> Iterator[Dict[str, Any]]:
+        """流式生成章节内容，依次产出段落开始、增量文本事件，最后产出完整解析结果"""
+        parser = StreamingContentParser()
         try:
-            prompt = f"""
-请根据以下反馈改进章节内容：
-
-原始内容：
-标题：{content.get('title', '')}
-正文：{content.get('content', '')}
-
-反馈意见：{feedback}
-
-背景信息：{json.dumps(knowledge, ensure_ascii=False, indent=2)}
-
-请提供改进后的内容，格式如下：
-标题：[改进后的标题]
-正文：[改进后的正文]
-摘要：[改进后的摘要]
-"""
+            prompt = self._build_generation_prompt(knowledge, context, requirements)
+            yield {'type': 'knowledge', 'packing_report': self.packing_reports['generate']}
+            stream = self._stream_chat(
+                'generate',
+                messages=prompt.messages,
+                max_tokens=self.max_tokens,
+                temperature=temperature
+            )
             
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的小说编辑，擅长根据反馈改进内容质量。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=2000,
+            for delta in stream:
+                yield from self._stream_events(parser, delta)
+            
+        except Exception as e:
+            print(f"流式生成内容时出错: {e}")
+            if not parser.text.strip():
+                # 尚未收到任何输出时返回示例内容
+                fallback = '标题：新章节\n正文：这是一个示例章节内容。由于AI服务暂时不可用，这里显示的是默认内容。\n摘要：示例章节摘要。'
+                yield from self._stream_events(parser, fallback)
+        
+        # 完整结果与非流式解析保持一致
+        yield {'type': 'content', 'content': self._parse_generated_content(parser.text)}
+    
+    def _chat(self, stage: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        """按阶段路由调用大模型，优先读取响应缓存（缓存键使用该阶段的主模型，备用模型的输出不写入缓存）"""
+        model = self.router.model(stage)
+        key = self.cache.key(model, messages, temperature, max_tokens) if self.use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
+        self.deadline.check('llm')
+        response, used_model = self.router.chat(stage, messages, max_tokens, temperature, deadline=self.deadline)
+        # 局部改写的统计记在 improve 下
+        stats = self.prompt_stats.get('improve' if stage == 'patch' else stage)
+        if stats is not None:
+            stats['model'] = used_model
+        if key and used_model == model:
+            self.cache.put(key, response)
+        return response
+    
+    def _stream_chat(self, stage: str, messages: List[Dict[str, str]], max_tokens: int,
+                     temperature: float) -> Iterator[str]:
+        """按阶段路由流式调用大模型；缓存命中时一次性返回，主模型完整输出后写入缓存"""
+        model = self.router.model(stage)
+        key = self.cache.key(model, messages, temperature, max_tokens) if self.use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        self.deadline.check('llm_stream')
+        received = []
+        stream = self.router.stream_chat(stage, messages, max_tokens, temperature, deadline=self.deadline)
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as stop:
+                # 流结束时返回实际使用的模型
+                used_model = stop.value
+                break
+            received.append(delta)
+            yield delta
+            # 流式输出超过截止时间时停止接收，已收到的部分照常解析
+            self.deadline.check('llm_stream')
+        stats = self.prompt_stats.get(stage)
+        if stats is not None:
+            stats['model'] = used_model
+        if key and used_model == model:
+            self.cache.put(key, ''.join(received))
+    
+    def _stream_events(self, parser: StreamingContentParser, chunk: str) -> Iterator[Dict[str, Any]]:
+        for event, section, text in parser.feed(chunk):
+            if event == 'section':
+                yield {'type': 'section', 'section': section}
+            else:
+                yield {'type': 'delta', 'section': section, 'text': text}
+    
+    def improve_content(self, content: Dict[str, str], feedback: str, knowledge: Dict[str, Any],
+                        issue_locations: Optional[List[Dict[str, Any]]] = None) -> Dict[str, str]:
+        """根据反馈改进内容；审核给出问题段落时只改写这些段落"""
+        if issue_locations:
+            patched = self._patch_paragraphs(content, issue_locations, knowledge)
+            if patched is not None:
+                return patched
+        
+        try:
+            max_tokens = self.router.max_tokens('improve')
+            prompt = self._build_prompt('improve', self.IMPROVEMENT_PROMPT, knowledge, [
+                ('draft', '原始内容', f"标题：{content.get('title', '')}\n正文：{content.get('content', '')}"),
+                ('feedback', '反馈意见', feedback)
+            ], max_tokens)
+            self.prompt_stats['improve'] = dict(prompt.stats(), mode='rewrite')
+            
+            improved_content = self._chat(
+                'improve',
+                messages=prompt.messages,
+                max_tokens=max_tokens,
                 temperature=0.6
             )
             
-            improved_content = response.choices[0].message.content
             return self._parse_generated_content(improved_content)
             
         except Exception as e:
             print(f"改进内容时出错: {e}")
             return content  # 返回原始内容
     
+    def _patch_paragraphs(self, content: Dict[str, str], issue_locations: List[Dict[str, Any]],
+                          knowledge: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """局部改写问题段落并拼回原文，失败时返回None以便整体改写"""
+        try:
+            text = content.get('content', '')
+            spans = paragraph_spans(text)
+            issues = {}
+            for location in issue_locations:
+                if 0 <= location['paragraph'] < len(spans):
+                    issues.setdefault(location['paragraph'], []).append(location['issue'])
+            if not issues:
+                return None
+            
+            # 每个问题段落附上前一段作为上文（前一段也待改写时省略），保证衔接
+            listing = []
+            for index in sorted(issues):
+                if index > 0 and index - 1 not in issues:
+                    previous = text[spans[index - 1][0]:spans[index - 1][1]].strip()
+                    listing.append(f"（上文）{previous[-self.PATCH_CONTEXT_CHARS:]}")
+                listing.append(f"段落{index + 1}：{text[spans[index][0]:spans[index][1]].strip()}")
+                listing.append(f"问题：{'；'.join(issues[index])}")
+            
+            # 输出预算按待改写段落的长度估算
+            original_tokens = sum(estimate_tokens(text[spans[index][0]:spans[index][1]]) for index in issues)
+            max_tokens = min(self.router.max_tokens('patch'), original_tokens * 2 + 100)
+            prompt = self._build_prompt('patch', self.PATCH_PROMPT, knowledge, [
+                ('paragraphs', '待改写段落', '\n'.join(listing))
+            ], max_tokens)
+            self.prompt_stats['improve'] = dict(
+                prompt.stats(), mode='patch', patched_paragraphs=sorted(issues), max_tokens=max_tokens
+            )
+            
+            rewrites = self._parse_paragraph_rewrites(
+                self._chat('patch', messages=prompt.messages, max_tokens=max_tokens, temperature=0.6)
+            )
+            rewrites = {index: paragraph for index, paragraph in rewrites.items() if index in issues}
+            if not rewrites:
+                return None
+            
+            # 从后往前替换，保持前面段落的位置不变；保留原段落首尾的空白（如段首缩进）
+            for index in sorted(rewrites, reverse=True):
+                start, end = spans[index]
+                original = text[start:end]
+                leading = original[:len(original) - len(original.lstrip())]
+                trailing = original[len(original.rstrip()):]
+                text = text[:start] + leading + rewrites[index] + trailing + text[end:]
+            return dict(content, content=text)
+            
+        except Exception as e:
+            print(f"局部改写内容时出错: {e}")
+            return None
+    
+    def _parse_paragraph_rewrites(self, text: str) -> Dict[int, str]:
+        """解析 段落N：内容 格式的改写结果，返回段落下标（从0开始）到新内容的映射"""
+        rewrites = {}
+        current = None
+        for line in text.split('\n'):
+            line = line.strip()
+            match = _PARAGRAPH_REWRITE.match(line)
+            if match:
+                current = int(match.group(1)) - 1
+                rewrites[current] = match.group(2).strip()
+            elif current is not None and line:
+                # 同一段落的续行合并，不产生新的段落
+                rewrites[current] += line
+        return {index: paragraph for index, paragraph in rewrites.items() if paragraph}
+    
     def suggest_plot_development(self, knowledge: Dict[str, Any], current_context: str) -> List[str]:
         """建议情节发展"""
         try:
-            prompt = f"""
-基于以下背景信息和当前情况，请提供3个可能的情节发展建议：
-
-背景信息：{json.dumps(knowledge, ensure_ascii=False, indent=2)}
-
-当前情况：{current_context}
-
-请提供3个不同的发展方向，每个建议应该：
-1. 符合已建立的世界观和人物设定
-2. 推进主要情节发展
-3. 具有足够的戏剧冲突
-4. 保持逻辑连贯性
-
-格式：
-建议1：[详细描述]
-建议2：[详细描述]
-建议3：[详细描述]
-"""
+            prompt = self._build_prompt('suggest', self.SUGGESTION_PROMPT, knowledge, [
+                ('context', '当前情况', current_context)
+            ], self.suggestion_max_tokens)
+            self.prompt_stats['suggest'] = prompt.stats()
             
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个经验丰富的小说策划师，擅长设计引人入胜的情节发展。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
+            suggestions_text = self._chat(
+                'suggest',
+                messages=prompt.messages,
+                max_tokens=self.suggestion_max_tokens,
                 temperature=0.8
             )
             
-            suggestions_text = response.choices[0].message.content
             return self._parse_suggestions(suggestions_text)
             
         except Exception as e:
@@ -123,44 +392,38 @@ class WritingAssistant:
                 "建议3：回到之前埋下的伏笔，通过揭示隐藏信息来推动情节发展。"
             ]
     
-    def _build_generation_prompt(self, knowledge: Dict[str, Any], context: str, requirements: str) -> str:
+    def _build_generation_prompt(self, knowledge: Dict[str, Any], context: str, requirements: str) -> Prompt:
         """构建生成提示词"""
-        prompt = f"""
-请根据以下信息创作一个小说章节：
-
-小说背景：
-{json.dumps(knowledge.get('novel', {}), ensure_ascii=False, indent=2)}
-
-人物信息：
-{json.dumps(knowledge.get('characters', []), ensure_ascii=False, indent=2)}
-
-世界观设定：
-{json.dumps(knowledge.get('settings', []), ensure_ascii=False, indent=2)}
-
-大纲信息：
-{json.dumps(knowledge.get('outlines', []), ensure_ascii=False, indent=2)}
-
-最近章节：
-{json.dumps(knowledge.get('recent_chapters', []), ensure_ascii=False, indent=2)}
-
-创作要求：
-{context}
-
-特殊要求：
-{requirements}
-
-请创作一个章节，包含：
-1. 引人入胜的标题
-2. 1500-2000字的正文内容
-3. 简洁的章节摘要
-
-格式要求：
-标题：[章节标题]
-正文：[章节正文内容]
-摘要：[章节摘要]
-"""
+        prompt = self._build_prompt('generate', self.GENERATION_PROMPT, knowledge, [
+            ('context', '创作要求', context),
+            ('requirements', '特殊要求', requirements)
+        ], self.max_tokens)
+        self.prompt_stats['generate'] = prompt.stats()
         return prompt
     
+    def _build_prompt(self, stage: str, builder: PromptBuilder, knowledge: Dict[str, Any],
+                      sections: List[Tuple[str, str, Any]], max_tokens: int) -> Prompt:
+        """按该阶段实际发送的提示词裁剪知识后组装：知识预算扣除输出上限及草稿、上下文、要求等其余部分"""
+        other_tokens = builder.build({}, self._knowledge_sections({}) + sections).stats()['total_tokens']
+        packer = KnowledgePacker(
+            model=self.router.model(stage),
+            max_output_tokens=max_tokens,
+            reserved_tokens=other_tokens + self.PROMPT_MARGIN_TOKENS,
+            context_window=self.router.context_window(stage)
+        )
+        knowledge, report = packer.pack(knowledge)
+        # 局部改写的报告与提示词统计一样记在 improve 下
+        self.packing_reports['improve' if stage == 'patch' else stage] = report
+        return builder.build(knowledge, self._knowledge_sections(knowledge) + sections)
+    
+    def _knowledge_sections(self, knowledge: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+        """随请求变化的知识：大纲、相关段落与最近章节"""
+        return [
+            ('outlines', '大纲信息', knowledge.get('outlines', [])),
+            ('passages', '相关段落', knowledge.get('passages', [])),
+            ('recent_chapters', '最近章节', knowledge.get('recent_chapters', []))
+        ]
+    
     def _parse_generated_content(self, content: str) -> Dict[str, str]:
         """解析生成的内容"""
         result = {'title': '', 'content': '', 'summary': ''}
@@ -0,0 +1,35 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+from flask import Flask
+from src.database_init import db
+from src.models.user import User
+from src.models.novel import Novel, Chapter, Character, Setting, Outline, NovelStats
+from src.models.knowledge import KnowledgeTerm, ChapterChunk, ChapterAnalysis, ParagraphFingerprint
+from src.routes.user import user_bp
+from src.routes.novel import novel_bp
+from src.routes.mcp import mcp_bp
+from src.services.knowledge_cache import knowledge_cache
+
+@pytest.fixture
+def app(tmp_path):
+    """使用临时SQLite文件的应用，不触碰 src/database 下的数据库（进程池的工作进程按文件路径只读打开数据库）"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(novel_bp, url_prefix='/api')
+    app.register_blueprint(mcp_bp, url_prefix='/api/mcp')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    knowledge_cache.clear()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,37 @@
+from src.services.candidate_generator import CandidateGenerator
+from src.services.llm_client import LLMBusyError
+from src.services.model_router import ModelRouter
+from src.services.writing_assistant import WritingAssistant
+
+class TemperatureClient:
+    """第二个候选（温度0.8）的主模型排队超时，由备用模型完成，其余候选由主模型完成"""
+
+    def stream_chat(self, model, messages, max_tokens, temperature, timeout=None):
+        if temperature == 0.8:
+            if model == 'big':
+                raise LLMBusyError('busy')
+            yield '标题：选中\n正文：天亮之后，雨终于停了。\n摘要：摘要'
+            return
+        yield '标题：夜雨\n正文：天亮之后，雨终于停了。\n摘要：摘要'
+
+class TitleReviewer:
+    """只通过标题为“选中”的候选"""
+
+    def review_content(self, content, knowledge):
+        approved = content['title'] == '选中'
+        return {'approved': approved, 'overall_score': 0.9 if approved else 0.5}
+
+def test_each_candidate_records_its_own_stats(app):
+    assistant = WritingAssistant(use_cache=False)
+    assistant.router = ModelRouter(
+        routes={'generate': {'model': 'big', 'fallback': 'small', 'max_tokens': 100}},
+        client=TemperatureClient()
+    )
+
+    result = CandidateGenerator(assistant, TitleReviewer(), count=3).generate(knowledge={}, context='主角下山')
+
+    # 请求的统计来自选中候选实际使用的模型，而不是最后完成的候选
+    assert result['selected'] == 1
+    assert assistant.prompt_stats['generate']['model'] == 'small'
+    assert assistant.packing_reports['generate']['budget'] > 0
+    assert 'assistant' not in result
@@ -0,0 +1,101 @@
+from src.database_init import db
+from src.models.novel import Novel, Chapter, Character, Setting
+from src.models.knowledge import ChapterAnalysis
+from src.services.chapter_analyzer import ChapterAnalyzer
+from src.services.knowledge_cache import knowledge_cache
+
+# 章节正文的组成片段：人物与设定的提及、时间标记与回忆
+_SENTENCES = [
+    '李明推开房门，屋里一片漆黑。',
+    '小明想起了王芳临别时说的话。',
+    '次日清晨，他们离开了长安城。',
+    '第{day}天，队伍终于抵达青云山脚下。',
+    '三年前的那场大火，他至今记得。',
+    '王芳在青云山的石阶上等了很久。',
+    '数月后，长安城的城门再次打开。',
+    '风吹过山谷，没有人说话。',
+]
+
+def _seed(chapter_count: int) -> int:
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+    db.session.add_all([
+        Character(novel_id=novel.id, name='李明', aliases='小明', description='主角'),
+        Character(novel_id=novel.id, name='王芳', description='同伴'),
+        Character(novel_id=novel.id, name='赵四', description='从未出场'),
+        Setting(novel_id=novel.id, name='长安城', type='地点', description='都城'),
+        Setting(novel_id=novel.id, name='青云山', type='地点', description='山门'),
+    ])
+    for number in range(1, chapter_count + 1):
+        sentences = [
+            _SENTENCES[(number * step) % len(_SENTENCES)].format(day=number)
+            for step in (1, 3, 5)
+        ]
+        db.session.add(Chapter(
+            novel_id=novel.id, chapter_number=number, title=f'第{number}章', content='\n'.join(sentences)
+        ))
+    db.session.commit()
+    return novel.id
+
+def _stored_rows(novel_id: int):
+    return [
+        (row.chapter_id, row.content_hash, row.names_hash, row.chapter_updated_at, row.result)
+        for row in ChapterAnalysis.query.filter_by(novel_id=novel_id).order_by(ChapterAnalysis.chapter_id).all()
+    ]
+
+def _restore_rows(novel_id: int, rows) -> None:
+    """把分析结果恢复为给定的快照，使串行与并行从相同的状态开始"""
+    ChapterAnalysis.query.filter_by(novel_id=novel_id).delete(synchronize_session=False)
+    db.session.add_all([
+        ChapterAnalysis(novel_id=novel_id, chapter_id=chapter_id, content_hash=digest, names_hash=names,
+                        chapter_updated_at=updated_at, result=result)
+        for chapter_id, digest, names, updated_at, result in rows
+    ])
+    db.session.commit()
+    knowledge_cache.invalidate(novel_id)
+
+def _run_both(novel_id: int, monkeypatch):
+    """从同一状态分别串行与并行分析，返回两次的报告与存储的结果"""
+    start = _stored_rows(novel_id)
+    serial_report = ChapterAnalyzer(workers=1).analyze_novel(novel_id)
+    serial_rows = _stored_rows(novel_id)
+
+    _restore_rows(novel_id, start)
+    # 进程池出错时会静默回退为串行，这里确认确实走了并行路径
+    with monkeypatch.context() as patch:
+        def no_serial(*args, **kwargs):
+            raise AssertionError('并行分析回退为串行')
+        patch.setattr(ChapterAnalyzer, '_analyze_serial', no_serial)
+        parallel_report = ChapterAnalyzer(workers=4, parallel_min=1).analyze_novel(novel_id)
+    parallel_rows = _stored_rows(novel_id)
+    return serial_report, serial_rows, parallel_report, parallel_rows
+
+def test_parallel_analysis_matches_serial(app, monkeypatch):
+    novel_id = _seed(60)
+
+    # 首次分析：全部章节
+    serial_report, serial_rows, parallel_report, parallel_rows = _run_both(novel_id, monkeypatch)
+    assert serial_report['stats'] == {'chapters': 60, 'reused': 0, 'analyzed': 60}
+    assert parallel_report == serial_report
+    assert parallel_rows == serial_rows
+
+    # 增量分析：修改部分章节的正文与标题
+    for chapter in Chapter.query.filter(Chapter.chapter_number.in_([3, 17, 42])).all():
+        chapter.content += '\n五天后，李明回到了长安城。'
+    Chapter.query.filter_by(chapter_number=8).first().title = '改过的标题'
+    db.session.commit()
+
+    serial_report, serial_rows, parallel_report, parallel_rows = _run_both(novel_id, monkeypatch)
+    assert serial_report['stats'] == {'chapters': 60, 'reused': 57, 'analyzed': 3}
+    assert parallel_report == serial_report
+    assert parallel_rows == serial_rows
+
+    # 名称变化后全部章节重新分析
+    Character.query.filter_by(name='王芳').first().aliases = '芳儿'
+    db.session.commit()
+
+    serial_report, serial_rows, parallel_report, parallel_rows = _run_both(novel_id, monkeypatch)
+    assert serial_report['stats'] == {'chapters': 60, 'reused': 0, 'analyzed': 60}
+    assert parallel_report == serial_report
+    assert parallel_rows == serial_rows
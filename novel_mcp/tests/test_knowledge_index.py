@@ -0,0 +1,29 @@
+from src.database_init import db
+from src.models.novel import Novel, Chapter, Character
+from src.services.knowledge_index import KnowledgeIndex
+
+def test_term_frequencies_skip_chunk_postings(app):
+    index = KnowledgeIndex()
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+
+    character = Character(novel_id=novel.id, name='李明', description='青云山的剑客，性情沉稳')
+    db.session.add(character)
+    db.session.flush()
+    index.index_entity(character)
+
+    for number in range(1, 6):
+        content = '\n'.join(f'第{number}章第{line}段，李明在长安城外练剑，直到天色渐暗才回到客栈。' for line in range(40))
+        chapter = Chapter(novel_id=novel.id, chapter_number=number, title=f'第{number}章', content=content)
+        db.session.add(chapter)
+        db.session.flush()
+        index.index_chapter(chapter)
+    db.session.commit()
+
+    frequencies = index.load_term_frequencies(novel.id)
+
+    # 只有人物、设定与大纲进入快照，段落块在检索时按词项读取
+    assert list(frequencies) == [('character', character.id)]
+    assert frequencies[('character', character.id)]
+    assert index.chunk_stats(novel.id)[0] > 5
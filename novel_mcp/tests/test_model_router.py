@@ -0,0 +1,90 @@
+import pytest
+from src.services.llm_client import LLMBusyError
+from src.services.llm_cache import LLMResponseCache
+from src.services.model_router import ModelRouter
+from src.services.writing_assistant import WritingAssistant
+
+ROUTES = {
+    'generate': {'model': 'big', 'fallback': 'small', 'max_tokens': 100},
+    'suggest': {'model': 'tiny', 'fallback': None, 'max_tokens': 50},
+}
+MESSAGES = [{'role': 'user', 'content': '写一章'}]
+
+class FakeClient:
+    """按模型返回固定文本，列在 busy 中的模型抛出排队超时"""
+
+    def __init__(self, busy=()):
+        self.busy = set(busy)
+        self.calls = []
+
+    def chat(self, model, messages, max_tokens, temperature, timeout=None):
+        self.calls.append(model)
+        if model in self.busy:
+            raise LLMBusyError('busy')
+        return f'{model}的输出'
+
+    def stream_chat(self, model, messages, max_tokens, temperature, timeout=None):
+        self.calls.append(model)
+        if model in self.busy:
+            raise LLMBusyError('busy')
+        yield f'{model}的'
+        yield '输出'
+
+def test_primary_model_is_used_when_available():
+    client = FakeClient()
+    router = ModelRouter(routes=ROUTES, client=client)
+
+    assert router.chat('generate', MESSAGES, 100, 0.7) == ('big的输出', 'big')
+    assert client.calls == ['big']
+    assert router.stats()['generate']['fallbacks'] == 0
+
+def test_falls_back_when_primary_is_busy():
+    client = FakeClient(busy={'big'})
+    router = ModelRouter(routes=ROUTES, client=client)
+
+    assert router.chat('generate', MESSAGES, 100, 0.7) == ('small的输出', 'small')
+    assert client.calls == ['big', 'small']
+    stats = router.stats()['generate']
+    assert (stats['errors'], stats['fallbacks'], stats['models']) == (1, 1, {'big': 1, 'small': 1})
+
+    stream = router.stream_chat('generate', MESSAGES, 100, 0.7)
+    received = []
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            received.append(next(stream))
+    assert ''.join(received) == 'small的输出'
+    assert stop.value.value == 'small'
+
+def test_no_fallback_configured_raises():
+    router = ModelRouter(routes=ROUTES, client=FakeClient(busy={'tiny'}))
+    with pytest.raises(LLMBusyError):
+        router.chat('suggest', MESSAGES, 50, 0.7)
+
+def _assistant(client, tmp_path) -> WritingAssistant:
+    assistant = WritingAssistant()
+    assistant.router = ModelRouter(routes=ROUTES, client=client)
+    assistant.cache = LLMResponseCache(path=str(tmp_path / 'llm_cache.db'), enabled=True)
+    return assistant
+
+def test_fallback_responses_are_not_cached(tmp_path):
+    client = FakeClient(busy={'big'})
+    assistant = _assistant(client, tmp_path)
+
+    assert assistant._chat('generate', MESSAGES, 100, 0.7) == 'small的输出'
+    assert ''.join(assistant._stream_chat('generate', MESSAGES, 100, 0.9)) == 'small的输出'
+    assert assistant.cache.stats()['writes'] == 0
+
+    # 主模型恢复后，同样的请求调用主模型而不是读到备用模型的输出
+    client.busy.clear()
+    assert assistant._chat('generate', MESSAGES, 100, 0.7) == 'big的输出'
+    assert client.calls == ['big', 'small', 'big', 'small', 'big']
+
+def test_primary_responses_are_cached(tmp_path):
+    client = FakeClient()
+    assistant = _assistant(client, tmp_path)
+
+    assert assistant._chat('generate', MESSAGES, 100, 0.7) == 'big的输出'
+    assert assistant._chat('generate', MESSAGES, 100, 0.7) == 'big的输出'
+    assert ''.join(assistant._stream_chat('generate', MESSAGES, 100, 0.9)) == 'big的输出'
+    assert ''.join(assistant._stream_chat('generate', MESSAGES, 100, 0.9)) == 'big的输出'
+    assert client.calls == ['big', 'big']
@@ -0,0 +1,51 @@
+from src.database_init import db
+from src.models.novel import Novel, Chapter
+
+def _seed(count: int) -> int:
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+    # 插入顺序与章节号顺序不同，验证按排序键续读
+    db.session.add_all([
+        Chapter(novel_id=novel.id, chapter_number=number, title=f'第{number}章', content='正文')
+        for number in reversed(range(1, count + 1))
+    ])
+    db.session.commit()
+    return novel.id
+
+def test_cursor_pages_cover_every_row_once(client):
+    novel_id = _seed(23)
+
+    numbers, cursor, pages = [], None, 0
+    while True:
+        url = f'/api/novels/{novel_id}/chapters?limit=5' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        numbers.extend(item['chapter_number'] for item in page['items'])
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert numbers == list(range(1, 24))
+    assert pages == 5
+
+def test_fields_projection(client):
+    novel_id = _seed(3)
+
+    page = client.get(f'/api/novels/{novel_id}/chapters?fields=title&limit=2').get_json()
+    # 排序键只用于生成游标，未请求时不出现在结果中
+    assert page['items'] == [{'title': '第1章'}, {'title': '第2章'}]
+    assert page['next_cursor']
+
+    # 未提供limit与cursor时保持原来的完整数组
+    items = client.get(f'/api/novels/{novel_id}/chapters?fields=chapter_number,title').get_json()
+    assert items == [{'chapter_number': n, 'title': f'第{n}章'} for n in (1, 2, 3)]
+    assert 'token_signature' not in client.get(f'/api/novels/{novel_id}/chapters').get_json()[0]
+
+def test_invalid_parameters_are_rejected(client):
+    novel_id = _seed(1)
+
+    assert client.get(f'/api/novels/{novel_id}/chapters?fields=title,secret').status_code == 400
+    assert client.get(f'/api/novels/{novel_id}/chapters?fields=token_signature').status_code == 400
+    assert client.get(f'/api/novels/{novel_id}/chapters?cursor=not-a-cursor').status_code == 400
+    assert client.get(f'/api/novels/{novel_id}/chapters?limit=0').status_code == 400
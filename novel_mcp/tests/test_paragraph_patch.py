@@ -0,0 +1,76 @@
+from src.services.analyzed_document import paragraph_spans
+from src.services.content_reviewer import ContentReviewer
+from src.services.writing_assistant import WritingAssistant
+
+_CLEAN = [
+    '　　夜色沉沉，城门外的老人拄着拐杖慢慢走过长街，灯火在雨里摇晃，像是随时会熄灭的一点希望。他停下脚步，抬头望向城楼。',
+    '　　少年推开客栈的木门，掌柜抬头看了他一眼，又低头拨弄算盘，屋里弥漫着陈年的酒香与柴火味。少年找了个角落坐下。',
+    '　　远处的钟声响了三下，城墙上的守卫换了岗，风从北边吹来，带着山里积雪融化后的湿冷气息。夜更深了。',
+    '　　集市上人声鼎沸，卖糖人的小贩吆喝着，孩子们围成一圈看得入迷。一个穿青衫的剑客从人群中挤了过去。',
+    '　　山道蜿蜒曲折，两旁的松树在风中沙沙作响。马车颠簸着前行，车夫哼着不知名的小调，眼睛却一直盯着前方。',
+    '　　老和尚坐在禅房里敲着木鱼，香炉里的青烟袅袅升起。小沙弥端来一碗清粥，轻轻放在案几上便退了出去。',
+    '　　河边的柳树抽出了新芽，洗衣的妇人们说说笑笑，木槌敲打衣裳的声音传出很远。对岸的渡船正慢慢靠过来。',
+    '　　天亮之后，雨终于停了。街上的积水映着灰白的天色，早起的行人踩着水花匆匆走过，谁也没有回头。',
+]
+_UNFINISHED = [
+    '　　江南三月，桃花开得正盛，渔船在湖面上来来往往，船家的号子声此起彼伏，惊起一群白鹭',
+    '　　将军披甲上马，身后千军万马列阵以待，战鼓擂动，旌旗猎猎，杀气直冲云霄而去，久久不散',
+    '　　书生在灯下苦读，窗外虫鸣阵阵，他揉了揉酸涩的眼睛，提笔在纸上写下一行工整的小楷字迹',
+]
+
+def _draft() -> dict:
+    # 问题段落与正常段落交替，段落块以空行分隔
+    paragraphs = [paragraph for pair in zip(_CLEAN, _UNFINISHED) for paragraph in pair] + _CLEAN[len(_UNFINISHED):]
+    return {'title': '夜雨', 'content': '\n\n'.join(paragraphs), 'summary': '摘要'}
+
+def _paragraphs(text: str) -> list:
+    return [text[start:end] for start, end in paragraph_spans(text)]
+
+def test_draft_failing_only_paragraph_checks_is_patched():
+    reviewer = ContentReviewer()
+    draft = _draft()
+    review = reviewer.review_content(draft, knowledge={})
+
+    assert not review['approved']
+    assert review['failed_checks'] == ['paragraphs']
+    assert review['patchable']
+    flagged = sorted(location['paragraph'] for location in review['issue_locations'])
+    assert flagged == [1, 3, 5]
+
+    assistant = WritingAssistant(use_cache=False)
+    stages = []
+
+    def fake_chat(stage, messages, max_tokens, temperature):
+        stages.append(stage)
+        return '\n'.join(f'段落{index + 1}：第{index + 1}段改写后的内容，补全了结尾。' for index in flagged)
+
+    assistant._chat = fake_chat
+    improved = assistant.improve_content(
+        content=draft,
+        feedback=review['feedback'],
+        knowledge={},
+        issue_locations=review['issue_locations'] if review['patchable'] else None
+    )
+
+    assert stages == ['patch']
+    assert assistant.prompt_stats['improve']['mode'] == 'patch'
+    before, after = _paragraphs(draft['content']), _paragraphs(improved['content'])
+    assert len(after) == len(before)
+    for index, (old, new) in enumerate(zip(before, after)):
+        if index in flagged:
+            # 改写的段落保留原有的段首缩进
+            assert new == f'　　第{index + 1}段改写后的内容，补全了结尾。'
+        else:
+            assert new == old
+    # 段落之外的文本（空行）不变
+    assert improved['content'].count('\n\n') == draft['content'].count('\n\n')
+    assert reviewer.review_content(improved, knowledge={})['approved']
+
+def test_whole_draft_failure_is_not_patched():
+    # 过短的草稿在逻辑检查上失败，改写段落无法修复
+    review = ContentReviewer().review_content({'title': '夜雨', 'content': '\n'.join(_UNFINISHED[:2])}, knowledge={})
+
+    assert not review['approved']
+    assert 'logic' in review['failed_checks']
+    assert review['issue_locations']
+    assert not review['patchable']
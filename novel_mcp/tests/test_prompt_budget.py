@@ -0,0 +1,47 @@
+from src.services.knowledge_packer import MODEL_CONTEXT_WINDOWS
+from src.services.model_router import ModelRouter
+from src.services.writing_assistant import WritingAssistant
+
+def _knowledge() -> dict:
+    # 约两万token的人物资料，超过任何阶段的预算
+    return {
+        'novel': {'id': 1, 'title': '测试小说', 'genre': '武侠'},
+        'characters': [
+            {'id': index, 'name': f'人物{index}', 'description': '性情沉稳，' * 100, 'relevance_score': 1.0 / (index + 1)}
+            for index in range(40)
+        ],
+        'settings': [],
+        'outlines': [],
+        'passages': [],
+        'recent_chapters': []
+    }
+
+def test_each_stage_packs_knowledge_into_its_own_prompt():
+    assistant = WritingAssistant(use_cache=False)
+    assistant._chat = lambda stage, messages, max_tokens, temperature: '标题：夜雨\n正文：改写后的正文。\n摘要：摘要'
+    knowledge = _knowledge()
+
+    assistant.generate_content(knowledge=knowledge, context='主角下山', requirements='')
+    draft = {'title': '夜雨', 'content': '风吹过山谷，没有人说话。' * 500, 'summary': ''}
+    assistant.improve_content(content=draft, feedback='节奏太慢', knowledge=knowledge)
+
+    generate, improve = assistant.packing_reports['generate'], assistant.packing_reports['improve']
+    # 改写阶段的预算扣除了整篇草稿
+    assert generate['budget'] - improve['budget'] >= 5500
+    assert improve['items_packed'] < generate['items_packed']
+    for stage in ('generate', 'improve'):
+        window = MODEL_CONTEXT_WINDOWS[assistant.router.model(stage)]
+        assert assistant.prompt_stats[stage]['total_tokens'] + assistant.router.max_tokens(stage) <= window
+
+def test_pack_fits_the_smaller_fallback_window():
+    assistant = WritingAssistant(use_cache=False)
+    assistant.router = ModelRouter(routes={
+        'generate': {'model': 'gpt-4o', 'fallback': 'gpt-4', 'max_tokens': 2000},
+    })
+    assistant._chat = lambda stage, messages, max_tokens, temperature: '标题：夜雨\n正文：正文。\n摘要：摘要'
+
+    assistant.generate_content(knowledge=_knowledge(), context='主角下山', requirements='')
+
+    # 主模型超时切换到gpt-4时，同一提示词也必须放得下
+    assert assistant.router.context_window('generate') == MODEL_CONTEXT_WINDOWS['gpt-4']
+    assert assistant.prompt_stats['generate']['total_tokens'] + 2000 <= MODEL_CONTEXT_WINDOWS['gpt-4']
@@ -0,0 +1,63 @@
+from collections import Counter
+import pytest
+from src.services.tokenizer import CJKTokenizer, Tokenizer, WordTokenizer, build_signature, decode_signature, term_id
+from src.services.ranking import BM25Ranker
+
+def test_cjk_tokenizer_splits_mixed_text():
+    tokenizer = CJKTokenizer()
+    assert tokenizer.tokenize('李明在长安城') == ['李明', '明在', '在长', '长安', '安城']
+    # 拉丁文字按单词切分并转为小写，单字成段时保留单字
+    assert tokenizer.tokenize('Hello世界, 我 GPT4') == ['hello', '世界', '我', 'gpt4']
+    assert CJKTokenizer((3, 2)).tokenize('青云山') == ['青云', '云山', '青云山']
+    assert tokenizer.tokenize('') == []
+
+def test_word_tokenizer_keeps_cjk_runs_whole():
+    assert WordTokenizer().tokenize('Li Ming 去了长安') == ['li', 'ming', '去了长安']
+
+def test_signature_round_trip():
+    tokens = CJKTokenizer().tokenize('长安城的长安街')
+    assert decode_signature(build_signature(tokens)) == frozenset(term_id(token) for token in tokens)
+    assert decode_signature(None) == frozenset()
+
+def _documents(texts):
+    tokenizer = CJKTokenizer()
+    return {key: Counter(tokenizer.tokenize(text)) for key, text in texts.items()}
+
+def test_bm25_ranks_by_relevance_within_each_type():
+    ranker = BM25Ranker(_documents({
+        ('character', 1): '李明是青云山的剑客',
+        ('character', 2): '王芳住在长安城',
+        ('character', 3): '李明的师父住在青云山下',
+        ('setting', 10): '青云山在长安城以北',
+        ('setting', 11): '东海之滨的渔村',
+    }))
+    query = CJKTokenizer().tokenize('青云山剑客')
+
+    ranked = ranker.top_k(query, {'character': 5, 'setting': 5, 'outline': 3})
+
+    # 同时命中“青云山”与“剑客”的人物排在只命中“青云山”的人物之前
+    assert [entity_id for entity_id, _ in ranked['character']] == [1, 3]
+    # 得分为0的实体不返回，没有该类型的实体时返回空列表
+    assert [entity_id for entity_id, _ in ranked['setting']] == [10]
+    assert ranked['outline'] == []
+    assert [entity_id for entity_id, _ in ranker.top_k(query, {'character': 1})['character']] == [1]
+
+def test_bm25_ties_break_by_id():
+    ranker = BM25Ranker(_documents({
+        ('character', 7): '长安城',
+        ('character', 2): '长安城',
+        ('character', 5): '东海',
+    }))
+    ranked = ranker.top_k(CJKTokenizer().tokenize('长安'), {'character': 3})['character']
+    assert [entity_id for entity_id, _ in ranked] == [2, 7]
+    assert ranked[0][1] == ranked[1][1] > 0
+
+def test_tokenizer_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        Tokenizer()
+
+    class Incomplete(Tokenizer):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
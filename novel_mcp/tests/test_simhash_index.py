@@ -0,0 +1,47 @@
+from src.database_init import db
+from src.models.novel import Novel, Chapter
+from src.services.simhash import simhash
+from src.services.simhash_index import simhash_index
+
+_REPEATED = '夜色沉沉，城门外的老人拄着拐杖慢慢走过长街，灯火在雨里摇晃。'
+_FIRST_ONLY = '少年推开客栈的木门，掌柜抬头看了他一眼，又低头拨弄算盘。'
+_SECOND_ONLY = '山道蜿蜒曲折，两旁的松树在风中沙沙作响，马车颠簸着前行。'
+
+def _chapter(novel_id: int, number: int, paragraphs) -> Chapter:
+    chapter = Chapter(novel_id=novel_id, chapter_number=number, title=f'第{number}章', content='\n'.join(paragraphs))
+    db.session.add(chapter)
+    db.session.flush()
+    simhash_index.index_chapter(chapter, force=True)
+    return chapter
+
+def test_hotspots_count_paragraphs_not_pairs(app):
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+    # 每章同一段落出现两次：跨章节有4个相似段落对，但每章只有2个段落参与重复
+    first = _chapter(novel.id, 1, [_REPEATED, _FIRST_ONLY, _REPEATED])
+    second = _chapter(novel.id, 2, [_REPEATED, _SECOND_ONLY, _REPEATED])
+    db.session.commit()
+
+    hotspots = simhash_index.repetition_hotspots(novel.id)
+
+    assert hotspots == [
+        {'chapters': [1, 2], 'chapter_ids': [first.id, second.id], 'duplicate_paragraphs': 2},
+        {'chapters': [1, 1], 'chapter_ids': [first.id, first.id], 'duplicate_paragraphs': 1},
+        {'chapters': [2, 2], 'chapter_ids': [second.id, second.id], 'duplicate_paragraphs': 1},
+    ]
+
+def test_near_duplicates_exclude_the_chapter_itself(app):
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+    first = _chapter(novel.id, 1, [_FIRST_ONLY, _REPEATED])
+    second = _chapter(novel.id, 2, [_REPEATED])
+    db.session.commit()
+
+    # 过短的段落没有指纹，不参与查找
+    fingerprints = [simhash(_REPEATED), simhash('短句。'), simhash(_SECOND_ONLY)]
+    assert fingerprints[1] is None
+
+    found = simhash_index.find_near_duplicates(novel.id, fingerprints, exclude_chapter_id=second.id)
+    assert found == {0: [{'chapter_id': first.id, 'chapter_number': 1, 'paragraph': 1, 'distance': 0}]}
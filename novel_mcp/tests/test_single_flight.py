@@ -0,0 +1,133 @@
+import threading
+import time
+from src.services.single_flight import SingleFlight
+
+def _wait_until(condition, timeout: float = 5.0) -> None:
+    started = time.monotonic()
+    while not condition():
+        assert time.monotonic() - started < timeout
+        time.sleep(0.01)
+
+def _run_concurrently(flights, key, fn):
+    """第一个调用开始执行后再发起其余调用，返回各调用的 (结果, 是否复用) 或异常"""
+    results = [None] * len(flights)
+
+    def call(index):
+        try:
+            results[index] = flights[index].do(key, fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(len(flights))]
+    threads[0].start()
+    return threads, results
+
+def test_concurrent_calls_execute_once():
+    flight = SingleFlight(window=0, shared=False)
+    gate, executed = threading.Event(), []
+
+    def fn():
+        executed.append(1)
+        gate.wait(5)
+        return {'value': 42}
+
+    threads, results = _run_concurrently([flight] * 5, 'key', fn)
+    _wait_until(lambda: executed)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.coalesced == 4)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(executed) == 1
+    assert results[0] == ({'value': 42}, False)
+    assert results[1:] == [({'value': 42}, True)] * 4
+    assert flight.stats()['in_flight'] == 0
+
+    # 不保留窗口时，完成后的调用重新执行
+    assert flight.do('key', lambda: {'value': 7}) == ({'value': 7}, False)
+
+def test_errors_are_shared_and_not_retained():
+    flight = SingleFlight(window=60, shared=False)
+    gate = threading.Event()
+
+    def fn():
+        gate.wait(5)
+        raise ValueError('失败')
+
+    threads, results = _run_concurrently([flight] * 3, 'key', fn)
+    _wait_until(lambda: flight.stats()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.coalesced == 2)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    # 失败的结果不在窗口内复用
+    assert flight.do('key', lambda: 'ok') == ('ok', False)
+
+def test_window_reuses_finished_result():
+    flight = SingleFlight(window=60, shared=False)
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (1, True)
+    assert flight.do('other', lambda: 3) == (3, False)
+
+def test_shared_mode_coalesces_across_instances(tmp_path):
+    # 两个实例使用同一个SQLite文件，相当于同一主机上的两个工作进程
+    path = str(tmp_path / 'single_flight.db')
+    leader, follower = SingleFlight(window=0, shared=True, path=path), SingleFlight(window=0, shared=True, path=path)
+    gate, executed = threading.Event(), []
+
+    def fn():
+        executed.append(1)
+        gate.wait(5)
+        return {'suggestions': ['甲', '乙']}
+
+    threads, results = _run_concurrently([leader, follower], 'key', fn)
+    _wait_until(lambda: executed)
+    threads[1].start()
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(executed) == 1
+    assert results[0] == ({'suggestions': ['甲', '乙']}, False)
+    assert results[1] == ({'suggestions': ['甲', '乙']}, True)
+    assert follower.stats()['shared_hits'] == 1
+
+def test_shared_waiters_only_read_while_waiting(tmp_path, monkeypatch):
+    path = str(tmp_path / 'single_flight.db')
+    leader, follower = SingleFlight(window=0, shared=True, path=path), SingleFlight(window=0, shared=True, path=path)
+    claims = []
+    claim = SingleFlight._claim
+
+    def counting_claim(self, conn, key, reusable_since):
+        claims.append(self)
+        return claim(self, conn, key, reusable_since)
+
+    monkeypatch.setattr(SingleFlight, '_claim', counting_claim)
+    gate, executed = threading.Event(), []
+
+    def fn():
+        executed.append(1)
+        gate.wait(5)
+        return 'done'
+
+    threads, results = _run_concurrently([leader, follower], 'key', fn)
+    _wait_until(lambda: executed)
+    threads[1].start()
+    time.sleep(0.5)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    # 等待方只在到达时尝试抢占一次，等待期间不写数据库
+    assert claims.count(follower) == 1
+    assert results[1] == ('done', True)
+
+    # 不保留窗口时，已完成的旧结果不被新请求复用
+    assert follower.do('key', lambda: 'again') == ('again', False)
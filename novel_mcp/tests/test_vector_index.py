@@ -0,0 +1,89 @@
+import os
+import time
+from src.database_init import db
+from src.models.novel import Novel, Chapter, Character
+from src.models.knowledge import ChapterChunk
+from src.services import vector_index as vector_module
+from src.services.knowledge_index import KnowledgeIndex
+from src.services.vector_index import VectorIndex
+
+LIMITS = {'character': 5, 'chunk': 50}
+
+def _seed(chapter_count: int):
+    novel = Novel(title='测试小说', description='')
+    db.session.add(novel)
+    db.session.flush()
+    character = Character(novel_id=novel.id, name='李明', description='青云山的剑客')
+    db.session.add(character)
+    index = KnowledgeIndex()
+    for number in range(1, chapter_count + 1):
+        chapter = Chapter(novel_id=novel.id, chapter_number=number, title=f'第{number}章',
+                          content='\n'.join(f'第{number}章第{line}段，李明在长安城外练剑。' * 8 for line in range(4)))
+        db.session.add(chapter)
+        db.session.flush()
+        index.index_chapter(chapter)
+    db.session.commit()
+    return novel.id, character.id
+
+def _chunk_ids(novel_id: int, **filters) -> set:
+    return {row[0] for row in db.session.query(ChapterChunk.id).filter_by(novel_id=novel_id, **filters).all()}
+
+def _found(vectors: VectorIndex, novel_id: int, query: str = '李明在长安城外练剑') -> dict:
+    return {entity_type: {entity_id for entity_id, _ in ranked}
+            for entity_type, ranked in vectors.search(novel_id, [query], LIMITS)[0].items()}
+
+def test_writes_update_only_the_changed_chapter(app, tmp_path, monkeypatch):
+    vectors = VectorIndex(directory=str(tmp_path))
+    monkeypatch.setattr(vector_module, 'vector_index', vectors)
+    novel_id, character_id = _seed(5)
+    assert _found(vectors, novel_id)['chunk'] == _chunk_ids(novel_id)
+    main_stat = os.stat(vectors._index_path(novel_id))
+
+    vectorized = []
+    transform = vectors.vectorizer.transform
+    monkeypatch.setattr(vectors.vectorizer, 'transform', lambda texts: vectorized.append(list(texts)) or transform(texts))
+
+    chapter = Chapter.query.filter_by(novel_id=novel_id, chapter_number=3).first()
+    chapter.content = '王芳在青云山的石阶上等了很久，风吹过山谷。' * 4
+    KnowledgeIndex().index_chapter(chapter)
+    db.session.delete(db.session.get(Character, character_id))
+    db.session.commit()
+
+    found = _found(vectors, novel_id, '王芳在青云山的石阶上等了很久')
+    # 只为改动章节的新段落块计算向量（另一次是查询本身），主索引文件不变
+    assert vectorized[0] == [chunk.content for chunk in ChapterChunk.query.filter_by(chapter_id=chapter.id).order_by(ChapterChunk.id)]
+    assert len(vectorized) == 2
+    assert os.stat(vectors._index_path(novel_id)).st_mtime_ns == main_stat.st_mtime_ns
+    assert found['chunk'] & _chunk_ids(novel_id, chapter_id=chapter.id)
+    assert found['chunk'] <= _chunk_ids(novel_id)
+    assert found['character'] == set()
+
+    # 只改标题时段落块内容不变，直接复用已有向量
+    vectorized.clear()
+    chapter.title = '改过的标题'
+    db.session.commit()
+    assert _found(vectors, novel_id) == {'character': set(), 'chunk': _chunk_ids(novel_id)}
+    assert len(vectorized) == 1
+
+def test_delta_is_compacted_in_background(app, tmp_path, monkeypatch):
+    vectors = VectorIndex(directory=str(tmp_path))
+    vectors.COMPACT_MIN_ROWS = 0
+    monkeypatch.setattr(vector_module, 'vector_index', vectors)
+    novel_id, _ = _seed(4)
+    before = vectors.search(novel_id, ['李明在长安城外练剑'], LIMITS)
+
+    chapter = Chapter.query.filter_by(novel_id=novel_id, chapter_number=2).first()
+    chapter.content += '\n次日清晨，李明离开了长安城，再也没有回来。'
+    KnowledgeIndex().index_chapter(chapter)
+    db.session.commit()
+    during = vectors.search(novel_id, ['李明在长安城外练剑'], LIMITS)
+
+    started = time.monotonic()
+    while os.path.exists(vectors._delta_path(novel_id)):
+        assert time.monotonic() - started < 5
+        time.sleep(0.01)
+    after = vectors.search(novel_id, ['李明在长安城外练剑'], LIMITS)
+
+    assert {entity_id for entity_id, _ in during[0]['chunk']} == _chunk_ids(novel_id)
+    assert after == during
+    assert during != before